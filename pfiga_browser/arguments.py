@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Command line interface of the pfiga-browser program.
+
+`build_parser`: Create the argument parser for the `pfiga-browser` command.
+
+`build_server_parser`: Create the argument parser for the query server commands (`serve` and `query`).
+
+`default_options`: Options as parsed from the command line, for calling the program from Python.
+
+`read_manifest`: Read the index paths listed in a manifest file.
+"""
+# python level imports
+from typing import Any, List
+from pathlib import Path
+from argparse import ArgumentParser, Namespace
+
+
+def build_parser() -> ArgumentParser:
+    """
+    Create the argument parser for the `pfiga-browser` command.
+
+    :returns: Argument parser. `parse_args` returns a namespace with one attribute per option.
+    """
+    argparser = ArgumentParser(prog="pfiga-browser",
+                               description="Track images and readmes of one or more pfiga projects and update the readmes.",
+                               epilog="To keep scans in memory and query them, see 'python -m pfiga_browser.server {serve,query} --help'.")
+    argparser.add_argument("index", nargs="*",
+                           help="index file of a project (can be repeated to process several projects in one run)")
+    argparser.add_argument("--manifest", action="append", default=[], metavar="FILE",
+                           help="file listing index paths, one per line (relative paths are relative to the manifest, '#' starts a comment)")
+    argparser.add_argument("--jobs", type=int, default=None, metavar="N",
+                           help="number of projects processed at the same time (default: all of them)")
+    argparser.add_argument("--use-maxdepth", action="store_true",
+                           help="stop following toctrees at each toctree's :maxdepth: (readmes beyond it are listed in the report and their directories are not scanned)")
+    argparser.add_argument("--check", action="store_true",
+                           help="only check the project, never modify files; exit with UNTRACKED (3) or MISSING (4) at the first problem")
+    argparser.add_argument("--all", action="store_true",
+                           help="with --check, report all problems instead of stopping at the first one")
+    argparser.add_argument("--changed-only", action="store_true",
+                           help="only process directories with uncommitted or untracked changes (requires a git repository)")
+    argparser.add_argument("--since", default=None, metavar="REV",
+                           help="only process directories that changed since git revision REV (implies --changed-only)")
+    argparser.add_argument("--progress", action="store_true",
+                           help="show directories walked per second, readmes parsed, images verified, files written, and an estimate of the time left on stderr")
+    argparser.add_argument("--low-memory", action="store_true",
+                           help="compare found and tracked files through sorted runs on disk instead of in memory (for very large trees); "
+                                "disables the early exit of --check: untracked files are only found after the whole tree was walked")
+    argparser.add_argument("--time-budget", type=float, default=None, metavar="SECONDS",
+                           help="process the most recently modified directories first and stop after about SECONDS, leaving the rest for the next full run (ignored with --changed-only/--since)")
+    argparser.add_argument("--resume", action="store_true",
+                           help="continue an interrupted run: readmes and directories that did not change since are not parsed or listed again")
+    argparser.add_argument("--cache-dir", default=None,
+                           help="directory to store caches in (default: $XDG_CACHE_HOME/pfiga_browser)")
+    argparser.add_argument("--thumbnails", action="store_true",
+                           help="generate thumbnails for PNG images and link new readme entries to the originals")
+    argparser.add_argument("--thumbnail-dir", default=None,
+                           help="directory to store thumbnails in (default: _thumbnails next to the index)")
+    argparser.add_argument("--gallery", default=None, metavar="DIR",
+                           help="write a static HTML gallery of all second level readmes to DIR (rebuilt incrementally)")
+    argparser.add_argument("--report", action="append", default=[], choices=["duplicates", "near-duplicates"],
+                           help="print an additional report about the images in the project (can be repeated)")
+    argparser.add_argument("--max-distance", type=int, default=6,
+                           help="maximum number of differing hash bits (out of 64) for images to count as near-duplicates")
+    return argparser
+
+
+def build_server_parser() -> ArgumentParser:
+    """
+    Create the argument parser for the query server commands (see `server.py`): `serve` keeps scans in memory and answers
+    queries, `query` is its client. The namespace's `subcommand` attribute names the command given.
+
+    :returns: Argument parser.
+    """
+    argparser = ArgumentParser(prog="python -m pfiga_browser.server",
+                               description="Keep scans of pfiga projects in memory and answer queries about them.")
+    subparsers = argparser.add_subparsers(dest="subcommand", metavar="{serve,query}", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="scan projects and answer queries about them over a Unix domain socket",
+                                         description="Scan projects and answer queries about them over a Unix domain socket.")
+    serve_parser.add_argument("index", nargs="+", help="index file of a project to serve")
+    serve_parser.add_argument("--socket", default=None,
+                              help="socket to listen on (default: $XDG_RUNTIME_DIR/pfiga_browser.sock)")
+    serve_parser.add_argument("--cache-dir", default=None,
+                              help="directory to store caches in (default: $XDG_CACHE_HOME/pfiga_browser)")
+
+    query_parser = subparsers.add_parser("query", help="query a running server (or scan the project directly) and print JSON",
+                                         description="Query a running server, or scan the project directly if none is running. Prints JSON.")
+    query_parser.add_argument("command", choices=["status", "untracked", "images", "search", "rescan", "apply", "shutdown"])
+    query_parser.add_argument("argument", nargs="?", default=None,
+                              help="folder for 'images', text for 'search', subtree for 'rescan'")
+    query_parser.add_argument("--index", default=None,
+                              help="project to query (default: the first one served; required if no server is running)")
+    query_parser.add_argument("--socket", default=None,
+                              help="socket of the server (default: $XDG_RUNTIME_DIR/pfiga_browser.sock)")
+    query_parser.add_argument("--cache-dir", default=None,
+                              help="cache directory to use if no server is running")
+    return argparser
+
+
+def default_options(**overrides: Any) -> Namespace:
+    """
+    Return the options the command line parser produces without any arguments, with some of them overridden.
+
+    :param overrides: Options to override, named like the attributes of the parsed namespace (e.g. `check=True`, `cache_dir="..."`).
+
+    :raises TypeError: if an override is not a known option.
+
+    :returns: Namespace of options.
+    """
+    options = build_parser().parse_args([])
+    for name, value in overrides.items():
+        if not hasattr(options, name):
+            raise TypeError("unknown option: '%s'" % name)
+        setattr(options, name, value)
+    return options
+
+
+def read_manifest(path: Path) -> List[Path]:
+    """
+    Read the index paths listed in a manifest file.
+
+    Each non-empty line holds one path. Everything after a '#' is ignored. Relative paths are relative to the manifest's directory.
+
+    :param path: Path to the manifest file.
+
+    :raises FileNotFoundError: if the manifest does not exist.
+
+    :returns: List of absolute index paths, in the order they are listed.
+    """
+    indexes: List[Path] = []
+
+    with path.open("r") as f_manifest:
+        for line in f_manifest:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                indexes.append(path.parent.joinpath(line).absolute())
+
+    return indexes
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+asyncio interface to the scanner, for calling it from an event loop (e.g. a web dashboard) without blocking it.
+
+Projects are processed by the same `process_index` function as the command line program, in worker threads started with
+`asyncio.to_thread`. Progress reported by the worker threads is handed to the event loop and yielded as `ScanEvent` objects.
+
+`ScanEvent`: A progress event of a scan.
+
+`scan_async`: Scan one or more projects and yield progress events.
+"""
+# python level imports
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Iterable, List, Optional, Union
+from pathlib import Path
+# pfiga-browser level imports
+from pfiga_browser.arguments import default_options
+from pfiga_browser.cache import default_cache_dir
+from pfiga_browser.pfiga_browser import ProjectReport, RunContext, process_index
+
+
+class ScanEvent(object):
+    """
+    A progress event of a scan.
+
+    `kind`: 'readme' (a readme was parsed), 'image' (an image was verified), 'directory' (a directory was scanned), 'write' (a readme was written), or 'done' (a project was processed).
+
+    `index`: Index file of the project the event belongs to.
+
+    `path`: Readme, image, or directory the event is about. The index for 'done' events.
+
+    `report`: Report of the project for 'done' events, None otherwise (or if processing the project failed).
+
+    `error`: Exception processing the project raised, for 'done' events. None otherwise.
+    """
+
+    kind: str
+
+    index: Path
+
+    path: Path
+
+    report: Optional[ProjectReport]
+
+    error: Optional[BaseException]
+
+    def __init__(self, kind: str, index: Path, path: Path, report: Optional[ProjectReport] = None,
+                 error: Optional[BaseException] = None):
+        """
+        Initialize with the kind of event and what it is about.
+
+        :param kind: Kind of event.
+
+        :param index: Index file of the project.
+
+        :param path: Readme or directory the event is about.
+
+        :param report: Optional. Report of the project ('done' events only).
+
+        :param error: Optional. Exception processing the project raised ('done' events only).
+        """
+        self.kind = kind
+        self.index = index
+        self.path = path
+        self.report = report
+        self.error = error
+
+    def __repr__(self) -> str:
+        """Return a short representation of the event for debugging."""
+        return "ScanEvent(%s, '%s')" % (self.kind, self.path)
+
+
+async def scan_async(index: Union[Path, str, Iterable[Union[Path, str]]], concurrency: int = 4,
+                     context: Optional[RunContext] = None, **options: Any) -> AsyncIterator[ScanEvent]:
+    """
+    Scan (and, unless `check=True` is given, update) one or more projects without blocking the event loop.
+
+    At most `concurrency` projects are processed at the same time, each in its own worker thread. `concurrency` only
+    bounds the number of projects: the CPU-bound work of all projects (thumbnails, perceptual hashes) shares the worker
+    pools of `context`, whose size is set by `RunContext.workers`.
+
+    Cancelling the task iterating over the events (or closing the iterator early) cancels the scan: the worker threads stop
+    at their next readme or directory, and the iterator returns once they have stopped. Each scan has its own cancel event,
+    so cancelling one scan does not affect other scans (or later ones) sharing `context`.
+
+    Usage::
+
+        async for event in scan_async("docs/index.rst", check=True):
+            if event.kind == "done":
+                print(event.report.exit_code)
+
+    :param index: Index file of a project, or several index files.
+
+    :param concurrency: Optional. Maximum number of projects processed at the same time (not the number of threads or
+        processes the projects use). Defaults to 4.
+
+    :param context: Optional. Shared state to use (caches, worker pools). A new one is created and closed (saving the caches) by default.
+
+    :param options: Options as accepted on the command line, e.g. `check=True`, `cache_dir="..."`, `report=["duplicates"]`. See `arguments.default_options`.
+
+    :raises TypeError: if an option is unknown.
+
+    :raises Exception: the first exception raised while processing a project, once all projects are done.
+
+    :returns: Async iterator over progress events. One 'done' event is yielded per project, also for projects that failed (see `ScanEvent.error`).
+    """
+    indexes: List[Path] = [Path(index).absolute()] if isinstance(index, (Path, str)) else [
+        Path(path).absolute() for path in index]
+    args = default_options(**options)
+    owns_context = context is None
+    if context is None:
+        context = RunContext(Path(args.cache_dir) if args.cache_dir else default_cache_dir())
+
+    loop = asyncio.get_running_loop()
+    queue: "asyncio.Queue[ScanEvent]" = asyncio.Queue()
+    semaphore = asyncio.Semaphore(concurrency)
+    cancel = threading.Event()
+
+    async def run_project(project: Path) -> None:
+        def progress(kind: str, path: Path) -> None:
+            # called from the worker thread; the queue may only be used from the event loop
+            loop.call_soon_threadsafe(queue.put_nowait, ScanEvent(kind, project, path))
+
+        report: Optional[ProjectReport] = None
+        error: Optional[BaseException] = None
+        try:
+            async with semaphore:
+                report = await asyncio.to_thread(process_index, project, args, context, progress, cancel=cancel)
+        except BaseException as ex:
+            error = ex
+            raise
+        finally:
+            # always sent (the queue is unbounded), so the iterator does not wait forever for a project that failed
+            queue.put_nowait(ScanEvent("done", project, project, report, error))
+
+    tasks = [asyncio.create_task(run_project(project)) for project in indexes]
+    remaining = len(tasks)
+
+    try:
+        while remaining:
+            event = await queue.get()
+            if event.kind == "done":
+                remaining -= 1
+            yield event
+        # re-raise errors of the worker threads
+        await asyncio.gather(*tasks)
+    finally:
+        if remaining:
+            # worker threads cannot be interrupted; tell them to stop and wait until they have
+            cancel.set()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if owns_context:
+            await asyncio.to_thread(context.close)
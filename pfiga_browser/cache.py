@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+Persistent caches for per-file data (image dimensions, content hashes, etc.) that are invalidated when the file changes on disk.
+
+The files in the cache directory are shared by every pfiga-browser process using it, so they are never simply overwritten:
+a cache is saved by merging its changes into the file on disk while holding the cache's lock (`cache_lock`), and written
+atomically (`write_json`).
+"""
+# python level imports
+import os
+import json
+import mmap
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Any, Set, Union
+from pathlib import Path
+
+# files larger than this are hashed through a memory map instead of being read in chunks
+HASH_CHUNK_SIZE = 1 << 20
+
+# version of the format of the cache files; caches written with another version are rebuilt
+CACHE_VERSION = 2
+
+# records of files that were not looked at for this many days (e.g. deleted files) are dropped when a cache is saved
+CACHE_MAX_AGE_DAYS = 30
+
+
+def cache_day() -> int:
+    """
+    Return the current day, the granularity at which cache records remember when they were last used.
+
+    :returns: Days since the epoch.
+    """
+    return int(time.time() // 86400)
+
+
+def default_cache_dir() -> Path:
+    """
+    Return the directory the program stores its caches in.
+
+    Uses `PFIGA_BROWSER_CACHE` if it is set, otherwise `$XDG_CACHE_HOME/pfiga_browser` (or `~/.cache/pfiga_browser`).
+
+    :returns: Path to the cache directory (may not exist yet).
+    """
+    if os.environ.get("PFIGA_BROWSER_CACHE"):
+        return Path(os.environ["PFIGA_BROWSER_CACHE"])
+
+    cache_home = os.environ.get("XDG_CACHE_HOME", "")
+    if cache_home:
+        return Path(cache_home).joinpath("pfiga_browser")
+    return Path.home().joinpath(".cache", "pfiga_browser")
+
+
+def index_digest(index: Path) -> str:
+    """
+    Return a short digest of the path of a project index, used to name the per-project files in the cache directory (e.g. journals).
+
+    :param index: Index file of the project.
+
+    :returns: First 16 hex digits of the SHA-1 of the path.
+    """
+    return hashlib.sha1(str(index).encode("utf-8")).hexdigest()[:16]
+
+
+@contextmanager
+def cache_lock(path: Path) -> Iterator[None]:
+    """
+    Hold an exclusive lock on a file in the cache directory (through a `.lock` file next to it) until the block is left.
+
+    :param path: Path to the cache file (may not exist yet).
+
+    :returns: Context manager.
+    """
+    # imported here since `locking` uses `file_stamp`
+    from pfiga_browser.locking import locked
+
+    lock_path = path.with_name(path.name + ".lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    lock_path.touch(exist_ok=True)
+    with locked(lock_path):
+        yield
+
+
+def read_json(path: Path) -> Optional[Any]:
+    """
+    Read a JSON file from the cache directory.
+
+    :param path: Path to the file.
+
+    :returns: Decoded contents, or None if the file does not exist or is corrupt.
+    """
+    try:
+        with path.open("r") as f_cache:
+            return json.load(f_cache)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path: Path, data: Any) -> None:
+    """
+    Write a JSON file to the cache directory. Written to a temporary file first so an interrupted write never corrupts the file.
+
+    :param path: Path to the file.
+
+    :param data: Data to write.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".%d.%d.tmp" % (os.getpid(), threading.get_ident()))
+    with tmp_path.open("w") as f_cache:
+        json.dump(data, f_cache, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def file_stamp(path: Union[Path, str], stat: Optional[os.stat_result] = None) -> str:
+    """
+    Create a key that identifies the current contents of a file without reading it: (inode, mtime, size).
+
+    :param path: Path to the file.
+
+    :param stat: Optional. Result of a previous `stat` call on `path`, saves a system call if available.
+
+    :returns: String of the form 'inode:mtime:size'.
+    """
+    if stat is None:
+        stat = os.stat(path)
+    return "%d:%d:%d" % (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class StatCache(object):
+    """
+    Cache of records (dictionaries) about files, keyed by path and validated by the (inode, mtime, size) stamp of the file. See `file_stamp`.
+
+    A file that is modified gets a new stamp, so stale records are never returned; its record is replaced, so every file has
+    at most one record. Records also hold the stamp ('stamp') and the day they were last used ('seen', see `cache_day`);
+    records not used for `CACHE_MAX_AGE_DAYS` are dropped when the cache is saved. Saving merges the records this process
+    added or used into the file, so records other processes saved in the meantime are kept.
+
+    `path`: Path to the JSON file the cache is persisted to. None if the cache only lives in memory.
+
+    `entries`: Map of file paths to records.
+    """
+
+    path: Optional[Path]
+
+    entries: Dict[str, Dict[str, Any]]
+
+    def __init__(self, path: Optional[Path] = None):
+        """
+        Initialize the cache, loading existing entries from `path` if it exists.
+
+        :param path: Optional. JSON file to load from and save to.
+        """
+        self.path = path
+        self.entries = {}
+        # keys of the records added or used since the cache was loaded or saved
+        self._changed: Set[str] = set()
+        self._lock = threading.Lock()
+        self._today = cache_day()
+
+        if path is not None:
+            self.entries = self._read_entries(path)
+
+    @staticmethod
+    def _read_entries(path: Path) -> Dict[str, Dict[str, Any]]:
+        """
+        Read the records saved to a cache file.
+
+        :param path: Path to the cache file.
+
+        :returns: Map of file paths to records; empty if the file does not exist, is corrupt (it is simply rebuilt), or has another version.
+        """
+        cache = read_json(path)
+        if isinstance(cache, dict) and cache.get("version") == CACHE_VERSION and isinstance(cache.get("entries"), dict):
+            return cache["entries"]
+        return {}
+
+    def get(self, path: Union[Path, str], stat: Optional[os.stat_result] = None) -> Optional[Dict[str, Any]]:
+        """
+        Return the record for the current version of `path`.
+
+        :param path: Path to the file.
+
+        :param stat: Optional. Result of a previous `stat` call on `path`.
+
+        :returns: The record for the file or None if there is no (up to date) record.
+        """
+        record = self.entries.get(str(path))
+        if record is None or record.get("stamp") != file_stamp(path, stat):
+            return None
+        if record.get("seen") != self._today:
+            # at most one write per day for records that are only read
+            with self._lock:
+                record["seen"] = self._today
+                self._changed.add(str(path))
+        return record
+
+    def update(self, path: Union[Path, str], values: Dict[str, Any], stat: Optional[os.stat_result] = None) -> Dict[str, Any]:
+        """
+        Merge `values` into the record for the current version of `path`.
+
+        :param path: Path to the file.
+
+        :param values: Fields to add/overwrite in the record.
+
+        :param stat: Optional. Result of a previous `stat` call on `path`.
+
+        :returns: The updated record.
+        """
+        stamp = file_stamp(path, stat)
+        with self._lock:
+            record = self.entries.get(str(path))
+            if record is None or record.get("stamp") != stamp:
+                record = self.entries[str(path)] = {"stamp": stamp}
+            record.update(values)
+            record["seen"] = self._today
+            self._changed.add(str(path))
+        return record
+
+    def save(self) -> None:
+        """
+        Merge the records added or used since the cache was loaded into `path` (if any), dropping records that were not used
+        for `CACHE_MAX_AGE_DAYS`. The cache then also holds the records other processes saved.
+        """
+        if self.path is None or not self._changed:
+            return
+
+        with self._lock, cache_lock(self.path):
+            entries = self._read_entries(self.path)
+            entries.update({key: self.entries[key] for key in self._changed if key in self.entries})
+            oldest = self._today - CACHE_MAX_AGE_DAYS
+            self.entries = {key: record for key, record in entries.items() if record.get("seen", 0) >= oldest}
+            write_json(self.path, {"version": CACHE_VERSION, "entries": self.entries})
+            self._changed = set()
+
+
+def content_hash(path: Path, cache: Optional[StatCache] = None) -> str:
+    """
+    Return the SHA-256 hash of the file at `path`.
+
+    Small files are read in one go, large files are hashed through a memory map. The result is stored in the 'sha256' field
+    of the file's record in `cache` so unchanged files are only hashed once.
+
+    :param path: Path to the file to hash.
+
+    :param cache: Optional. Cache to look up and store the hash in.
+
+    :returns: Hex digest of the file contents.
+    """
+    stat = path.stat()
+    if cache is not None:
+        record = cache.get(path, stat)
+        if record is not None and "sha256" in record:
+            return record["sha256"]
+
+    with path.open("rb") as f_file:
+        if stat.st_size > HASH_CHUNK_SIZE:
+            with mmap.mmap(f_file.fileno(), 0, access=mmap.ACCESS_READ) as f_map:
+                digest = hashlib.sha256(f_map).hexdigest()
+        else:
+            digest = hashlib.sha256(f_file.read()).hexdigest()
+
+    if cache is not None:
+        cache.update(path, {"sha256": digest}, stat)
+    return digest
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+"""
+Checkpoint journal that lets an interrupted run of a large project resume where it stopped.
+
+While a project is processed, the results of the walk and parse phases (the toctree entries and images of each parsed readme,
+and the subdirectories, readmes, and images of each scanned directory) are appended to a journal in the cache directory. With
+`--resume`, a readme or directory whose (inode, mtime, size) stamp still matches its journal record is not parsed or listed
+again. The journal is removed once the project was processed completely.
+
+The journal is a JSON lines file with one compact array per record, so appending is cheap and a record cut short by a crash
+is simply ignored. Records are buffered and written every `FLUSH_RECORDS` records or `FLUSH_INTERVAL` seconds, whichever
+comes first; at most that much work is repeated after a crash.
+
+`Journal`: Checkpoint journal of a single project.
+
+`journal_path`: Path of the journal of a project.
+"""
+# python level imports
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+from pathlib import Path
+# pfiga-browser level imports
+from pfiga_browser.cache import cache_lock, file_stamp, index_digest
+from pfiga_browser.imageinfo import Image, ImageCollection
+from pfiga_browser.locking import FileVersion
+
+# version of the record format; journals written with another version are ignored
+JOURNAL_VERSION = 2
+
+# number of buffered records that triggers a write
+FLUSH_RECORDS = 512
+
+# seconds after which buffered records are written even if there are only a few
+FLUSH_INTERVAL = 2.0
+
+
+def journal_path(cache_dir: Path, index: Path) -> Path:
+    """
+    Return the path of the journal of a project.
+
+    :param cache_dir: Directory the caches are stored in.
+
+    :param index: Index file of the project.
+
+    :returns: Path to the journal (may not exist).
+    """
+    return cache_dir.joinpath("journals", "%s.jsonl" % (index_digest(index)))
+
+
+class Journal(object):
+    """
+    Checkpoint journal of a single project. Not thread safe; a project is processed by one thread.
+
+    `path`: Path to the journal file.
+
+    `index`: Index file of the project.
+
+    `readmes`: Map of readme paths to their records from the previous run (only filled when resuming).
+
+    `directories`: Map of directory paths to their records from the previous run (only filled when resuming).
+
+    `reused`: Number of records of the previous run that were still up to date and used instead of repeating the work.
+    """
+
+    path: Path
+
+    index: Path
+
+    readmes: Dict[str, List[Any]]
+
+    directories: Dict[str, List[Any]]
+
+    reused: int
+
+    def __init__(self, path: Path, index: Path, resume: bool = False):
+        """
+        Open the journal, loading the records of the previous run if resuming and starting a new journal otherwise.
+
+        :param path: Path to the journal file.
+
+        :param index: Index file of the project.
+
+        :param resume: Optional. Whether to use the records of the previous run. False by default.
+        """
+        self.path = path
+        self.index = index
+        self.readmes = {}
+        self.directories = {}
+        self.reused = 0
+        self._buffer: List[str] = []
+        self._flushed = time.monotonic()
+        self._partial = False
+
+        if resume and path.is_file():
+            self._load()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # the records of the previous run are kept (appended to) so a run that is interrupted again loses nothing
+        self._file = path.open("a" if self.readmes or self.directories else "w")
+        if self._file.tell() == 0:
+            self._write(["journal", JOURNAL_VERSION, str(index)])
+        elif self._partial:
+            # terminate the incomplete last record so it does not swallow the next one
+            self._file.write("\n")
+
+    def readme(self, path: Path) -> Optional[Tuple[List[Path], Dict[Path, Optional[int]], ImageCollection, FileVersion]]:
+        """
+        Return the parse result of a readme recorded by the previous run, if the readme has not changed since.
+
+        :param path: Normalized absolute path to the readme.
+
+        :returns: Tuple of toctree entries, their `:maxdepth:` options, images (see `ReadmeDocumentParser.parse`), and the version of the readme that was parsed, or None.
+        """
+        record = self.readmes.get(str(path))
+        if record is None or not self._unchanged(path, record[2]):
+            return None
+
+        self.reused += 1
+        children = [Path(child) for child in record[3]]
+        collection = ImageCollection()
+        for uri, name, description, width, thumbnail in record[5]:
+            image = Image(uri, description=description, width=width, thumbnail=thumbnail)
+            image.name = name
+            collection.add(image)
+        return (children, dict(zip(children, record[4])), collection, FileVersion(record[2], record[6]))
+
+    def record_readme(self, path: Path, version: FileVersion, children: List[Path], maxdepths: Dict[Path, Optional[int]],
+                      collection: ImageCollection) -> None:
+        """
+        Record the parse result of a readme.
+
+        :param path: Normalized absolute path to the readme.
+
+        :param version: Version of the readme that was parsed.
+
+        :param children: Toctree entries of the readme.
+
+        :param maxdepths: `:maxdepth:` option of each entry.
+
+        :param collection: Images described in the readme.
+        """
+        self._append(["r", str(path), version.stamp, [str(child) for child in children],
+                      [maxdepths.get(child) for child in children],
+                      [[image.uri, image.name, image.description, image.width, image.thumbnail]
+                       for image in collection.collection], version.digest])
+
+    def directory(self, path: Path) -> Optional[Tuple[List[str], List[str]]]:
+        """
+        Return the listing of a directory recorded by the previous run, if no entries were added to or removed from it since.
+
+        :param path: Absolute path to the directory.
+
+        :returns: Tuple of the names of its subdirectories and of its readmes and images, or None.
+        """
+        record = self.directories.get(str(path))
+        if record is None or not self._unchanged(path, record[2]):
+            return None
+
+        # each directory is only looked up once per run
+        del self.directories[str(path)]
+        self.reused += 1
+        return (record[3], record[4])
+
+    def record_directory(self, path: Path, subdirs: List[str], files: List[str]) -> None:
+        """
+        Record the listing of a scanned directory.
+
+        :param path: Absolute path to the directory.
+
+        :param subdirs: Names of its subdirectories.
+
+        :param files: Names of its readmes and images.
+        """
+        self._append(["d", str(path), self._stamp(path), subdirs, files])
+
+    def flush(self) -> None:
+        """Write the buffered records."""
+        if self._buffer:
+            # several runs of the same project append to the same journal; records must not interleave
+            with cache_lock(self.path):
+                self._file.write("".join(self._buffer))
+                self._file.flush()
+            self._buffer = []
+        self._flushed = time.monotonic()
+
+    def close(self, complete: bool = False) -> None:
+        """
+        Write the buffered records and close the journal.
+
+        :param complete: Optional. Whether the project was processed completely, in which case the journal is removed.
+        """
+        self.flush()
+        self._file.close()
+        if complete:
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _load(self) -> None:
+        """Load the records of the previous run. A journal of another project or format version is ignored."""
+        with self.path.open("r") as f_journal:
+            for line in f_journal:
+                self._partial = not line.endswith("\n")
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last record of an interrupted run may be incomplete
+                    continue
+                if record[0] == "journal":
+                    if record[1] != JOURNAL_VERSION or record[2] != str(self.index):
+                        self.readmes = {}
+                        self.directories = {}
+                        return
+                elif record[0] == "r":
+                    self.readmes[record[1]] = record
+                elif record[0] == "d":
+                    self.directories[record[1]] = record
+
+    def _append(self, record: List[Any]) -> None:
+        """
+        Buffer a record, writing the buffer if it is full or old enough.
+
+        :param record: Record to add.
+        """
+        self._buffer.append(json.dumps(record, separators=(",", ":")) + "\n")
+        if len(self._buffer) >= FLUSH_RECORDS or time.monotonic() - self._flushed >= FLUSH_INTERVAL:
+            self.flush()
+
+    def _write(self, record: List[Any]) -> None:
+        """
+        Write a record immediately.
+
+        :param record: Record to write.
+        """
+        self._buffer.append(json.dumps(record, separators=(",", ":")) + "\n")
+        self.flush()
+
+    @staticmethod
+    def _stamp(path: Union[Path, str]) -> Optional[str]:
+        """
+        Return the stamp of a file or directory, or None if it no longer exists.
+
+        :param path: Path to stamp.
+
+        :returns: Stamp. See `cache.file_stamp`.
+        """
+        try:
+            return file_stamp(path)
+        except OSError:
+            return None
+
+    def _unchanged(self, path: Path, stamp: Optional[str]) -> bool:
+        """
+        Return true if `path` still has the recorded stamp.
+
+        :param path: Path to check.
+
+        :param stamp: Recorded stamp.
+
+        :returns: True if the record is up to date.
+        """
+        return stamp is not None and self._stamp(path) == stamp
@@ -1,8 +1,13 @@
 #!/usr/bin/env python
 """Directory walker class and associated functions for efficiently searching through directories and finding files matching specified patterns."""
 # python level import
-from typing import List, Union, Dict
+import os
+import threading
+from typing import Callable, Iterator, List, Optional, Tuple, Union, Dict
 from pathlib import Path
+# pfiga-browser level imports
+from pfiga_browser.error import OperationCancelledError
+from pfiga_browser.filesystem import LOCAL, FileSystem
 
 
 class DirectoryWalker(object):
@@ -14,30 +19,70 @@ class DirectoryWalker(object):
     `scanned_paths`: List of absolute file paths to directories found within the project(s) (specified in the project index)
 
     `root`: The root directory that the walker is in charge of analyzing.
+
+    `cancel`: Event that stops the walk when set. None if the walk cannot be cancelled.
+
+    `fs`: File system the directories are on (the local disk, an archive, ...). See `filesystem.py`.
     """
 
     scanned_paths: List[Path]
 
     root: Path
 
-    def __init__(self, root: Union[Path, str]):
+    cancel: Optional[threading.Event]
+
+    fs: FileSystem
+
+    def __init__(self, root: Union[Path, str], cancel: Optional[threading.Event] = None, fs: Optional[FileSystem] = None):
         """
         Initialize directory walker with root path to start searching from.
 
         :param root: Top-most level of the director(y/ies) to walk through.
+
+        :param cancel: Optional. Event that stops the walk when set (checked once per directory).
+
+        :param fs: Optional. File system to walk. The local disk by default.
         """
+        self.fs = fs if fs is not None else LOCAL
+
         # if the root path is a string, make a path from it
         if not isinstance(root, Path):
             root = Path(root)
 
         # validate the directory/path
-        if root.exists() and root.is_dir():
+        if self.fs.is_dir(root):
             self.root = root
         else:
             # TODO create more specific error/exception object for this case?
             raise FileNotFoundError()
 
         self.scanned_paths = []
+        self.cancel = cancel
+
+    def iter_dirs(self, subdirs: Optional[Callable[[Path], Optional[List[str]]]] = None) -> Iterator[Path]:
+        """
+        Yield the root path and all of its subdirectories (sorted, parents before children) as they are found.
+
+        Unlike `recurse_dirs`, directories can be processed while the walk continues and the walk can stop early.
+
+        :param subdirs: Optional. Called (after the caller processed a directory) with the directory; returns the names of its subdirectories if they are already known (e.g. from `list_directory` or a checkpoint journal), or None to list the directory.
+
+        :raises OperationCancelledError: if `cancel` is set during the walk.
+
+        :returns: Iterator over absolute directory paths.
+        """
+        stack: List[Path] = [self.root]
+
+        while stack:
+            self._check_cancelled()
+            path = stack.pop()
+            yield path
+            names = subdirs(path) if subdirs is not None else None
+            if names is None:
+                # scandir entries know whether they are directories without another stat call
+                names = [entry.name for entry in self.fs.scandir(path) if entry.is_dir()]
+            # push in reverse so directories are yielded in sorted order
+            stack.extend(path.joinpath(name) for name in sorted(names, reverse=True))
 
     def recurse_dirs(self) -> List[Path]:
         """
@@ -86,9 +131,9 @@ class DirectoryWalker(object):
         readme_paths: List[Path] = []
 
         for path in self.scanned_paths:
-            for item in path.iterdir():
-                if item.name == name and item.is_file():
-                    readme_paths.append(item)
+            for entry in self.fs.scandir(path):
+                if entry.name == name and entry.is_file():
+                    readme_paths.append(path.joinpath(entry.name))
 
         # sort for consistency in output later
         readme_paths.sort()
@@ -136,20 +181,48 @@ class DirectoryWalker(object):
         :raises: FileNotFoundError if `path` does not exist on the system. PathNotADirectoryError if `path` is not a directory.
         """
         # validate path
-        if not path.exists():
+        if not self.fs.exists(path):
             raise FileNotFoundError()
-        if not path.is_dir():
+        if not self.fs.is_dir(path):
             raise PathNotADirectoryError()
 
         collection: List[Path] = []
 
         # check the extension of each file in the directory and add to the collection if it's one of the file types specified
-        for item in path.iterdir():
-            if item.is_file() and item.suffix in exts:
-                collection.append(item.absolute())
+        for entry in self.fs.scandir(path):
+            if entry.is_file() and os.path.splitext(entry.name)[1] in exts:
+                collection.append(path.joinpath(entry.name).absolute())
 
         return collection
 
+    def list_directory(self, path: Path, names: List[str] = [],
+                       exts: List[str] = [".jpg", ".png", ".svg"]) -> Tuple[List[str], List[str]]:
+        """
+        List the subdirectories of `path` and the files in it that are named `names` or match `exts`, with a single `scandir` call.
+
+        :param path: Directory to list.
+
+        :param names: (optional) File names to find (e.g. readme names).
+
+        :param exts: (optional) Image extensions to search for. By default: '.jpg', '.png', '.svg'
+
+        :returns: Tuple of the sorted names of the subdirectories and the sorted names of the matching files.
+
+        :raises: FileNotFoundError if `path` does not exist on the system.
+        """
+        subdirs: List[str] = []
+        files: List[str] = []
+
+        for entry in self.fs.scandir(path):
+            if entry.is_dir():
+                subdirs.append(entry.name)
+            elif (entry.name in names or os.path.splitext(entry.name)[1] in exts) and entry.is_file():
+                files.append(entry.name)
+
+        subdirs.sort()
+        files.sort()
+        return (subdirs, files)
+
     def _recurse_dirs(self, path: Path) -> None:
         """
         Recursively finds and adds all directories from the top level path until the end of all paths.
@@ -158,19 +231,29 @@ class DirectoryWalker(object):
 
         :param path: 'root' path to start searching from
         """
+        self._check_cancelled()
         subdirs = []
 
         # find directories in `path`
-        for item in path.iterdir():
-            if item.is_dir():
-                self.scanned_paths.append(item)
-                subdirs.append(item)
+        for entry in self.fs.scandir(path):
+            if entry.is_dir():
+                self.scanned_paths.append(path.joinpath(entry.name))
+                subdirs.append(path.joinpath(entry.name))
 
         if subdirs:
             # recurse through found directories
             for directory in subdirs:
                 self._recurse_dirs(directory)
 
+    def _check_cancelled(self) -> None:
+        """
+        Stop the walk if it was cancelled.
+
+        :raises OperationCancelledError: if `cancel` is set.
+        """
+        if self.cancel is not None and self.cancel.is_set():
+            raise OperationCancelledError()
+
 
 class PathNotADirectoryError(Exception):
     """Exception object that is raised when a given path is not a directory."""
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Detection of byte-identical images within a project.
+
+Files are grouped by size first (a single `stat` per file) and only files that share a size with another file are hashed.
+Hashes are stored in the stat cache (see `cache.content_hash`) so repeat runs only hash new or modified files.
+
+`DuplicateSet`: A group of files with identical content.
+
+`DuplicateReport`: All duplicate sets found and the number of bytes wasted by them.
+
+`find_duplicates`: Build a `DuplicateReport` from a list of image paths.
+"""
+# python level imports
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+from pathlib import Path
+# pfiga-browser level imports
+from pfiga_browser.cache import StatCache, content_hash
+
+
+class DuplicateSet(object):
+    """
+    Group of files with identical content.
+
+    `digest`: SHA-256 hex digest of the content.
+
+    `size`: Size of each file in bytes.
+
+    `paths`: Sorted list of paths to the files.
+    """
+
+    digest: str
+
+    size: int
+
+    paths: List[Path]
+
+    def __init__(self, digest: str, size: int, paths: List[Path]):
+        """
+        Initialize with the content hash, size, and files in the set.
+
+        :param digest: SHA-256 hex digest of the content.
+
+        :param size: Size of each file in bytes.
+
+        :param paths: Paths to the files.
+        """
+        self.digest = digest
+        self.size = size
+        self.paths = sorted(paths)
+
+    @property
+    def wasted_bytes(self) -> int:
+        """Number of bytes that would be freed if only one copy was kept."""
+        return self.size * (len(self.paths) - 1)
+
+    def __str__(self) -> str:
+        """Return the set as a heading line (hash, size) followed by one indented line per file."""
+        lines = ["%s (%d bytes, %d copies)" % (self.digest[:16], self.size, len(self.paths))]
+        lines.extend("\t%s" % path for path in self.paths)
+        return "\n".join(lines)
+
+
+class DuplicateReport(object):
+    """
+    Report of all duplicate sets found in a list of files.
+
+    `sets`: Duplicate sets, most wasted bytes first.
+    """
+
+    sets: List[DuplicateSet]
+
+    def __init__(self, sets: List[DuplicateSet]):
+        """
+        Initialize with the duplicate sets found.
+
+        :param sets: Duplicate sets.
+        """
+        self.sets = sorted(sets, key=lambda dup: (-dup.wasted_bytes, dup.paths[0]))
+
+    @property
+    def wasted_bytes(self) -> int:
+        """Total number of bytes wasted by all duplicate sets."""
+        return sum(dup.wasted_bytes for dup in self.sets)
+
+    def __str__(self) -> str:
+        """Return a human readable report of all sets and the total number of wasted bytes."""
+        lines = [str(dup) for dup in self.sets]
+        lines.append("%d duplicate sets, %d bytes wasted" % (len(self.sets), self.wasted_bytes))
+        return "\n".join(lines)
+
+
+def find_duplicates(paths: Iterable[Path], cache: Optional[StatCache] = None, workers: Optional[int] = None,
+                    executor: Optional[Executor] = None) -> DuplicateReport:
+    """
+    Find files with identical content in `paths`.
+
+    :param paths: Paths to files (e.g. the result of `DirectoryWalker.find_all_images`).
+
+    :param cache: Optional. Cache to look up and store content hashes in.
+
+    :param workers: Optional. Number of threads to hash files with (hashing releases the GIL). Defaults to the executor's default.
+
+    :param executor: Optional. Thread pool to hash files on (e.g. one shared by several projects). A new pool is created by default.
+
+    :returns: Report of all sets of identical files.
+    """
+    sizes: Dict[Path, int] = {path: path.stat().st_size for path in paths}
+    by_size: Dict[int, List[Path]] = {}
+
+    # files with a unique size cannot have a duplicate, so they are never read
+    for path, size in sizes.items():
+        by_size.setdefault(size, []).append(path)
+
+    candidates: List[Path] = [path for group in by_size.values() if len(group) > 1 for path in group]
+
+    pool = executor if executor is not None else ThreadPoolExecutor(max_workers=workers)
+    try:
+        digests = list(pool.map(lambda path: content_hash(path, cache), candidates))
+    finally:
+        if executor is None:
+            pool.shutdown()
+
+    by_digest: Dict[str, List[Path]] = {}
+    for path, digest in zip(candidates, digests):
+        by_digest.setdefault(digest, []).append(path)
+
+    return DuplicateReport([DuplicateSet(digest, sizes[group[0]], group)
+                            for digest, group in by_digest.items() if len(group) > 1])
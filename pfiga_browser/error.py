@@ -9,3 +9,19 @@ class ExitCode(enum.Enum):
     NORMAL = 0
     UNKOWN = 1
     FILENOTFOUND = 2
+    UNTRACKED = 3
+    MISSING = 4
+    # the project was stopped before it was processed completely (e.g. another project of the run failed a check)
+    CANCELLED = 5
+
+
+class OperationCancelledError(Exception):
+    """Exception object that is raised by walkers and parsers when the operation they are part of was cancelled."""
+
+    def __init__(self, *args: object):
+        """
+        Initialize with `args`. See `Exception` base class.
+
+        :param args: Arguments to pass to the super class
+        """
+        super(OperationCancelledError, self).__init__(*args)
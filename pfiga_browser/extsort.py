@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+External sorting and merge joins for comparing very large sets of paths with bounded memory (see `--low-memory`).
+
+Records (tuples of strings) are collected in memory until `run_size` of them are buffered; the buffer is then sorted and
+written to a temporary file (a "run"). Reading the sorted records back is a k-way merge of all runs (`heapq.merge`), so only
+one record per run is in memory at a time. Two sorted streams are compared with `anti_join`, which needs no memory beyond
+the current record of each stream.
+
+`ExternalSorter`: Sorts records that may not fit in memory.
+
+`anti_join`: Yield the records of one sorted stream whose key is not in another.
+"""
+# python level imports
+import os
+import heapq
+import marshal
+import tempfile
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+# number of records buffered before a run is written; a few tens of MB for typical path records
+RUN_SIZE = 100000
+
+
+class ExternalSorter(object):
+    """
+    Sorts records that may not fit in memory by spilling sorted runs to temporary files.
+
+    Usage::
+
+        with ExternalSorter() as sorter:
+            for record in records:
+                sorter.add(record)
+            for record in sorter.sorted():
+                ...
+
+    `run_size`: Number of records buffered in memory before they are written to a run.
+
+    `directory`: Directory the runs are written to. None for the system's temporary directory.
+
+    `runs`: Paths to the temporary files holding the runs written so far.
+    """
+
+    run_size: int
+
+    directory: Optional[str]
+
+    runs: List[str]
+
+    def __init__(self, run_size: int = RUN_SIZE, directory: Optional[str] = None):
+        """
+        Initialize an empty sorter.
+
+        :param run_size: Optional. Number of records buffered in memory. Defaults to `RUN_SIZE`.
+
+        :param directory: Optional. Directory to write runs to.
+        """
+        self.run_size = run_size
+        self.directory = directory
+        self.runs = []
+        self._buffer: List[Tuple[Any, ...]] = []
+
+    def add(self, record: Tuple[Any, ...]) -> None:
+        """
+        Add a record. Records must be tuples of values `marshal` can write (e.g. strings and numbers).
+
+        :param record: Record to add.
+        """
+        self._buffer.append(record)
+        if len(self._buffer) >= self.run_size:
+            self._spill()
+
+    def sorted(self) -> Iterator[Tuple[Any, ...]]:
+        """
+        Return all records added so far in sorted order.
+
+        :returns: Iterator merging the runs and the records still buffered.
+        """
+        self._buffer.sort()
+        streams = [read_run(run) for run in self.runs]
+        return heapq.merge(*streams, iter(self._buffer))
+
+    def close(self) -> None:
+        """Delete the runs."""
+        for run in self.runs:
+            try:
+                os.unlink(run)
+            except FileNotFoundError:
+                pass
+        self.runs = []
+        self._buffer = []
+
+    def __del__(self) -> None:
+        """Delete the runs of a sorter that was not closed (e.g. because the scan was cancelled)."""
+        self.close()
+
+    def __enter__(self) -> "ExternalSorter":
+        """Return the sorter."""
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Delete the runs."""
+        self.close()
+
+    def _spill(self) -> None:
+        """Sort the buffered records and write them to a new run."""
+        self._buffer.sort()
+        handle, run = tempfile.mkstemp(prefix="pfiga_browser.", suffix=".run", dir=self.directory)
+        self.runs.append(run)
+        with open(handle, "wb", buffering=1 << 16) as f_run:
+            for record in self._buffer:
+                marshal.dump(record, f_run)
+        self._buffer = []
+
+
+def read_run(run: str) -> Iterator[Tuple[Any, ...]]:
+    """
+    Read the records of a run in the order they were written.
+
+    :param run: Path to the run.
+
+    :returns: Iterator over the records.
+    """
+    with open(run, "rb", buffering=1 << 16) as f_run:
+        while True:
+            try:
+                yield marshal.load(f_run)
+            except EOFError:
+                return
+
+
+def anti_join(left: Iterator[Tuple[Any, ...]], right: Iterator[Tuple[Any, ...]],
+              key: Callable[[Tuple[Any, ...]], Any]) -> Iterator[Tuple[Any, ...]]:
+    """
+    Yield the records of `left` whose key does not occur in `right`, as a streaming merge join.
+
+    :param left: Records sorted by `key`.
+
+    :param right: Records sorted by `key`.
+
+    :param key: Function returning the key of a record of either stream.
+
+    :returns: Iterator over the records of `left` without a match, in order.
+    """
+    sentinel = object()
+    other = next(right, sentinel)
+
+    for record in left:
+        record_key = key(record)
+        while other is not sentinel and key(other) < record_key:
+            other = next(right, sentinel)
+        if other is sentinel or key(other) != record_key:
+            yield record
@@ -0,0 +1,479 @@
+#!/usr/bin/env python
+"""
+File systems the scanner can read projects from: the local disk, zip/tar archives (read in place), and an in-memory tree.
+
+`DirectoryWalker`, the readme parsers, and `verify_image` only list directories, stat files, and open files through a
+`FileSystem`, so a project stored in an archive can be checked without extracting it, and benchmarks can measure the
+pipeline without disk noise. Paths are absolute; the files of an archive appear below the path of the archive itself
+(e.g. `/archive/project.zip/docs/index.rst`). Only the local file system is writable.
+
+`FileSystem`: Interface of a file system (list, stat, open).
+
+`LocalFileSystem`: The local disk.
+
+`ArchiveFileSystem`: Files of a zip or tar archive, read through its central directory or index.
+
+`MemoryFileSystem`: Files held in memory.
+
+`member_key`: Normalize the name of an archive member.
+
+`filesystem_for`: Return the file system a path is on.
+"""
+# python level imports
+import io
+import os
+import stat
+import zlib
+import tarfile
+import posixpath
+import zipfile
+import threading
+from calendar import timegm
+from typing import BinaryIO, Dict, List, Optional, Set, Union
+from pathlib import Path, PurePath
+
+# suffixes of tar archives
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+# suffixes of archives that are opened as file systems
+ARCHIVE_SUFFIXES = (".zip",) + TAR_SUFFIXES
+
+
+def member_key(name: str) -> Optional[str]:
+    """
+    Return the path of an archive member relative to the root of the archive, as used by `TreeFileSystem`.
+
+    Archivers store the same file as 'docs/index.rst', './docs/index.rst', 'docs//index.rst', or '/docs/index.rst'; members
+    that point outside of the archive (e.g. '../index.rst') are not part of the tree.
+
+    :param name: Name of the member as stored in the archive.
+
+    :returns: Normalized path using '/' as separator ('' for the root), or None if the member is outside of the archive.
+    """
+    key = posixpath.normpath(name.lstrip("/"))
+    if key == ".." or key.startswith("../"):
+        return None
+    return "" if key == "." else key
+
+
+class FileStat(object):
+    """
+    Result of `FileSystem.stat` for file systems other than the local disk. Has the fields of `os.stat_result` the program uses.
+
+    `st_mode`: File type (see `stat.S_ISDIR`) and permissions.
+
+    `st_ino`: Number identifying the file within its file system.
+
+    `st_size`: Size in bytes.
+
+    `st_mtime_ns`: Modification time in nanoseconds since the epoch.
+    """
+
+    st_mode: int
+
+    st_ino: int
+
+    st_size: int
+
+    st_mtime_ns: int
+
+    def __init__(self, is_dir: bool, ino: int, size: int = 0, mtime_ns: int = 0):
+        """
+        Initialize with the type, number, size, and modification time of the file.
+
+        :param is_dir: Whether the file is a directory.
+
+        :param ino: Number identifying the file.
+
+        :param size: Optional. Size in bytes.
+
+        :param mtime_ns: Optional. Modification time in nanoseconds.
+        """
+        self.st_mode = (stat.S_IFDIR | 0o555) if is_dir else (stat.S_IFREG | 0o444)
+        self.st_ino = ino
+        self.st_size = size
+        self.st_mtime_ns = mtime_ns
+
+
+class Entry(object):
+    """
+    Directory entry returned by `FileSystem.scandir` for file systems other than the local disk. Has the methods of `os.DirEntry` the program uses.
+
+    `name`: Name of the entry.
+    """
+
+    name: str
+
+    def __init__(self, name: str, directory: bool):
+        """
+        Initialize with the name and type of the entry.
+
+        :param name: Name of the entry.
+
+        :param directory: Whether the entry is a directory.
+        """
+        self.name = name
+        self._directory = directory
+
+    def is_dir(self) -> bool:
+        """Return true if the entry is a directory."""
+        return self._directory
+
+    def is_file(self) -> bool:
+        """Return true if the entry is a regular file."""
+        return not self._directory
+
+
+class FileSystem(object):
+    """
+    Interface of a file system. Implementations provide `scandir`, `stat`, and `open`; everything else is built on them.
+
+    `writable`: Whether readmes on the file system can be updated.
+    """
+
+    writable: bool = False
+
+    def scandir(self, path: PurePath) -> List[Entry]:
+        """
+        List a directory.
+
+        :param path: Absolute path to the directory.
+
+        :raises FileNotFoundError: if `path` does not exist.
+
+        :raises NotADirectoryError: if `path` is not a directory.
+
+        :returns: Entries of the directory (objects with `name`, `is_dir()`, and `is_file()`, like `os.DirEntry`).
+        """
+        raise NotImplementedError(
+            "%s: must implement the scandir() function in the class." % (self.__class__.__name__))
+
+    def stat(self, path: PurePath) -> Union[os.stat_result, FileStat]:
+        """
+        Return the type, size, and modification time of a file or directory.
+
+        :param path: Absolute path.
+
+        :raises FileNotFoundError: if `path` does not exist.
+
+        :returns: Stat result with at least `st_mode`, `st_ino`, `st_size`, and `st_mtime_ns`.
+        """
+        raise NotImplementedError(
+            "%s: must implement the stat() function in the class." % (self.__class__.__name__))
+
+    def open(self, path: PurePath) -> BinaryIO:
+        """
+        Open a file for reading.
+
+        :param path: Absolute path to the file.
+
+        :raises FileNotFoundError: if `path` does not exist.
+
+        :returns: Binary file object.
+        """
+        raise NotImplementedError(
+            "%s: must implement the open() function in the class." % (self.__class__.__name__))
+
+    def exists(self, path: PurePath) -> bool:
+        """Return true if `path` exists."""
+        try:
+            self.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return False
+        return True
+
+    def is_dir(self, path: PurePath) -> bool:
+        """Return true if `path` is a directory."""
+        try:
+            return stat.S_ISDIR(self.stat(path).st_mode)
+        except (FileNotFoundError, NotADirectoryError):
+            return False
+
+    def is_file(self, path: PurePath) -> bool:
+        """Return true if `path` is a regular file."""
+        try:
+            return stat.S_ISREG(self.stat(path).st_mode)
+        except (FileNotFoundError, NotADirectoryError):
+            return False
+
+    def read_text(self, path: PurePath) -> str:
+        """
+        Read a text file.
+
+        :param path: Absolute path to the file.
+
+        :raises FileNotFoundError: if `path` does not exist.
+
+        :returns: Contents of the file.
+        """
+        with self.open(path) as f_file:
+            return io.TextIOWrapper(f_file).read()
+
+    def close(self) -> None:
+        """Release resources held by the file system (e.g. open archives)."""
+        pass
+
+
+class LocalFileSystem(FileSystem):
+    """The local disk. Entries are `os.DirEntry` objects, so listing a directory needs no additional `stat` calls."""
+
+    writable = True
+
+    def scandir(self, path: PurePath) -> List[os.DirEntry]:
+        """List a directory with `os.scandir`. See `FileSystem.scandir`."""
+        with os.scandir(path) as entries:
+            return list(entries)
+
+    def stat(self, path: PurePath) -> os.stat_result:
+        """Return the result of `os.stat`. See `FileSystem.stat`."""
+        return os.stat(path)
+
+    def open(self, path: PurePath) -> BinaryIO:
+        """Open a file. See `FileSystem.open`."""
+        return open(path, "rb")
+
+    def read_text(self, path: PurePath) -> str:
+        """Read a text file. See `FileSystem.read_text`."""
+        with open(path, "r") as f_file:
+            return f_file.read()
+
+
+# the file system used when none is given
+LOCAL = LocalFileSystem()
+
+
+class TreeFileSystem(FileSystem):
+    """
+    Base class of file systems whose directory tree is held in memory: a map of each directory to the names of its entries.
+
+    `root`: Path the tree is mounted at.
+
+    `directories`: Map of paths relative to `root` ('' for the root) to the names of the directory's entries.
+
+    `files`: Map of paths relative to `root` to their stat results.
+    """
+
+    root: PurePath
+
+    directories: Dict[str, Set[str]]
+
+    files: Dict[str, FileStat]
+
+    def __init__(self, root: PurePath):
+        """
+        Initialize an empty tree.
+
+        :param root: Absolute path the tree is mounted at.
+        """
+        self.root = root
+        self.directories = {"": set()}
+        self.files = {}
+        self._inodes = 1
+
+    def scandir(self, path: PurePath) -> List[Entry]:
+        """List a directory of the tree. See `FileSystem.scandir`."""
+        key = self.key(path)
+        if key in self.files:
+            raise NotADirectoryError(str(path))
+        if key not in self.directories:
+            raise FileNotFoundError(str(path))
+        prefix = key + "/" if key else ""
+        return [Entry(name, prefix + name in self.directories) for name in sorted(self.directories[key])]
+
+    def stat(self, path: PurePath) -> FileStat:
+        """Return the stat result of a file or directory of the tree. See `FileSystem.stat`."""
+        key = self.key(path)
+        if key in self.files:
+            return self.files[key]
+        if key in self.directories:
+            # directories get a stable number from their position in the tree
+            return FileStat(True, zlib.crc32(key.encode("utf-8")))
+        raise FileNotFoundError(str(path))
+
+    def key(self, path: PurePath) -> str:
+        """
+        Return the key of a path in the tree.
+
+        :param path: Absolute path below `root`.
+
+        :raises FileNotFoundError: if `path` is not below `root`.
+
+        :returns: Path relative to `root`, using '/' as separator ('' for the root).
+        """
+        try:
+            relative = PurePath(os.path.normpath(path)).relative_to(self.root)
+        except ValueError:
+            raise FileNotFoundError(str(path))
+        return "" if str(relative) == "." else relative.as_posix()
+
+    def add(self, key: str, size: int = 0, mtime_ns: int = 0, directory: bool = False) -> None:
+        """
+        Add a file or directory (and its parent directories) to the tree.
+
+        :param key: Path relative to `root` using '/' as separator.
+
+        :param size: Optional. Size of the file.
+
+        :param mtime_ns: Optional. Modification time of the file.
+
+        :param directory: Optional. Whether the path is a directory.
+        """
+        key = key.strip("/")
+        parts = key.split("/") if key else []
+        for depth in range(len(parts)):
+            parent = "/".join(parts[:depth])
+            self.directories.setdefault(parent, set()).add(parts[depth])
+        if directory:
+            self.directories.setdefault(key, set())
+        elif key in self.files:
+            # a replaced file keeps its number, like a file that is rewritten on disk
+            self.files[key] = FileStat(False, self.files[key].st_ino, size, mtime_ns)
+        else:
+            self.files[key] = FileStat(False, self._inodes, size, mtime_ns)
+            self._inodes += 1
+
+
+class ArchiveFileSystem(TreeFileSystem):
+    """
+    Files of a zip or tar archive, mounted at the path of the archive. Read in place: the tree is built from the zip central
+    directory or the tar index, and only the files that are opened (readmes) are decompressed.
+
+    `archive`: Path to the archive.
+    """
+
+    archive: Path
+
+    def __init__(self, archive: Path):
+        """
+        Open the archive and build its tree.
+
+        :param archive: Path to a zip or tar archive (tar archives may be compressed).
+
+        :raises FileNotFoundError: if the archive does not exist.
+
+        :raises ValueError: if the file is not a zip or tar archive.
+        """
+        super(ArchiveFileSystem, self).__init__(PurePath(os.path.normpath(archive.absolute())))
+        self.archive = archive
+        self._lock = threading.Lock()
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._tar: Optional[tarfile.TarFile] = None
+        self._members: Dict[str, Union[zipfile.ZipInfo, tarfile.TarInfo]] = {}
+
+        # the suffix decides the format: an uncompressed tar whose last member is a zip (e.g. an .odg drawing) looks like a
+        # zip archive to `zipfile.is_zipfile`, which only looks for a central directory at the end of the file
+        name = archive.name.lower()
+        if name.endswith(".zip") or (not name.endswith(TAR_SUFFIXES) and not tarfile.is_tarfile(archive)):
+            if not zipfile.is_zipfile(archive):
+                raise ValueError("'%s' is not a zip or tar archive" % archive)
+            self._zip = zipfile.ZipFile(archive)
+            for info in self._zip.infolist():
+                key = member_key(info.filename)
+                if key:
+                    mtime_ns = timegm(info.date_time + (0, 0, -1)) * 10 ** 9
+                    self.add(key, info.file_size, mtime_ns, info.is_dir())
+                    self._members[key] = info
+        else:
+            if not tarfile.is_tarfile(archive):
+                raise ValueError("'%s' is not a zip or tar archive" % archive)
+            # tar archives have no central directory; the headers are read once (skipping over the file data if uncompressed)
+            self._tar = tarfile.open(archive)
+            for member in self._tar.getmembers():
+                key = member_key(member.name)
+                if key and (member.isdir() or member.isfile()):
+                    self.add(key, member.size, int(member.mtime) * 10 ** 9, member.isdir())
+                    self._members[key] = member
+
+    def open(self, path: PurePath) -> BinaryIO:
+        """Read a file of the archive. See `FileSystem.open`."""
+        key = self.key(path)
+        if key not in self.files:
+            raise FileNotFoundError(str(path))
+
+        # archive readers share one file handle; files are read completely while holding the lock
+        with self._lock:
+            if self._zip is not None:
+                data = self._zip.read(self._members[key])
+            else:
+                f_member = self._tar.extractfile(self._members[key])
+                data = f_member.read() if f_member is not None else b""
+        return io.BytesIO(data)
+
+    def close(self) -> None:
+        """Close the archive."""
+        for archive in (self._zip, self._tar):
+            if archive is not None:
+                archive.close()
+
+
+class MemoryFileSystem(TreeFileSystem):
+    """
+    Files held in memory, e.g. to measure the cost of the pipeline without disk noise.
+
+    Usage::
+
+        fs = MemoryFileSystem(Path("/project"))
+        fs.write(Path("/project/index.rst"), ".. toctree::\\n\\n   1pj/01readme.rst\\n")
+        report = process_index(Path("/project/index.rst"), default_options(check=True), context, fs=fs)
+
+    `contents`: Map of paths relative to `root` to the contents of the files.
+    """
+
+    contents: Dict[str, bytes]
+
+    def __init__(self, root: PurePath = PurePath("/")):
+        """
+        Initialize an empty file system.
+
+        :param root: Optional. Absolute path the file system is mounted at. Defaults to '/'.
+        """
+        super(MemoryFileSystem, self).__init__(root)
+        self.contents = {}
+        self._clock = 0
+
+    def write(self, path: PurePath, data: Union[str, bytes] = b"") -> None:
+        """
+        Create or replace a file (and its parent directories).
+
+        :param path: Absolute path to the file.
+
+        :param data: Optional. Contents of the file. Text is encoded as UTF-8. Empty by default (e.g. for images that are only listed).
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        key = self.key(path)
+        # every write gets a new modification time, so changes are noticed like on disk
+        self._clock += 1
+        self.add(key, len(data), self._clock)
+        self.contents[key] = data
+
+    def mkdir(self, path: PurePath) -> None:
+        """
+        Create a directory (and its parent directories).
+
+        :param path: Absolute path to the directory.
+        """
+        self.add(self.key(path), directory=True)
+
+    def open(self, path: PurePath) -> BinaryIO:
+        """Open a file. See `FileSystem.open`."""
+        key = self.key(path)
+        if key not in self.contents:
+            raise FileNotFoundError(str(path))
+        return io.BytesIO(self.contents[key])
+
+
+def filesystem_for(path: Path) -> FileSystem:
+    """
+    Return the file system a path is on: an archive if one of its parents is a zip or tar archive, the local disk otherwise.
+
+    :param path: Absolute path, e.g. '/archive/project.zip/docs/index.rst'.
+
+    :raises ValueError: if a parent looks like an archive but cannot be read as one.
+
+    :returns: File system to read the path from. Archives must be closed after use (see `FileSystem.close`).
+    """
+    for parent in [path] + list(path.parents):
+        if parent.name.lower().endswith(ARCHIVE_SUFFIXES) and parent.is_file():
+            return ArchiveFileSystem(parent)
+    return LOCAL
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+"""
+Static HTML gallery generator that renders second level readmes directly, without a Sphinx build.
+
+One page is written per second level readme (i.e. per image directory), plus an index page and a JSON search index.
+A manifest in the output directory records the (inode, mtime, size) stamps of every readme and image a page was built
+from, so a rebuild only parses and rewrites the pages whose readme or images changed.
+
+Several projects can share an output directory: the pages of each project are written to a subdirectory named after
+the project (`cache.index_digest` of its index), and the manifest is merged under a lock, so the index page lists the
+pages of all projects and a build only replaces or deletes the pages of its own project.
+
+`GalleryBuilder`: Builds and incrementally updates the gallery.
+"""
+# python level imports
+import os
+import json
+from typing import Any, Dict, Iterable, List, Optional
+from pathlib import Path
+from importlib import resources
+# pfiga-browser level imports
+import pfiga_browser.templates
+from pfiga_browser.cache import cache_lock, file_stamp, index_digest, read_json, write_json
+from pfiga_browser.imageinfo import ImageCollection
+from pfiga_browser.parsers import ReadmeImageParser
+from pfiga_browser.template import TemplateEngine
+
+MANIFEST_NAME = ".pfiga-gallery.json"
+
+
+def image_stamp(path: Path) -> str:
+    """
+    Return the stamp of an image file, or 'missing' if it does not exist.
+
+    :param path: Path to the image.
+
+    :returns: See `cache.file_stamp`.
+    """
+    try:
+        return file_stamp(path)
+    except OSError:
+        return "missing"
+
+
+def clean_description(name: str, description: str) -> str:
+    """
+    Strip the leading image name from a parsed description (the parser returns the whole paragraph, e.g. 'img01.png. A screenshot...').
+
+    :param name: Name of the image.
+
+    :param description: Description parsed from the readme.
+
+    :returns: Description without the image name.
+    """
+    if description.startswith(name):
+        description = description[len(name):].lstrip(". ")
+    return " ".join(description.split())
+
+
+class GalleryBuilder(object):
+    """
+    Renders a static HTML gallery from second level readmes using the package's jinja2 environment (see `TemplateEngine`).
+
+    `outdir`: Directory the gallery is written to.
+
+    `root`: Directory the pages mirror (usually the directory of the project index). Readmes outside of it are placed by name.
+
+    `template_engine`: Template engine whose environment is used to load the gallery templates.
+
+    `project`: Name of the subdirectory of `outdir` the pages of the project are written to.
+
+    `manifest`: Map of page paths (relative to `outdir`) to the stamps and image data the page was last built from, for
+    the pages of all projects in `outdir`.
+    """
+
+    outdir: Path
+
+    root: Path
+
+    template_engine: TemplateEngine
+
+    project: str
+
+    manifest: Dict[str, Dict[str, Any]]
+
+    def __init__(self, outdir: Path, root: Path, template_engine: Optional[TemplateEngine] = None,
+                 project: Optional[str] = None):
+        """
+        Initialize with the output directory and the root of the project, loading the manifest of the last build.
+
+        :param outdir: Directory to write the gallery to.
+
+        :param root: Root directory of the project.
+
+        :param template_engine: Optional. Template engine to render with. A new one is created by default.
+
+        :param project: Optional. Name of the subdirectory for the pages of the project, e.g. `cache.index_digest` of
+            the project index. The digest of `root` by default.
+        """
+        self.outdir = outdir
+        self.root = root
+        self.template_engine = template_engine if template_engine is not None else TemplateEngine()
+        self.project = project if project is not None else index_digest(root)
+        self.manifest = self._read()
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Read the manifest from `outdir`.
+
+        :returns: Map of page paths to manifest entries; empty if there is no manifest or it is corrupt.
+        """
+        manifest = read_json(self.outdir.joinpath(MANIFEST_NAME))
+        return manifest if isinstance(manifest, dict) else {}
+
+    def owns(self, page: str) -> bool:
+        """
+        Return true if a page of the manifest belongs to this project, i.e. may be replaced or deleted by this build.
+
+        Entries without a project are left over from galleries built before pages were placed per project.
+
+        :param page: Page path relative to `outdir`.
+
+        :returns: True if the page belongs to this project.
+        """
+        return self.manifest[page].get("project", self.project) == self.project
+
+    def page_path(self, readme: Path) -> str:
+        """
+        Return the path of the page for a second level readme, relative to `outdir`.
+
+        :param readme: Path to the second level readme.
+
+        :returns: e.g. '<project>/4gr/folder_figs/index.html' for '<root>/4gr/folder_figs/02readme.rst'.
+        """
+        try:
+            relative = readme.parent.relative_to(self.root)
+        except ValueError:
+            relative = Path(readme.parent.name)
+        return Path(self.project).joinpath(relative, "index.html").as_posix()
+
+    def is_current(self, page: str, readme: Path) -> bool:
+        """
+        Return true if the page was built from the current versions of the readme and all images listed in it.
+
+        Only `stat` is used; the readme is not parsed.
+
+        :param page: Page path relative to `outdir`.
+
+        :param readme: Path to the second level readme.
+
+        :returns: True if the page does not need to be rebuilt.
+        """
+        entry = self.manifest.get(page)
+        if entry is None or entry["readme"] != str(readme) or not self.outdir.joinpath(page).is_file():
+            return False
+        if entry["stamp"] != image_stamp(readme):
+            return False
+        return all(image_stamp(readme.parent.joinpath(image["uri"])) == image["stamp"] for image in entry["images"])
+
+    def render_page(self, page: str, readme: Path, collection: ImageCollection) -> Dict[str, Any]:
+        """
+        Render and write the page for a second level readme.
+
+        :param page: Page path relative to `outdir`.
+
+        :param readme: Path to the second level readme.
+
+        :param collection: Images parsed from the readme.
+
+        :returns: Manifest entry for the page.
+        """
+        page_path = self.outdir.joinpath(page)
+        page_dir = page_path.parent
+        images: List[Dict[str, Any]] = []
+
+        for image in collection.collection:
+            original = readme.parent.joinpath(image.uri)
+            source = readme.parent.joinpath(image.thumbnail) if image.thumbnail else original
+            images.append({
+                "name": image.name,
+                "uri": image.uri,
+                "description": clean_description(image.name, image.description),
+                "width": image.width,
+                "href": Path(os.path.relpath(original, page_dir)).as_posix(),
+                "src": Path(os.path.relpath(source, page_dir)).as_posix(),
+                "stamp": image_stamp(original)
+            })
+
+        title = readme.parent.relative_to(self.root).as_posix() if self.root in readme.parents else readme.parent.name
+        rendered_text = self.template_engine.environment.get_template("gallery_page.html").render(
+            title=title,
+            root="../" * (page.count("/")),
+            images=images)
+
+        page_dir.mkdir(parents=True, exist_ok=True)
+        page_path.write_text(rendered_text)
+
+        return {
+            "project": self.project,
+            "root": str(self.root),
+            "readme": str(readme),
+            "stamp": image_stamp(readme),
+            "title": title,
+            "images": images
+        }
+
+    def build(self, readmes: Iterable[Path], title: str = "Image gallery") -> List[Path]:
+        """
+        Build or update the gallery for a list of second level readmes.
+
+        Pages are only rewritten if their readme or one of their images changed since the last build. Pages of this
+        project whose readmes are no longer listed are deleted; pages of other projects are kept. The index page and search
+        index are only rewritten if any page changed.
+
+        :param readmes: Paths to second level readmes.
+
+        :param title: Optional. Title of the index page.
+
+        :returns: List of files that were written.
+        """
+        written: List[Path] = []
+        pages: Dict[str, Path] = {self.page_path(readme): readme for readme in readmes}
+        changed = False
+
+        # delete pages of readmes that are no longer part of the project
+        for page in [page for page in self.manifest if page not in pages and self.owns(page)]:
+            self.outdir.joinpath(page).unlink(missing_ok=True)
+            del self.manifest[page]
+            changed = True
+
+        for page, readme in pages.items():
+            if self.is_current(page, readme):
+                continue
+            try:
+                collection = ReadmeImageParser(readme).parse()
+            except FileNotFoundError:
+                continue
+            self.manifest[page] = self.render_page(page, readme, collection)
+            written.append(self.outdir.joinpath(page))
+            changed = True
+
+        if changed or not self.outdir.joinpath("index.html").is_file():
+            written.extend(self.write_index(title))
+
+        return written
+
+    def write_index(self, title: str) -> List[Path]:
+        """
+        Write the index page, the JSON search index, the style sheet, and the manifest.
+
+        The pages of this project are merged into the manifest on disk under its lock, so pages that other projects built
+        into `outdir` in the meantime are kept and listed.
+
+        :param title: Title of the index page.
+
+        :returns: List of files that were written.
+        """
+        self.outdir.mkdir(parents=True, exist_ok=True)
+        manifest_path = self.outdir.joinpath(MANIFEST_NAME)
+
+        with cache_lock(manifest_path):
+            manifest = {page: entry for page, entry in self._read().items()
+                        if entry.get("project", self.project) != self.project}
+            manifest.update((page, entry) for page, entry in self.manifest.items() if self.owns(page))
+            self.manifest = manifest
+            written = self._write_index(title)
+            write_json(manifest_path, self.manifest)
+
+        return written + [manifest_path]
+
+    def _write_index(self, title: str) -> List[Path]:
+        """
+        Write the index page, the JSON search index, and the style sheet for the pages in `manifest`.
+
+        :param title: Title of the index page.
+
+        :returns: List of files that were written.
+        """
+        pages = sorted(self.manifest.items(), key=lambda item: (item[1].get("root", ""), item[1]["title"]))
+        # the project of each page is only shown if the gallery holds more than one project
+        several = len({entry.get("root", "") for page, entry in pages}) > 1
+
+        index_path = self.outdir.joinpath("index.html")
+        index_path.write_text(self.template_engine.environment.get_template("gallery_index.html").render(
+            title=title,
+            pages=[{"href": page, "title": entry["title"], "project": entry.get("root", "") if several else "",
+                    "count": len(entry["images"])} for page, entry in pages]))
+
+        search_path = self.outdir.joinpath("search.json")
+        with search_path.open("w") as f_search:
+            json.dump([{
+                "name": image["name"],
+                "description": image["description"],
+                "href": "%s#%s" % (page, image["uri"])
+            } for page, entry in pages for image in entry["images"]], f_search, separators=(",", ":"))
+
+        css_path = self.outdir.joinpath("gallery.css")
+        css_path.write_text(resources.files(pfiga_browser.templates).joinpath("gallery.css").read_text())
+
+        return [index_path, search_path, css_path]
@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 """Common data structures for images and collections of images."""
 # python level imports
-from typing import Dict, Union, List
+from typing import Dict, Union, List, Optional
 from pathlib import Path
 from copy import deepcopy
+# pfiga-browser level imports
+from pfiga_browser.filesystem import LOCAL, FileSystem
 
 
 class Image(object):
@@ -19,6 +21,8 @@ class Image(object):
     `description`: Description of the image. By default this is either "" or "Add description here.". Used primarily in second level readme files.
 
     `width`: Width of the image thumbnail (optional argument in reST `image` directives)
+
+    `thumbnail`: URI of a downscaled copy of the image to display instead of the original (the original is linked to). Empty if there is none.
     """
 
     name: str
@@ -29,7 +33,9 @@ class Image(object):
 
     width: int
 
-    def __init__(self, uri: str, name: str = "", description: str = "Add description here.", width: int = 300):
+    thumbnail: str
+
+    def __init__(self, uri: str, name: str = "", description: str = "Add description here.", width: int = 300, thumbnail: str = ""):
         """
         Initialize with name, description (optional), and width (optional).
 
@@ -40,12 +46,15 @@ class Image(object):
         :param description: Optional. Image description.
 
         :param width: Optional. Small/large pixel values for displaying image thumbnails.
+
+        :param thumbnail: Optional. URI of a thumbnail to display instead of the image.
         """
         if name == "":
             self.name = uri
         self.uri = uri
         self.description = description
         self.width = width
+        self.thumbnail = thumbnail
 
     def to_dict(self) -> Dict[str, Union[str, int]]:
         """
@@ -57,7 +66,8 @@ class Image(object):
             "name": self.name,
             "uri": self.uri,
             "description": self.description,
-            "width": self.width
+            "width": self.width,
+            "thumbnail": self.thumbnail
         }
 
     def __repr__(self) -> str:
@@ -150,7 +160,7 @@ class ImageCollection(object):
         return str([str(image) for image in self.collection])
 
 
-def verify_image(image: Image, path: Path) -> bool:
+def verify_image(image: Image, path: Path, fs: Optional[FileSystem] = None) -> bool:
     """
     Return true if `image` URI is present in `path`, false otherwise.
 
@@ -158,10 +168,12 @@ def verify_image(image: Image, path: Path) -> bool:
 
     :param path: Path to iterate through and check for `image`.
 
+    :param fs: Optional. File system `path` is on. The local disk by default.
+
     :returns: True if `image` is in `path`, False otherwise.
     """
     # if file name and image uri match, then image is valid
-    for item in path.iterdir():
+    for item in (fs if fs is not None else LOCAL).scandir(path):
         # possible on some systems to have a folder name that could match an URI
         if item.is_file() and image.uri == item.name:
             return True
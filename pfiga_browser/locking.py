@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+Advisory file locking and optimistic write checks for readme updates.
+
+Several pfiga-browser processes (possibly on different hosts sharing the same storage) may update the readmes of overlapping
+projects at the same time. Every readme update therefore holds an exclusive `fcntl.flock` lock on the readme while it reads
+and writes it. Edits are planned from the version of a readme that was parsed earlier; before writing, the version is compared
+to the file on disk (see `FileVersion`) and the edit is re-planned from the current contents if another process changed it.
+
+`FileVersion`: Version of a file an edit was planned against.
+
+`locked`: Open a file and hold an exclusive lock on it.
+"""
+# python level imports
+import os
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Dict, IO, Iterator, Optional
+from pathlib import Path
+# pfiga-browser level imports
+from pfiga_browser.cache import file_stamp
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks (e.g. on Windows); updates are only serialized within the process
+    fcntl = None
+
+# flock locks of the same file opened twice by one process exclude each other, but not on file systems that emulate them with
+# POSIX locks (e.g. NFS); threads of this process are serialized separately
+_thread_locks: Dict[str, threading.Lock] = {}
+_thread_locks_lock = threading.Lock()
+
+
+def text_digest(text: str) -> str:
+    """
+    Return the digest of the contents of a text file.
+
+    :param text: Contents of the file.
+
+    :returns: Hex digest.
+    """
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class FileVersion(object):
+    """
+    Version of a file an edit was planned against.
+
+    `stamp`: (inode, mtime, size) stamp of the file. See `cache.file_stamp`.
+
+    `digest`: Digest of the file's contents (see `text_digest`), or None if unknown. Used to tell a file that was only touched from one that was changed.
+    """
+
+    stamp: str
+
+    digest: Optional[str]
+
+    def __init__(self, stamp: str, digest: Optional[str] = None):
+        """
+        Initialize with the stamp and digest of the file.
+
+        :param stamp: Stamp of the file.
+
+        :param digest: Optional. Digest of the file's contents.
+        """
+        self.stamp = stamp
+        self.digest = digest
+
+    def matches(self, f_file: IO[str], text: Optional[str] = None) -> bool:
+        """
+        Return true if an open file is still this version: its stamp is unchanged or, if it was only touched, its contents are.
+
+        :param f_file: The file, opened for reading.
+
+        :param text: Optional. Contents of the file, if already read. Otherwise the file is read if its stamp changed.
+
+        :returns: True if the file is unchanged.
+        """
+        if file_stamp(f_file.name, os.fstat(f_file.fileno())) == self.stamp:
+            return True
+        if self.digest is None:
+            return False
+        if text is None:
+            f_file.seek(0)
+            text = f_file.read()
+        return text_digest(text) == self.digest
+
+    def __repr__(self) -> str:
+        """Return the stamp and digest for debugging."""
+        return "FileVersion(%s, %s)" % (self.stamp, self.digest)
+
+
+def file_version(path: Path, text: Optional[str] = None) -> FileVersion:
+    """
+    Return the current version of a file.
+
+    :param path: Path to the file.
+
+    :param text: Optional. Contents of the file, to record their digest as well.
+
+    :returns: Version of the file.
+    """
+    return FileVersion(file_stamp(path), text_digest(text) if text is not None else None)
+
+
+@contextmanager
+def locked(path: Path) -> Iterator[IO[str]]:
+    """
+    Open a file for reading and writing and hold an exclusive lock on it until the block is left.
+
+    Blocks until other processes (and threads) holding the lock release it. Reads and writes must go through the returned file.
+
+    Usage::
+
+        with locked(readme) as f_readme:
+            text = f_readme.read()
+            ...
+
+    :param path: Path to the file.
+
+    :raises FileNotFoundError: if the file does not exist.
+
+    :returns: Context manager yielding the open file, positioned at the start.
+    """
+    key = os.path.abspath(path)
+    with _thread_locks_lock:
+        thread_lock = _thread_locks.setdefault(key, threading.Lock())
+
+    with thread_lock:
+        with open(path, "r+") as f_file:
+            if fcntl is not None:
+                fcntl.flock(f_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield f_file
+            finally:
+                if fcntl is not None:
+                    f_file.flush()
+                    fcntl.flock(f_file.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+"""
+Readers for image metadata (pixel dimensions) that only look at file headers instead of decoding entire images.
+
+`read_png_size`: Reads the IHDR chunk of a PNG file.
+
+`read_jpeg_size`: Reads the SOF marker of a JPEG file, skipping over other segments without reading them.
+
+`read_svg_size`: Reads the width, height, or viewBox of the root element of an SVG file.
+
+`read_odg_size`: Reads the page size of an OpenDocument drawing from its zip archive.
+
+`MetadataReader`: Reads image sizes and caches them by (inode, mtime, size). See `cache.StatCache`.
+"""
+# python level imports
+import re
+import struct
+import zipfile
+from typing import BinaryIO, Callable, Dict, Iterable, Optional, Tuple
+from pathlib import Path
+from xml.etree import ElementTree
+# pfiga-browser level imports
+from pfiga_browser.cache import StatCache
+
+ImageSize = Tuple[int, int]
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# JPEG start of frame markers (excluding DHT, JPG, and DAC which share the range)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# pixels per unit for CSS/SVG length units (96 dpi)
+SVG_UNITS: Dict[str, float] = {
+    "": 1.0,
+    "px": 1.0,
+    "pt": 96.0 / 72.0,
+    "pc": 16.0,
+    "in": 96.0,
+    "cm": 96.0 / 2.54,
+    "mm": 96.0 / 25.4
+}
+
+SVG_LENGTH = re.compile(r"^\s*([0-9.]+(?:[eE][-+]?[0-9]+)?)\s*([a-z]*)\s*$")
+
+ODG_STYLE_NAMESPACE = "urn:oasis:names:tc:opendocument:xmlns:style:1.0"
+
+ODG_FO_NAMESPACE = "urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0"
+
+
+def read_png_size(f_image: BinaryIO) -> Optional[ImageSize]:
+    """
+    Read the width and height of a PNG image from its IHDR chunk (always the first chunk, 24 bytes into the file).
+
+    :param f_image: File object opened in binary mode.
+
+    :returns: (width, height) in pixels or None if the file is not a valid PNG.
+    """
+    header = f_image.read(24)
+    if len(header) < 24 or header[:8] != PNG_SIGNATURE or header[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", header[16:24])
+
+
+def read_jpeg_size(f_image: BinaryIO) -> Optional[ImageSize]:
+    """
+    Read the width and height of a JPEG image from its start of frame (SOF) marker.
+
+    Only the two byte marker and length of each segment is read; segment bodies (EXIF data, embedded thumbnails, etc.) are skipped.
+
+    :param f_image: File object opened in binary mode.
+
+    :returns: (width, height) in pixels or None if the file is not a valid JPEG.
+    """
+    if f_image.read(2) != b"\xff\xd8":
+        return None
+
+    while True:
+        byte = f_image.read(1)
+        if not byte:
+            return None
+        if byte != b"\xff":
+            continue
+
+        # markers may be padded with any number of 0xff fill bytes
+        marker = f_image.read(1)
+        while marker == b"\xff":
+            marker = f_image.read(1)
+        if not marker:
+            return None
+
+        code = marker[0]
+        # standalone markers have no length field
+        if code == 0x01 or 0xD0 <= code <= 0xD9:
+            continue
+
+        length_bytes = f_image.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack(">H", length_bytes)[0]
+
+        if code in JPEG_SOF_MARKERS:
+            frame = f_image.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack(">HH", frame[1:5])
+            return (width, height)
+
+        f_image.seek(length - 2, 1)
+
+
+def parse_svg_length(value: Optional[str]) -> Optional[float]:
+    """
+    Convert an SVG length attribute (e.g. '300', '12.5mm', '2in') to pixels.
+
+    :param value: Value of the attribute.
+
+    :returns: Length in pixels or None if the value is missing or relative (e.g. percentages).
+    """
+    if value is None:
+        return None
+    match = SVG_LENGTH.match(value)
+    if match is None or match.group(2) not in SVG_UNITS:
+        return None
+    return float(match.group(1)) * SVG_UNITS[match.group(2)]
+
+
+def read_svg_size(f_image: BinaryIO) -> Optional[ImageSize]:
+    """
+    Read the width and height of an SVG image from the attributes of its root element.
+
+    The document is parsed incrementally and parsing stops at the first element, so the rest of the file is never read.
+    Falls back to the viewBox when width/height are missing or relative.
+
+    :param f_image: File object opened in binary mode.
+
+    :returns: (width, height) in pixels or None if the size cannot be determined.
+    """
+    try:
+        for _, element in ElementTree.iterparse(f_image, events=("start",)):
+            width = parse_svg_length(element.get("width"))
+            height = parse_svg_length(element.get("height"))
+            view_box = element.get("viewBox", "").replace(",", " ").split()
+
+            if width is None or height is None:
+                if len(view_box) != 4:
+                    return None
+                box_width, box_height = float(view_box[2]), float(view_box[3])
+                # scale the missing dimension to the aspect ratio of the view box
+                if width is not None and box_width:
+                    height = width * box_height / box_width
+                elif height is not None and box_height:
+                    width = height * box_width / box_height
+                else:
+                    width, height = box_width, box_height
+
+            return (round(width), round(height))
+    except (ElementTree.ParseError, ValueError):
+        return None
+    return None
+
+
+def read_odg_size(f_image: BinaryIO) -> Optional[ImageSize]:
+    """
+    Read the page size of an OpenDocument drawing (.odg).
+
+    Only the zip archive's central directory and the start of `styles.xml` (up to the first page layout) are read.
+
+    :param f_image: File object opened in binary mode.
+
+    :returns: (width, height) in pixels or None if the size cannot be determined.
+    """
+    tag = "{%s}page-layout-properties" % ODG_STYLE_NAMESPACE
+
+    try:
+        with zipfile.ZipFile(f_image) as archive:
+            with archive.open("styles.xml") as f_styles:
+                for _, element in ElementTree.iterparse(f_styles, events=("start",)):
+                    if element.tag == tag:
+                        width = parse_svg_length(element.get("{%s}page-width" % ODG_FO_NAMESPACE))
+                        height = parse_svg_length(element.get("{%s}page-height" % ODG_FO_NAMESPACE))
+                        if width is None or height is None:
+                            return None
+                        return (round(width), round(height))
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError, ValueError):
+        # ValueError: malformed page length (e.g. '1.2.3cm')
+        return None
+    return None
+
+
+READERS: Dict[str, Callable[[BinaryIO], Optional[ImageSize]]] = {
+    ".png": read_png_size,
+    ".jpg": read_jpeg_size,
+    ".jpeg": read_jpeg_size,
+    ".svg": read_svg_size,
+    ".odg": read_odg_size
+}
+
+
+def read_image_size(path: Path) -> Optional[ImageSize]:
+    """
+    Read the pixel dimensions of the image at `path`. The reader is chosen by file extension.
+
+    :param path: Path to the image.
+
+    :returns: (width, height) in pixels or None if the format is unsupported or the file is invalid.
+    """
+    reader = READERS.get(path.suffix.lower())
+    if reader is None:
+        return None
+
+    with path.open("rb") as f_image:
+        return reader(f_image)
+
+
+def thumbnail_width(size: Optional[ImageSize], max_width: int = 300) -> int:
+    """
+    Choose the width to display an image at: its real width, capped at `max_width`.
+
+    :param size: (width, height) of the image or None if unknown.
+
+    :param max_width: Optional. Largest width to display thumbnails at. Defaults to 300 (the default width of `Image`).
+
+    :returns: Width in pixels.
+    """
+    if size is None or size[0] <= 0:
+        return max_width
+    return min(size[0], max_width)
+
+
+class MetadataReader(object):
+    """
+    Reads image dimensions and caches the results by (inode, mtime, size) so unchanged files are never opened twice.
+
+    `cache`: Cache the dimensions are stored in (as 'width' and 'height' fields of the file's record).
+    """
+
+    cache: StatCache
+
+    def __init__(self, cache: Optional[StatCache] = None):
+        """
+        Initialize with a cache to store results in.
+
+        :param cache: Optional. Cache to use. By default an in-memory cache is used.
+        """
+        self.cache = cache if cache is not None else StatCache()
+
+    def size(self, path: Path) -> Optional[ImageSize]:
+        """
+        Return the dimensions of the image at `path`, reading the file header only if there is no cached result.
+
+        :param path: Path to the image.
+
+        :returns: (width, height) in pixels or None if unknown.
+        """
+        stat = path.stat()
+        record = self.cache.get(path, stat)
+
+        if record is None or "width" not in record:
+            size = read_image_size(path)
+            record = self.cache.update(path, {
+                "width": size[0] if size else None,
+                "height": size[1] if size else None
+            }, stat)
+
+        if record["width"] is None:
+            return None
+        return (record["width"], record["height"])
+
+    def scan(self, paths: Iterable[Path]) -> Dict[Path, Optional[ImageSize]]:
+        """
+        Gather the dimensions of every image in `paths`.
+
+        :param paths: Paths to images (e.g. the result of `DirectoryWalker.find_all_images`).
+
+        :returns: Map of each path to its (width, height) or None if unknown.
+        """
+        return {path: self.size(path) for path in paths}
@@ -4,23 +4,29 @@ Collection of parser, directive, and AST walker implementation for use processin
 
 `directory`: Dummy class for specifying directories described within `toctree` directives in reST documents.
 
+`download`: Dummy class for files linked with Sphinx's `download` role in reST documents.
+
 `TocTree`: Re-implementation of Sphinx's `toctree` directive. See class description for details/rationale.
 
 `RstParser`: Abstract class for setting up objects required to parse and lex a reST document and directives.
 
+`ReadmeDocumentParser`: Parses a readme once and returns both its toctree entries and its images (see `traversal.py`).
+
 TODO Finish module description.
 """
 
 # python level imports
+import copy
 from pathlib import Path
-from typing import List, Dict, Tuple, Any
+from typing import List, Dict, Tuple, Any, Optional
 # docutils level imports
 from docutils import nodes, frontend
 from docutils.parsers import rst
 from docutils.utils import new_document
-from docutils.parsers.rst import directives
+from docutils.parsers.rst import directives, roles
 # pfiga-browser level imports
 from pfiga_browser.imageinfo import ImageCollection, Image, ItemNotFoundError
+from pfiga_browser.filesystem import LOCAL, FileSystem
 
 
 class directory(nodes.General, nodes.Element):
@@ -29,6 +35,41 @@ class directory(nodes.General, nodes.Element):
     pass
 
 
+class download(nodes.Inline, nodes.TextElement):
+    """Dummy class for representing `:download:` links (to the full size image of a thumbnail) in the docutils reST AST."""
+
+    pass
+
+
+def download_role(name: str, rawtext: str, text: str, lineno: int, inliner: Any,
+                  options: Optional[Dict[str, Any]] = None, content: Optional[List[str]] = None) -> Tuple[List[nodes.Node], List[Any]]:
+    """
+    Minimal version of Sphinx's `download` role: records the linked file (`reftarget`) so it can be read from the AST.
+
+    :param name: Name of the role.
+
+    :param rawtext: Text of the whole role, e.g. ':download:`Full size image <img01.png>`'.
+
+    :param text: Text between the backquotes, either 'title <file>' or just 'file'.
+
+    :param lineno: Line number of the role.
+
+    :param inliner: Inline parser.
+
+    :param options: Optional. Options of the role.
+
+    :param content: Optional. Content of the role.
+
+    :returns: List with the download node and an (empty) list of messages.
+    """
+    title, _, target = text.rpartition("<")
+    if title and target.endswith(">"):
+        node = download(rawtext, title.strip(), reftarget=target[:-1].strip())
+    else:
+        node = download(rawtext, text, reftarget=text.strip())
+    return ([node], [])
+
+
 class TocTree(rst.Directive):
     """
     Heavily trimmed and modified version of Sphinx's TocTree reST directive.
@@ -70,6 +111,7 @@ class TocTree(rst.Directive):
             if entry not in ("", " ", "\n"):
                 dir_node = directory(rawtext=entry)
                 dir_node["fullpath"] = str(Path(entry.strip()))
+                dir_node["maxdepth"] = self.options.get("maxdepth")
                 nodelist.append(dir_node)
 
         return nodelist
@@ -102,6 +144,11 @@ class RstParser(object):
     AST representation of the reST document.
     """
 
+    default_settings: Any = None
+    """
+    Default docutils settings for reST documents. Creating them is comparatively expensive, so they are created once and copied for each document.
+    """
+
     def __init__(self, path: Path, text: str):
         """
         Set path to and text of the document to parse and set up a parser and AST document for traversal later.
@@ -112,14 +159,19 @@ class RstParser(object):
         """
         # register the TocTree class to the "toctree" directive in reST
         directives.register_directive("toctree", TocTree)
+        # links to the full size images of thumbnails
+        roles.register_local_role("download", download_role)
 
         self.path = path
         self.text = text
         self.parser = rst.Parser()
 
+        if RstParser.default_settings is None:
+            RstParser.default_settings = frontend.OptionParser(
+                components=(rst.Parser,)).get_default_values()
+
         # create a document object for storing the AST information from the reST document
-        self.rst_document = new_document(str(path.absolute()), settings=frontend.OptionParser(
-            components=(rst.Parser,)).get_default_values())
+        self.rst_document = new_document(str(path.absolute()), settings=copy.copy(RstParser.default_settings))
 
     def parse(self) -> nodes.document:
         """
@@ -138,13 +190,18 @@ class TocTreeProcessor(nodes.NodeVisitor):
     `pathlist`: List of paths (directories; see directory class) that have been found in the reST document.
 
     `parent`: Parent path of the reST document being parsed. Needed for concatenating the full path to the file correctly.
+
+    `maxdepths`: Map of found paths to the `:maxdepth:` option of the toctree listing them (None if it has none). None if not collected.
     """
 
     pathlist: List[Path]
 
     parent: Path
 
-    def __init__(self, document: nodes.document, parent: Path, pathlist: List[Path]):
+    maxdepths: Optional[Dict[Path, Optional[int]]]
+
+    def __init__(self, document: nodes.document, parent: Path, pathlist: List[Path],
+                 maxdepths: Optional[Dict[Path, Optional[int]]] = None):
         """
         Initialize with AST to walk through and list of paths to save to.
 
@@ -153,9 +210,12 @@ class TocTreeProcessor(nodes.NodeVisitor):
         :param parent: Parent path of the reST file.
 
         :param pathlist: List to save parsed directories to.
+
+        :param maxdepths: Optional. Dictionary to save the `:maxdepth:` option of each path's toctree to.
         """
         self.pathlist = pathlist
         self.parent = parent
+        self.maxdepths = maxdepths
         super(TocTreeProcessor, self).__init__(document)
 
     def dispatch_visit(self, node: nodes.Node) -> None:
@@ -166,7 +226,10 @@ class TocTreeProcessor(nodes.NodeVisitor):
         """
         # if the node is a directory object add the absolute version of the path to the path list
         if isinstance(node, directory):
-            self.pathlist.append(self.parent.joinpath(node["fullpath"]))
+            path = self.parent.joinpath(node["fullpath"])
+            self.pathlist.append(path)
+            if self.maxdepths is not None:
+                self.maxdepths[path] = node.get("maxdepth")
 
     def dispatch_departure(self, node: nodes.Node) -> None:
         """Force this function to do nothing to avoid duplicate results or output."""
@@ -216,10 +279,18 @@ class SecondLevelProcessor(nodes.NodeVisitor):
         """
         Process image uri and width from the AST into an Image object.
 
+        Images followed by a `:download:` link to another file, or linking to another file themselves (`:target:` option, written
+        by earlier versions), are thumbnails; the linked file is the image being described.
+
         :param node: Current node.
 
         :returns: Image
         """
+        if isinstance(node.parent, nodes.reference) and "refuri" in node.parent:
+            return Image(uri=node.parent["refuri"], width=node["width"], thumbnail=node["uri"])
+        sibling = node.next_node(descend=False, siblings=True)
+        if isinstance(sibling, nodes.paragraph) and isinstance(sibling.next_node(), download):
+            return Image(uri=sibling.next_node()["reftarget"], width=node["width"], thumbnail=node["uri"])
         return Image(uri=node["uri"], width=node["width"])
 
     def parse_description(self, node: nodes.Node) -> Tuple[str, str]:
@@ -270,18 +341,20 @@ class ReadmeParser(object):
 
     content: str
 
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, fs: Optional[FileSystem] = None):
         """
         Initialize with path to file to parse.
 
         :param path: Path to the file to parse.
+
+        :param fs: Optional. File system to read the file from. The local disk by default.
         """
+        fs = fs if fs is not None else LOCAL
         # validate the file path
-        if path.exists() and path.is_file():
+        if fs.is_file(path):
             self.path = path
             # read and store contents
-            with path.open("r") as f_readme:
-                self.content = f_readme.read()
+            self.content = fs.read_text(path)
         else:
             raise FileNotFoundError()
 
@@ -299,13 +372,15 @@ class ReadmeDirectoryParser(ReadmeParser):
     These files describe the same things, just at different levels of the project.
     """
 
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, fs: Optional[FileSystem] = None):
         """
         Initialize with path to file to parse.
 
         :param path: Path to project index or first level readme file.
+
+        :param fs: Optional. File system to read the file from.
         """
-        super(ReadmeDirectoryParser, self).__init__(path)
+        super(ReadmeDirectoryParser, self).__init__(path, fs)
 
     def parse(self) -> List[Path]:
         """
@@ -332,13 +407,15 @@ class ReadmeImageParser(ReadmeParser):
     program can analyze and perform operations on as needed.
     """
 
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, fs: Optional[FileSystem] = None):
         """
         Initialize with path to the file to parse.
 
         :param path: Path to second level readme file (describes directory/images in directory).
+
+        :param fs: Optional. File system to read the file from.
         """
-        super(ReadmeImageParser, self).__init__(path)
+        super(ReadmeImageParser, self).__init__(path, fs)
 
     def parse(self) -> ImageCollection:
         """
@@ -355,13 +432,62 @@ class ReadmeImageParser(ReadmeParser):
         parsed_rst.walk(SecondLevelProcessor(
             parsed_rst, image_collection, description_map))
 
-        # set descriptions in the Image objects to what was found in the readme
-        for name, description in description_map.items():
-            try:
-                image = image_collection.find(name)
-                image.name = name
-                image.description = description
-            except ItemNotFoundError:
-                continue
+        apply_descriptions(image_collection, description_map)
 
         return image_collection
+
+
+class ReadmeDocumentParser(ReadmeParser):
+    """
+    Class for parsing both the toctree entries and the images of a readme from a single parse.
+
+    Used by the toctree traversal (see `traversal.py`), which does not know in advance whether a readme lists other readmes, images, or both.
+    """
+
+    def __init__(self, path: Path, fs: Optional[FileSystem] = None):
+        """
+        Initialize with path to the file to parse.
+
+        :param path: Path to any readme file.
+
+        :param fs: Optional. File system to read the file from.
+        """
+        super(ReadmeDocumentParser, self).__init__(path, fs)
+
+    def parse(self) -> Tuple[List[Path], Dict[Path, Optional[int]], ImageCollection]:
+        """
+        Parse the reST document once and walk the AST with both the toctree and the image processor.
+
+        :returns: Tuple of the paths listed in toctree directives, the `:maxdepth:` option of each path's toctree, and the images described in the readme.
+        """
+        parsed_paths: List[Path] = []
+        maxdepths: Dict[Path, Optional[int]] = {}
+        image_collection: ImageCollection = ImageCollection()
+        description_map: Dict[str, str] = {}
+
+        parsed_rst = RstParser(self.path, self.content).parse()
+        parsed_rst.walk(TocTreeProcessor(
+            parsed_rst, self.path.parent, parsed_paths, maxdepths))
+        parsed_rst.walk(SecondLevelProcessor(
+            parsed_rst, image_collection, description_map))
+
+        apply_descriptions(image_collection, description_map)
+
+        return (parsed_paths, maxdepths, image_collection)
+
+
+def apply_descriptions(image_collection: ImageCollection, description_map: Dict[str, str]) -> None:
+    """
+    Set the names and descriptions of the images in a collection to what was found in the readme.
+
+    :param image_collection: Images parsed from the readme.
+
+    :param description_map: Map of image names to descriptions (see `SecondLevelProcessor`).
+    """
+    for name, description in description_map.items():
+        try:
+            image = image_collection.find(name)
+            image.name = name
+            image.description = description
+        except ItemNotFoundError:
+            continue
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""
+Compact store of file system paths.
+
+Each path is an integer id. The store keeps two parallel arrays indexed by id: the id of the parent directory and the id of
+the interned name. A path therefore costs two array entries and one dictionary entry instead of a `Path` object holding its
+whole prefix. Ids hash and compare as plain integers, so sets of ids are much cheaper than sets of paths. `Path` objects are only
+created when asked for (e.g. to print or open a file).
+
+`PathStore`: Interned path table.
+"""
+# python level imports
+from array import array
+from typing import Dict, Iterable, List, Optional, Union
+from pathlib import Path, PurePath
+
+# ids of names are packed into the lower 32 bits of the (parent, name) lookup key
+NAME_BITS = 32
+
+
+class PathStore(object):
+    """
+    Table of interned paths.
+
+    `parents`: Id of the parent of each path (-1 for the file system root or the first component of a relative path).
+
+    `names`: Id of the name (last component) of each path. See `name_table`.
+
+    `name_table`: Interned names; a name's id is its index.
+    """
+
+    parents: array
+
+    names: array
+
+    name_table: List[str]
+
+    def __init__(self):
+        """Initialize an empty store."""
+        self.parents = array("q")
+        self.names = array("q")
+        self.name_table = []
+        self._name_ids: Dict[str, int] = {}
+        self._ids: Dict[int, int] = {}
+        self._children: Optional[Dict[int, List[int]]] = None
+
+    def __len__(self) -> int:
+        """Return the number of paths in the store (including all parent directories)."""
+        return len(self.parents)
+
+    def intern(self, name: str) -> int:
+        """
+        Return the id of a name, adding it to the name table if it is new.
+
+        :param name: Path component.
+
+        :returns: Id of the name.
+        """
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = len(self.name_table)
+            self.name_table.append(name)
+            self._name_ids[name] = name_id
+        return name_id
+
+    def child(self, parent: int, name: str) -> int:
+        """
+        Return the id of the entry `name` in the directory with id `parent`, adding it if it is new.
+
+        :param parent: Id of the directory (-1 for a root).
+
+        :param name: Name of the entry.
+
+        :returns: Id of the path.
+        """
+        name_id = self.intern(name)
+        key = ((parent + 1) << NAME_BITS) | name_id
+        path_id = self._ids.get(key)
+        if path_id is None:
+            path_id = len(self.parents)
+            self.parents.append(parent)
+            self.names.append(name_id)
+            self._ids[key] = path_id
+            self._children = None
+        return path_id
+
+    def add(self, path: Union[PurePath, str]) -> int:
+        """
+        Return the id of a path, adding it (and its parents) if it is new.
+
+        :param path: Path to add. Absolute paths should be used so the same file always has the same id.
+
+        :returns: Id of the path.
+        """
+        path_id = -1
+        for part in PurePath(path).parts:
+            path_id = self.child(path_id, part)
+        return path_id
+
+    def lookup(self, path: Union[PurePath, str]) -> Optional[int]:
+        """
+        Return the id of a path without adding it.
+
+        :param path: Path to look up.
+
+        :returns: Id of the path, or None if it is not in the store.
+        """
+        path_id = -1
+        for part in PurePath(path).parts:
+            name_id = self._name_ids.get(part)
+            if name_id is None:
+                return None
+            path_id = self._ids.get(((path_id + 1) << NAME_BITS) | name_id)
+            if path_id is None:
+                return None
+        return path_id
+
+    def __contains__(self, path: Union[PurePath, str]) -> bool:
+        """Return true if the path is in the store."""
+        return self.lookup(path) is not None
+
+    def name(self, path_id: int) -> str:
+        """
+        Return the name (last component) of a path.
+
+        :param path_id: Id of the path.
+
+        :returns: Name of the path.
+        """
+        return self.name_table[self.names[path_id]]
+
+    def parent(self, path_id: int) -> Optional[int]:
+        """
+        Return the id of the directory a path is in.
+
+        :param path_id: Id of the path.
+
+        :returns: Id of the parent, or None for a root.
+        """
+        parent = self.parents[path_id]
+        return parent if parent >= 0 else None
+
+    def children(self, path_id: int) -> List[int]:
+        """
+        Return the ids of the entries of a directory that are in the store.
+
+        The child index is built on first use and rebuilt after paths were added.
+
+        :param path_id: Id of the directory.
+
+        :returns: Ids of the entries, in the order they were added.
+        """
+        if self._children is None:
+            self._children = {}
+            for child_id, parent in enumerate(self.parents):
+                self._children.setdefault(parent, []).append(child_id)
+        return list(self._children.get(path_id, []))
+
+    def is_under(self, path_id: int, directory_id: int) -> bool:
+        """
+        Return true if a path is `directory_id` or inside it.
+
+        :param path_id: Id of the path.
+
+        :param directory_id: Id of the directory.
+
+        :returns: True if `directory_id` is the path or one of its parents.
+        """
+        while path_id >= 0:
+            if path_id == directory_id:
+                return True
+            path_id = self.parents[path_id]
+        return False
+
+    def path(self, path_id: int) -> Path:
+        """
+        Convert an id back to a `Path`.
+
+        :param path_id: Id of the path.
+
+        :returns: The path.
+        """
+        parts: List[str] = []
+        while path_id >= 0:
+            parts.append(self.name_table[self.names[path_id]])
+            path_id = self.parents[path_id]
+        return Path(*reversed(parts))
+
+    def paths(self, path_ids: Iterable[int]) -> List[Path]:
+        """
+        Convert ids back to `Path` objects.
+
+        :param path_ids: Ids of the paths.
+
+        :returns: List of paths, in the same order.
+        """
+        return [self.path(path_id) for path_id in path_ids]
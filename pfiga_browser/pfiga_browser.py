@@ -1,150 +1,741 @@
 #!/usr/bin/env python
 """Main file for the project."""
 # core level imports
-from typing import List, Dict
+import os
+import sys
+import copy
+import time
+import threading
+from typing import Any, Callable, Iterator, List, Dict, Optional, Set, Tuple
 from pathlib import Path
-from argparse import ArgumentParser
+from concurrent.futures import Executor, ThreadPoolExecutor
 # pfiga-browser level imports
-from pfiga_browser.parsers import ReadmeDirectoryParser, ReadmeImageParser
+from pfiga_browser.arguments import build_parser, read_manifest
 from pfiga_browser.directorywalker import DirectoryWalker
 from pfiga_browser.imageinfo import Image, ImageCollection, verify_image
-from pfiga_browser.error import ExitCode
+from pfiga_browser.error import ExitCode, OperationCancelledError
 from pfiga_browser.template import TemplateEngine
+from pfiga_browser.cache import StatCache, default_cache_dir, content_hash, index_digest
+from pfiga_browser.metadata import MetadataReader, thumbnail_width
+from pfiga_browser.duplicates import find_duplicates
+from pfiga_browser.renames import ContentIndex, detect_renames
+from pfiga_browser.gallery import GalleryBuilder
+from pfiga_browser.traversal import TocTreeWalker, normalize
+from pfiga_browser.checkpoint import Journal, journal_path
+from pfiga_browser.progress import ProgressReporter
+from pfiga_browser.filesystem import LOCAL, FileSystem, filesystem_for
+from pfiga_browser.pathstore import PathStore
+from pfiga_browser.extsort import ExternalSorter, anti_join
+from pfiga_browser.recency import TimeBudget, load_snapshot, order_by_recency, save_snapshot, snapshot_path
+from pfiga_browser.vcs import GitError, changed_paths
+from pfiga_browser.workers import process_pool
+
+
+class RunContext(object):
+    """
+    State shared by all projects processed in one invocation: the template engine, caches, and worker pools.
 
+    Sharing these means templates are compiled once, cached image metadata and hashes are looked up in one place, and
+    CPU-heavy work (thumbnails, perceptual hashes) of all projects is scheduled onto the same process pool.
 
-def main(args) -> ExitCode:
+    `cache_dir`: Directory the caches (and checkpoint journals) are stored in.
+
+    `template_engine`: Template engine used to update readmes.
+
+    `metadata_reader`: Image metadata reader; its stat cache also holds content hashes and perceptual hashes.
+
+    `content_index`: Index of the content hashes of tracked images (for rename detection).
+
+    `workers`: Number of worker processes/threads of the shared pools. None to use the executors' defaults.
+
+    `cancel`: Event that stops the toctree traversal and directory walks of all projects when set (e.g. when a check failed).
+    It stays set once a batch of projects was cancelled; callers that process several batches with the same context call
+    `start_batch` before each one, or pass their own event to `process_index`.
     """
-    Entry point for the pfiga-browser program.
+
+    cache_dir: Path
+
+    template_engine: TemplateEngine
+
+    metadata_reader: MetadataReader
+
+    content_index: ContentIndex
+
+    workers: Optional[int]
+
+    cancel: threading.Event
+
+    def __init__(self, cache_dir: Path, workers: Optional[int] = None):
+        """
+        Initialize the shared state, loading the caches from `cache_dir`.
+
+        :param cache_dir: Directory the caches are stored in.
+
+        :param workers: Optional. Number of workers of the shared pools.
+        """
+        self.cache_dir = cache_dir
+        self.template_engine = TemplateEngine()
+        self.metadata_reader = MetadataReader(
+            StatCache(cache_dir.joinpath("metadata.json")))
+        self.content_index = ContentIndex(cache_dir.joinpath("tracked.json"))
+        self.workers = workers
+        self.cancel = threading.Event()
+        self._process_pool: Optional[Executor] = None
+        self._thread_pool: Optional[Executor] = None
+        # projects are processed concurrently, so the pools are created under a lock to create each one only once
+        self._pool_lock = threading.Lock()
+
+    def start_batch(self) -> None:
+        """Clear `cancel` before processing another batch of projects, so a cancelled batch does not cancel the next one."""
+        self.cancel.clear()
+
+    @property
+    def process_pool(self) -> Executor:
+        """Shared process pool for CPU-bound work, created on first use (see `workers.process_pool`)."""
+        with self._pool_lock:
+            if self._process_pool is None:
+                self._process_pool = process_pool(self.workers)
+            return self._process_pool
+
+    @property
+    def thread_pool(self) -> Executor:
+        """Shared thread pool for I/O-bound work (e.g. hashing files), created on first use."""
+        with self._pool_lock:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(max_workers=self.workers)
+            return self._thread_pool
+
+    def close(self) -> None:
+        """Save the caches and shut down the worker pools."""
+        self.metadata_reader.cache.save()
+        self.content_index.save()
+        with self._pool_lock:
+            pools = (self._process_pool, self._thread_pool)
+            self._process_pool = None
+            self._thread_pool = None
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown()
+
+
+class ProjectReport(object):
+    """
+    Output and exit code of processing a single project.
+
+    Projects are processed concurrently, so output is collected here and printed once the project is done.
+
+    `index`: Index file of the project.
+
+    `exit_code`: Exit code of the project.
+
+    `lines`: Report lines.
+
+    `first_level_readmes`: Tracked first level readmes.
+
+    `second_level_readmes`: Tracked second level readmes.
+
+    `collections`: Map of directories to the images described in their second level readme.
+
+    `missing_images`: Map of paths of images listed in readmes that do not exist to their Image objects.
+
+    `untracked`: Untracked readmes and images found (before any updates were applied).
+
+    `remaining`: Directories a time-budgeted run (see `--time-budget`) left for the next full run, newest first.
+    """
+
+    index: Path
+
+    exit_code: ExitCode
+
+    lines: List[str]
+
+    first_level_readmes: List[Path]
+
+    second_level_readmes: List[Path]
+
+    collections: Dict[Path, ImageCollection]
+
+    missing_images: Dict[Path, Image]
+
+    untracked: List[Path]
+
+    remaining: List[Path]
+
+    def __init__(self, index: Path):
+        """
+        Initialize an empty report.
+
+        :param index: Index file of the project.
+        """
+        self.index = index
+        self.exit_code = ExitCode.NORMAL
+        self.lines = []
+        self.first_level_readmes = []
+        self.second_level_readmes = []
+        self.collections = {}
+        self.missing_images = {}
+        self.untracked = []
+        self.remaining = []
+
+    def fail(self, exit_code: ExitCode) -> None:
+        """
+        Record a problem. The first problem recorded determines the exit code.
+
+        :param exit_code: Exit code of the problem.
+        """
+        if self.exit_code == ExitCode.NORMAL:
+            self.exit_code = exit_code
+
+    def log(self, *values: Any) -> None:
+        """
+        Add a line to the report (arguments are joined like `print` does).
+
+        :param values: Values to add.
+        """
+        self.lines.append(" ".join(str(value) for value in values))
+
+    def __str__(self) -> str:
+        """Return the report as printable text."""
+        return "\n".join(self.lines)
+
+
+def process_index(index: Path, args: Any, context: RunContext, progress: Optional[Callable[[str, Path], None]] = None,
+                  scope: Optional[Set[Path]] = None, fs: Optional[FileSystem] = None,
+                  cancel: Optional[threading.Event] = None) -> ProjectReport:
+    """
+    Process a single project: parse its readmes, find untracked and missing files, and update the readmes.
 
     This is the high-level implementation of the project and is responsible for calling the lower level
     functions such as parsers, lexers, data structures, etc.
 
+    :param index: Index file of the project.
+
+    :param args: CLI arugments parsed by the argument parser.
+
+    :param context: State shared with other projects processed in the same run.
+
+    :param progress: Optional. Called with ('readme', path) for every readme parsed, ('image', path) for every image verified, ('directory', path) for every directory scanned, and ('write', path) for every readme written. Called from the thread processing the project. See `progress.ProgressReporter`.
+
+    :param scope: Optional. Only parse, verify, scan, and update these directories (like `--changed-only`, but with the directories given directly).
+
+    :param fs: Optional. File system the project is on (e.g. an archive, see `filesystem.py`). The local disk by default. Projects on read-only file systems are only checked.
+
+    :param cancel: Optional. Event that stops the project when set, and that is set when a check of the project fails (stopping the other projects sharing it). `context.cancel` by default.
+
+    :returns: Report holding the output and an exit code specifying what, if anything, went wrong. See `error.py`.
+    """
+    index = normalize(index)
+    fs = fs if fs is not None else LOCAL
+    cancel = cancel if cancel is not None else context.cancel
+    notes: List[str] = []
+
+    if not fs.writable:
+        # nothing can be updated; thumbnails, galleries, reports, and git read or write the local disk directly
+        args = copy.copy(args)
+        args.check = True
+        args.thumbnails = False
+        args.gallery = None
+        args.report = []
+        args.changed_only = False
+        args.since = None
+        notes.append("read-only file system: '%s' is only checked" % (index))
+
+    # parse results and directory listings are checkpointed, so an interrupted run can be continued with --resume;
+    # stamps of files on other file systems are not comparable between runs
+    journal: Optional[Journal] = None
+    if fs is LOCAL:
+        try:
+            journal = Journal(journal_path(context.cache_dir, index), index, resume=args.resume)
+        except OSError as ex:
+            print("could not open checkpoint journal: %s" % (ex), file=sys.stderr)
+
+    # the directories scanned by a run of the whole project are recorded, so --time-budget can order them without a walk
+    started = time.time_ns()
+    scanned: List[Path] = []
+
+    def record(kind: str, path: Path) -> None:
+        if kind == "directory":
+            scanned.append(path)
+        if progress is not None:
+            progress(kind, path)
+
+    whole = scope is None and not (args.changed_only or args.since)
+
+    complete = False
+    try:
+        with context.template_engine.observe(progress):
+            if whole and args.time_budget is not None:
+                report = _process_budgeted(index, args, context, record, journal, fs, cancel)
+            else:
+                report = _process_index(index, args, context, record if whole else progress, scope, journal, fs, cancel)
+        complete = report.exit_code == ExitCode.NORMAL and not cancel.is_set() and not report.remaining
+    finally:
+        if journal is not None:
+            journal.close(complete)
+
+    if complete and whole and fs is LOCAL:
+        save_snapshot(snapshot_path(context.cache_dir, index), index, started, scanned)
+
+    report.lines[:0] = notes
+
+    if journal is not None and journal.reused:
+        report.log("resumed: %d readmes and directories were taken from the checkpoint journal" % (journal.reused))
+
+    return report
+
+
+def _thumbnail_store(index: Path, args: Any) -> Optional[Path]:
+    """
+    Return the directory thumbnails of a project are stored in.
+
+    :param index: Normalized path to the index file of the project.
+
+    :param args: CLI arugments parsed by the argument parser.
+
+    :returns: Path to the thumbnail directory, or None if thumbnails are not used.
+    """
+    if not (args.thumbnails or args.thumbnail_dir):
+        return None
+    return Path(args.thumbnail_dir).absolute() if args.thumbnail_dir else index.parent.joinpath("_thumbnails")
+
+
+def _scan_roots(index: Path, args: Any, cancel: threading.Event, journal: Optional[Journal],
+                fs: FileSystem) -> Tuple[List[Path], List[Path]]:
+    """
+    Find the directories a scan of a project starts at, without parsing its second level readmes.
+
+    :param index: Normalized path to the index file of the project.
+
     :param args: CLI arugments parsed by the argument parser.
 
-    :returns: An exit code specifying what, if anything, went wrong. See `error.py`.
+    :param cancel: Event that stops the traversal when set.
+
+    :param journal: Checkpoint journal of the project or None.
+
+    :param fs: File system the project is on.
+
+    :raises OperationCancelledError: if `cancel` is set.
+
+    :returns: Tuple of the directories of the tracked first level readmes and the directories excluded from the scan (see `_process_index`).
+    """
+    toctree_walker = TocTreeWalker(index, use_maxdepth=args.use_maxdepth, include=lambda path: path.name != "02readme.rst",
+                                   cancel=cancel, journal=journal, fs=fs)
+    # classified like in `_process_index`
+    roots = sorted({document.path.parent for document in toctree_walker.walk() if document.path != toctree_walker.root and
+                    (document.path.name == "01readme.rst" or (document.path.name != "02readme.rst" and document.children))})
+    excluded = [path.parent for path in toctree_walker.truncated]
+    return (roots, excluded)
+
+
+def _process_budgeted(index: Path, args: Any, context: RunContext, progress: Optional[Callable[[str, Path], None]],
+                      journal: Optional[Journal], fs: FileSystem, cancel: threading.Event) -> ProjectReport:
     """
-    index: Path = Path(args.index).absolute()
-    index_parser: ReadmeDirectoryParser
-    template_engine: TemplateEngine = TemplateEngine()
+    Process a project in batches of directories, most recently modified first, until the time budget (`--time-budget`) runs out. See `recency.py`.
+
+    Each batch is a run of `_process_index` scoped to its directories (like `--changed-only`), so new readmes and images in
+    the newest directories are tracked (and written) before older directories are looked at. A batch is only started if it
+    is expected to finish within the budget; the directories left over are reported for the next full run.
+
+    :param index: Normalized path to the index file of the project.
+
+    :param args: CLI arugments parsed by the argument parser.
 
-    # validate index file
+    :param context: State shared with other projects processed in the same run.
+
+    :param progress: Progress callback or None.
+
+    :param journal: Checkpoint journal of the project or None.
+
+    :param fs: File system the project is on.
+
+    :param cancel: Event that stops the project when set.
+
+    :returns: Report of all batches; `remaining` holds the directories that were not processed.
+    """
+    report: ProjectReport = ProjectReport(index)
+    budget: TimeBudget = TimeBudget(args.time_budget)
+
+    # the directories of the last full run are ordered with one stat each; without a snapshot, the directories a full run
+    # would scan (below the first level readmes, see `scan_directories`) are walked once
+    snapshot = load_snapshot(snapshot_path(context.cache_dir, index), index) if fs is LOCAL else None
+    thumbnail_store = _thumbnail_store(index, args)
+    excluded: List[Path] = [thumbnail_store] if thumbnail_store is not None else []
     try:
-        index_parser = ReadmeDirectoryParser(index)
+        if snapshot is not None:
+            directories = order_by_recency(snapshot[1], snapshot[0], fs, cancel, excluded)
+        else:
+            roots, truncated = _scan_roots(index, args, cancel, journal, fs)
+            directories = order_by_recency(roots, -1, fs, cancel, excluded + truncated)
+    except OperationCancelledError:
+        report.log("cancelled: '%s'" % (index))
+        report.fail(ExitCode.CANCELLED)
+        return report
     except FileNotFoundError:
-        print("Error processing index: File '%s' not found" % (index))
-        return ExitCode.FILENOTFOUND
-    except Exception as ex:
-        print("Unkown error occured: ", ex)
-        return ExitCode.UNKOWN
+        # the index (or a first level readme) is missing; a normal run reports it
+        return _process_index(index, args, context, progress, None, journal, fs, cancel)
+
+    done = 0
+    while done < len(directories):
+        size = budget.next_batch(len(directories) - done)
+        if size == 0:
+            break
+        started = time.monotonic()
+        batch = _process_index(index, args, context, progress, set(directories[done:done + size]), journal, fs,
+                               cancel, summary=False)
+        budget.record(size, time.monotonic() - started)
+        done += size
+
+        report.fail(batch.exit_code)
+        report.first_level_readmes = batch.first_level_readmes
+        report.second_level_readmes = batch.second_level_readmes
+        report.collections.update(batch.collections)
+        report.missing_images.update(batch.missing_images)
+        report.untracked.extend(batch.untracked)
+        # batches leave empty sections; one blank line between the lines of a batch is enough
+        for line in batch.lines:
+            if line or (report.lines and report.lines[-1]):
+                report.lines.append(line)
+
+        # problems found by --check --all do not stop the run; --check without --all cancels it at the first one
+        if cancel.is_set() or batch.exit_code not in (ExitCode.NORMAL, ExitCode.UNTRACKED, ExitCode.MISSING):
+            if cancel.is_set():
+                report.fail(ExitCode.CANCELLED)
+            return report
+
+    if args.check:
+        report_problems(report, report.missing_images, report.untracked)
+
+    report.remaining = directories[done:]
+    report.log("time budget: %d of %d directories processed (newest first) in %.1f of %g seconds" % (
+        done, len(directories), budget.seconds - budget.remaining(), budget.seconds))
+    if report.remaining:
+        report.log("time budget: %d directories left for the next full run:" % (len(report.remaining)))
+        for directory in report.remaining[:20]:
+            report.log("    %s" % (directory))
+        if len(report.remaining) > 20:
+            report.log("    ... and %d more" % (len(report.remaining) - 20))
+
+    return report
+
+
+def _process_index(index: Path, args: Any, context: RunContext, progress: Optional[Callable[[str, Path], None]],
+                   scope: Optional[Set[Path]], journal: Optional[Journal], fs: FileSystem,
+                   cancel: threading.Event, summary: bool = True) -> ProjectReport:
+    """
+    Process a single project. See `process_index`.
 
-    # parse first level readme paths from index file
-    first_level_readme_list: List[Path] = index_parser.parse()
+    :param index: Normalized path to the index file of the project.
 
-    second_level_readme_list: List[Path] = []
+    :param args: CLI arugments parsed by the argument parser.
 
-    # parse second level readme paths from each of the first level readmes
-    for path in first_level_readme_list:
-        try:
-            # need a new parser object each time so it operates on and crafts directories correctly
-            first_level_parser: ReadmeDirectoryParser = ReadmeDirectoryParser(
-                path)
-            # add all second level readme paths to collection
-            second_level_readme_list.extend(first_level_parser.parse())
-        except FileNotFoundError:
-            print("Error processing first level readme: File '%s' not found" % (path))
-            return ExitCode.FILENOTFOUND
+    :param context: State shared with other projects processed in the same run.
 
-    image_collection_map: Dict[Path, ImageCollection] = {}
+    :param progress: Progress callback or None.
 
-    # process each second level readme and store image data found in the readme
-    for path in second_level_readme_list:
-        try:
-            # parse file using the image parser class
-            collection: ImageCollection = ReadmeImageParser(path).parse()
-            # its possible for some second level readmes to have no image data in them; need to check if the collection has items in it
-            if not collection.is_empty():
-                image_collection_map[path.parent] = collection
-        except FileNotFoundError:
-            print("Error processing second level readme: File '%s' not found" % (path))
-            return ExitCode.FILENOTFOUND
+    :param scope: Directories to process or None for all of them.
+
+    :param journal: Checkpoint journal of the project or None.
+
+    :param fs: File system the project is on.
+
+    :param cancel: Event that stops the project when set.
+
+    :param summary: Optional. Whether to list the tracked readmes (and, with `--check`, the problems found) in the report. Batches of a time-budgeted run leave this to the report of the whole run.
+
+    :returns: Report of the project.
+    """
+    report: ProjectReport = ProjectReport(index)
+    template_engine: TemplateEngine = context.template_engine
+    metadata_reader: MetadataReader = context.metadata_reader
+    content_index: ContentIndex = context.content_index
 
+    # with --changed-only/--since only directories with changes (according to git) are parsed, verified, scanned, and updated
+    if scope is None and (args.changed_only or args.since):
+        try:
+            scope = {path.parent for path in changed_paths(index.parent, args.since)}
+            report.log("changed-only: %d changed directories" % (len(scope)))
+        except GitError as ex:
+            report.log("changed-only: %s; processing the whole project" % (ex))
+
+    def in_scope(path: Path) -> bool:
+        # first level readmes are always parsed, they are needed to tell which second level readmes are tracked
+        return path.name != "02readme.rst" or path.parent in scope
+
+    # follow toctrees from the index to any depth; every readme is parsed once for both its toctree entries and its images
+    toctree_walker: TocTreeWalker = TocTreeWalker(index, use_maxdepth=args.use_maxdepth,
+                                                  include=in_scope if scope is not None else None,
+                                                  cancel=cancel, journal=journal, fs=fs)
+    index = toctree_walker.root
+
+    first_level_readme_list: List[Path] = []
+    second_level_readme_list: List[Path] = []
+    image_collection_map: Dict[Path, ImageCollection] = {}
     image_readme_list: List[Path] = []
+    missing_images: Dict[Path, Image] = {}
+
+    report.first_level_readmes = first_level_readme_list
+    report.second_level_readmes = second_level_readme_list
+    report.collections = image_collection_map
+    report.missing_images = missing_images
+
+    try:
+        for document in toctree_walker.walk():
+            if progress is not None:
+                progress("readme", document.path)
+            if document.path == index:
+                continue
+            # TODO config.py: update readme names to be user configurable
+            # readmes are classified by name; readmes with other names are second level readmes unless they list other readmes
+            if document.path.name == "02readme.rst" or (document.path.name != "01readme.rst" and not document.children):
+                second_level_readme_list.append(document.path)
+                # its possible for some second level readmes to have no image data in them; need to check if the collection has items in it
+                if not document.collection.is_empty():
+                    image_collection_map[document.path.parent] = document.collection
+
+                # verify images found in the file are present on disk (as soon as the readme is parsed, so a check can stop early)
+                for image in document.collection.collection:
+                    path = document.path.parent / str(image)
+                    if progress is not None:
+                        progress("image", path)
+                    if verify_image(image, document.path.parent, fs):
+                        image_readme_list.append(path)
+                    else:
+                        missing_images[path] = image
+                        if args.check:
+                            report.fail(ExitCode.MISSING)
+                        if args.check and not args.all:
+                            report.log("could not find image: '%s' on path: '%s'" % (image, path.parent))
+                            cancel.set()
+                            return report
+            else:
+                first_level_readme_list.append(document.path)
+    except OperationCancelledError:
+        report.log("cancelled: '%s'" % (index))
+        report.fail(ExitCode.CANCELLED)
+        return report
+    except FileNotFoundError:
+        report.log("Error processing index: File '%s' not found" % (index))
+        report.exit_code = ExitCode.FILENOTFOUND
+        return report
+    except Exception as ex:
+        report.log("Unkown error occured: ", ex)
+        report.exit_code = ExitCode.UNKOWN
+        return report
 
-    for path, collection in image_collection_map.items():
-        image_readme_list.extend([path.joinpath(str(image))
-                                 for image in collection.collection])
+    if toctree_walker.missing:
+        for parent, path in toctree_walker.missing:
+            report.log("Error processing readme: File '%s' (listed in '%s') not found" % (path, parent))
+        report.exit_code = ExitCode.FILENOTFOUND
+        return report
 
-    # verify images found in the file are present on disk
-    for path, collection in image_collection_map.items():
-        for image in collection.collection:
-            image_valid = verify_image(image, path)
-            if not image_valid:
-                image_readme_list.remove(path / str(image))
-                print("could not find image: '%s' on path: '%s'" %
-                      (image, path))
+    # edits are planned against the parsed readmes; a readme changed by another process before it is updated is parsed again
+    for path, document in toctree_walker.documents.items():
+        template_engine.expect(path, document.version)
 
-    # TODO directorywalker.py, parsers.py, template.py: search for first and second level readme files that aren't being tracked and update relevant files
-    all_first_level_readmes: List[Path] = []
-    all_second_level_readmes: List[Path] = []
-    all_images: List[Path] = []
+    # readmes outside of the scope are tracked, they just aren't looked at
+    second_level_readme_list.extend(sorted(toctree_walker.skipped))
 
-    # scan paths from top level (retrieved from index) for any untracked first and second level readmes
-    for path in first_level_readme_list:
-        directory_walkler = DirectoryWalker(path.parent)
+    for parent, path in toctree_walker.cycles:
+        report.log("found toctree cycle: '%s' lists '%s'" % (parent, path))
 
-        # TODO config.py: update first level readme name to be user configurable
-        all_first_level_readmes.extend(
-            directory_walkler.first_level_paths("01readme.rst"))
+    # with --use-maxdepth, readmes beyond a toctree's maxdepth are not followed and their directories are not scanned
+    for path in sorted(toctree_walker.truncated):
+        report.log("not followed (beyond :maxdepth:): '%s'; its directory is not scanned" % (path))
 
-        # TODO config.py: update second level readme name to be user configurable
-        all_second_level_readmes.extend(
-            directory_walkler.second_level_paths("02readme.rst"))
+    # TODO directorywalker.py, parsers.py, template.py: search for first and second level readme files that aren't being tracked and update relevant files
+    all_first_level_readmes: List[Path] = []
+    all_second_level_readmes: List[Path] = []
 
-        # TODO config.py: update image suffixes to be user configurable
-        all_images.extend(directory_walkler.find_all_images(
-            exts=[".png", ".odg", ".svg"]))
+    thumbnail_store: Optional[Path] = _thumbnail_store(index, args)
+
+    # readmes beyond a toctree's maxdepth (--use-maxdepth) are tracked but out of scope, so nothing below them is reported as untracked;
+    # generated thumbnails are never project images
+    excluded_dirs: List[Path] = [path.parent for path in toctree_walker.truncated]
+    if thumbnail_store is not None:
+        excluded_dirs.append(thumbnail_store)
+
+    # paths are interned, so found files are compared to tracked files as integer ids and `Path` objects are only
+    # created for the files that need one (e.g. untracked images); with --low-memory, found and tracked files are instead
+    # written to sorted runs on disk and compared after the walk (see below)
+    path_store: PathStore = PathStore()
+    tracked: Set[int] = set()
+    image_ids: List[int] = []
+    untracked_image_ids: List[int] = []
+    found_files: Optional[ExternalSorter] = None
+    tracked_files: Optional[ExternalSorter] = None
+    if args.low_memory:
+        found_files = ExternalSorter()
+        tracked_files = ExternalSorter()
+        for path in first_level_readme_list + second_level_readme_list + image_readme_list:
+            tracked_files.add((str(path.parent), path.name))
+    else:
+        tracked = {path_store.add(path) for path in
+                   first_level_readme_list + second_level_readme_list + image_readme_list}
+
+    # scan paths from top level (retrieved from index) for any untracked first and second level readmes and images;
+    # directories are checked as they are found, so a check can stop at the first untracked file
+    scan_roots: List[Path] = sorted({path.parent for path in first_level_readme_list})
+    # each directory is listed once (or taken from the journal); the walk reuses the listing to find its subdirectories
+    subdirs: Dict[Path, List[str]] = {}
+    try:
+        for directory_walker, directory in scan_directories(scan_roots, scope, cancel,
+                                                            lambda path: subdirs.pop(path, None), fs):
+            if in_dirs(directory, excluded_dirs):
+                continue
+            if progress is not None:
+                progress("directory", directory)
+
+            # TODO config.py: update readme names and image suffixes to be user configurable
+            listing = journal.directory(directory) if journal is not None else None
+            if listing is None:
+                listing = directory_walker.list_directory(directory, names=["01readme.rst", "02readme.rst"],
+                                                          exts=[".png", ".odg", ".svg"])
+                if journal is not None:
+                    journal.record_directory(directory, *listing)
+            subdirs[directory] = listing[0]
+
+            # with --low-memory the tracked files are only on disk, sorted; they cannot be probed per directory, so
+            # untracked files (and the first one, for --check) are only found by the merge join after the walk
+            if found_files is not None:
+                for name in listing[1]:
+                    found_files.add((str(directory), name))
+                continue
+
+            directory_id = path_store.add(directory)
+            untracked: List[Path] = []
+            for name, readmes in (("01readme.rst", all_first_level_readmes), ("02readme.rst", all_second_level_readmes)):
+                if name in listing[1]:
+                    readmes.append(directory.joinpath(name))
+                    if path_store.child(directory_id, name) not in tracked:
+                        untracked.append(directory.joinpath(name))
+
+            ids = [path_store.child(directory_id, name) for name in listing[1] if not name.endswith(".rst")]
+            image_ids.extend(ids)
+            ids = [path_id for path_id in ids if path_id not in tracked]
+            untracked_image_ids.extend(ids)
+            untracked.extend(path_store.paths(ids))
+
+            if untracked and args.check:
+                report.fail(ExitCode.UNTRACKED)
+                if not args.all:
+                    report.log("found untracked file: '%s'" % (untracked[0]))
+                    cancel.set()
+                    return report
+    except OperationCancelledError:
+        report.log("cancelled: '%s'" % (index))
+        report.fail(ExitCode.CANCELLED)
+        return report
+
+    # all images are only needed as paths for thumbnails and reports
+    need_all_images: bool = (args.thumbnails and not args.check) or bool(args.report)
+
+    if found_files is not None and tracked_files is not None:
+        # streaming merge join of the files found on disk and the tracked files; only untracked files are kept in memory
+        untracked_first_level_readmes: List[Path] = []
+        untracked_second_level_readmes: List[Path] = []
+        untracked_image_paths: List[Path] = []
+        levels = {"01readme.rst": untracked_first_level_readmes, "02readme.rst": untracked_second_level_readmes}
+        for directory, name in anti_join(found_files.sorted(), tracked_files.sorted(), key=lambda record: record):
+            levels.get(name, untracked_image_paths).append(Path(directory, name))
+
+        # same order as the directory walk
+        untracked_first_level_readmes.sort()
+        untracked_second_level_readmes.sort()
+        untracked_image_paths.sort(key=lambda path: (path.parent.parts, path.name))
+
+        all_images: List[Path] = [Path(directory, name) for directory, name in found_files.sorted()
+                                  if name not in levels] if need_all_images else []
+        all_images.sort(key=lambda path: (path.parent.parts, path.name))
+        found_files.close()
+        tracked_files.close()
+
+        if untracked_first_level_readmes or untracked_second_level_readmes or untracked_image_paths:
+            if args.check:
+                report.fail(ExitCode.UNTRACKED)
+                if not args.all:
+                    report.log("found untracked file: '%s'" % ((
+                        untracked_first_level_readmes + untracked_second_level_readmes + untracked_image_paths)[0]))
+                    cancel.set()
+                    return report
+    else:
+        # find untracked first and second level readmes
+        all_first_level_readmes.sort()
+        all_second_level_readmes.sort()
+        untracked_first_level_readmes = [
+            path for path in all_first_level_readmes if path_store.add(path) not in tracked]
+        untracked_second_level_readmes = [
+            path for path in all_second_level_readmes if path_store.add(path) not in tracked]
+
+        untracked_image_paths = path_store.paths(untracked_image_ids)
+
+        all_images = path_store.paths(image_ids) if need_all_images else []
+
+    thumbnails: Dict[Path, Path] = {}
+
+    # create thumbnails for all images (only images that have changed since the last run are processed)
+    if args.thumbnails and not args.check:
+        # numpy is only required when thumbnails are requested
+        from pfiga_browser.thumbnail import ThumbnailGenerator
+
+        thumbnails = ThumbnailGenerator(
+            thumbnail_store, cache=metadata_reader.cache).generate(all_images, context.process_pool)
 
     # TODO add user options to automatically update untracked files (does this by default at the moment)
 
-    untracked_first_level_readmes: List[Path] = []
-    untracked_second_level_readmes: List[Path] = []
     untracked_images: Dict[Path, List[Image]] = {}
 
-    # find untracked first level readmes
-    for path in all_first_level_readmes:
-        if path not in first_level_readme_list:
-            untracked_first_level_readmes.append(path)
-
-    # find untracked second level readmes
-    for path in all_second_level_readmes:
-        if path not in second_level_readme_list:
-            untracked_second_level_readmes.append(path)
-
-    # find untracked images
-    for image in all_images:
-        if image not in image_readme_list:
-            if image.parent in untracked_images.keys():
-                untracked_images[image.parent].append(Image(uri=image.name))
-            else:
-                untracked_images[image.parent] = [Image(uri=image.name)]
-
-    # update index with untracked first level readmes
-    if untracked_first_level_readmes:
-        template_engine.update_index(untracked_first_level_readmes, index)
-
-    # TODO: update first level readmes with untracked second level readmes
-    if untracked_second_level_readmes:
-        for first_level_readme in first_level_readme_list:
-            readmes2add: List[Path] = []
-            for second_level_readme in untracked_second_level_readmes:
-                try:
-                    relative_path = second_level_readme.relative_to(
-                        first_level_readme.parent)
-                    readmes2add.append(relative_path)
-                except ValueError:
-                    continue
+    report.untracked = untracked_first_level_readmes + untracked_second_level_readmes + untracked_image_paths
+
+    # --check never touches files; everything below only reports (renames are reported as missing and untracked images)
+    if args.check:
+        if summary:
+            report_problems(report, missing_images, report.untracked)
+        return report
+
+    # a missing image and an untracked image with the same content are a rename; keep the existing entry and description
+    renames = detect_renames(missing_images, untracked_image_paths,
+                             content_index, metadata_reader.cache)
+
+    for rename in renames:
+        readme = rename.old.parent.joinpath("02readme.rst")
+        if rename.is_move:
+            template_engine.move_image(rename.image.uri, rename.new.name,
+                                       readme, rename.new.parent.joinpath("02readme.rst"))
+        else:
+            template_engine.rename_image(
+                rename.image.uri, rename.new.name, readme)
+        del missing_images[rename.old]
+        content_index.forget(rename.old)
+        untracked_image_paths.remove(rename.new)
+        image_readme_list.append(rename.new)
+
+    # find untracked images; thumbnail widths are chosen from the real image dimensions (read from the file header)
+    for image in untracked_image_paths:
+        untracked_image = Image(uri=image.name, width=thumbnail_width(
+            metadata_reader.size(image)))
+        if image in thumbnails:
+            untracked_image.thumbnail = Path(
+                os.path.relpath(thumbnails[image], image.parent)).as_posix()
+        if image.parent in untracked_images.keys():
+            untracked_images[image.parent].append(untracked_image)
+        else:
+            untracked_images[image.parent] = [untracked_image]
+
+    # record the content of every tracked image (and every image about to be tracked) so future renames can be detected
+    for image in image_readme_list + untracked_image_paths:
+        content_index.record(image, content_hash(image, metadata_reader.cache))
+
+    # add untracked readmes to the toctree of the nearest tracked first level readme above them (or the index)
+    readme_additions: Dict[Path, List[Path]] = {}
+    for path in untracked_first_level_readmes + untracked_second_level_readmes:
+        readme_additions.setdefault(toctree_parent(path, first_level_readme_list, index), []).append(path)
+
+    for parent, paths in readme_additions.items():
+        if parent == index:
+            template_engine.update_index(paths, index)
+        else:
             template_engine.update_first_level_readme(
-                readmes2add, first_level_readme)
+                [path.relative_to(parent.parent) for path in paths], parent)
 
     # update second level readmes with untracked images
     if untracked_images:
@@ -152,51 +743,255 @@ def main(args) -> ExitCode:
             template_engine.update_images(
                 images, directory.joinpath("02readme.rst"))
 
+    # render the gallery; only pages whose readme or images changed since the last build are rewritten. The pages of
+    # each project go to their own subdirectory, so several projects can share the gallery
+    if args.gallery:
+        gallery_files = GalleryBuilder(Path(args.gallery).absolute(), index.parent, template_engine,
+                                       project=index_digest(index)).build(
+            second_level_readme_list + untracked_second_level_readmes)
+
     # TODO: move info logging to logging module (logging.py?)
 
-    print("index: ", index, end="\n\n")
+    if summary:
+        report.log("index: ", index)
+        report.log()
+
+        report.log("first level readmes:")
+        for path in first_level_readme_list:
+            report.log(path)
+        report.log()
+
+        report.log("second level readmes:")
+        for path in second_level_readme_list:
+            report.log(path)
+        report.log()
+
+        report.log("image collection map:")
+        for path, collection in image_collection_map.items():
+            report.log("%s: %s" % (path, collection))
+        report.log()
+
+    for path, image in missing_images.items():
+        report.log("could not find image: '%s' on path: '%s'" % (image, path.parent))
+    report.log()
+
+    for rename in renames:
+        report.log("found %s image: '%s'" % ("moved" if rename.is_move else "renamed", rename))
+    report.log()
+
+    for path in untracked_first_level_readmes:
+        report.log("found untracked first level readme: '%s'" % (path))
+    report.log()
 
-    print("first level readmes:")
-    for path in first_level_readme_list:
-        print(path)
-    print()
+    for path in untracked_second_level_readmes:
+        report.log("found untracked second level readme: '%s'" % (path))
+    report.log()
 
-    print("second level readmes:")
-    for path in second_level_readme_list:
-        print(path)
-    print()
+    for image in untracked_image_paths:
+        report.log("found untracked image: '%s'" % (image))
+    report.log()
 
-    print("image collection map:")
-    for path, collection in image_collection_map.items():
-        print("%s: %s" % (path, collection))
-    print()
+    if args.gallery:
+        report.log("gallery: %d files written to '%s'" % (len(gallery_files), args.gallery))
+        report.log()
 
-    for path in all_first_level_readmes:
-        if path not in first_level_readme_list:
-            print("found untracked first level readme: '%s'" % (path))
-    print()
+    if "duplicates" in args.report:
+        report.log("duplicate images:")
+        report.log(find_duplicates(all_images, metadata_reader.cache,
+                               executor=context.thread_pool))
+        report.log()
 
-    for path in all_second_level_readmes:
-        if path not in second_level_readme_list:
-            print("found untracked second level readme: '%s'" % (path))
-    print()
+    if "near-duplicates" in args.report:
+        # numpy is only required when near-duplicates are requested
+        from pfiga_browser.similarity import find_near_duplicates
 
-    for image in all_images:
-        if image not in image_readme_list:
-            print("found untracked image: '%s'" % (image))
-    print()
+        report.log("near-duplicate images:")
+        report.log(find_near_duplicates(all_images, metadata_reader.cache,
+                                        max_distance=args.max_distance, executor=context.process_pool))
+        report.log()
 
     # TODO directorywalker.py, template.py: search directories for images that aren't being tracked by existing second level readmes and update or create one if it doesn't exist
 
+    return report
+
+
+def scan_directories(roots: List[Path], scope: Optional[Set[Path]], cancel: Optional[threading.Event] = None,
+                     subdirs: Optional[Callable[[Path], Optional[List[str]]]] = None,
+                     fs: Optional[FileSystem] = None) -> Iterator[Tuple[DirectoryWalker, Path]]:
+    """
+    Yield the directories to look for untracked readmes and images in.
+
+    :param roots: Directories of the tracked first level readmes. Nested roots are covered by the walk of their parent.
+
+    :param scope: Directories with changes (see `--changed-only`), or None to walk all directories below `roots`.
+
+    :param cancel: Optional. Event that stops the walk when set.
+
+    :param subdirs: Optional. Returns the subdirectories of a directory if they are already known. See `DirectoryWalker.iter_dirs`.
+
+    :param fs: Optional. File system to walk. The local disk by default.
+
+    :raises OperationCancelledError: if `cancel` is set.
+
+    :returns: Iterator over pairs of a directory walker and a directory to scan with it.
+    """
+    if scope is not None:
+        for directory in sorted(scope):
+            if (fs if fs is not None else LOCAL).is_dir(directory) and in_dirs(directory, roots):
+                yield (DirectoryWalker(directory, cancel, fs), directory)
+        return
+
+    for root in roots:
+        if any(other in root.parents for other in roots):
+            continue
+        directory_walker = DirectoryWalker(root, cancel, fs)
+        for directory in directory_walker.iter_dirs(subdirs):
+            yield (directory_walker, directory)
+
+
+def report_problems(report: ProjectReport, missing_images: Dict[Path, Image], untracked: List[Path]) -> None:
+    """
+    Add the problems found by `--check --all` to a report.
+
+    :param report: Report of the project.
+
+    :param missing_images: Images listed in readmes that do not exist.
+
+    :param untracked: Untracked readmes and images.
+    """
+    for path, image in missing_images.items():
+        report.log("could not find image: '%s' on path: '%s'" % (image, path.parent))
+    for path in untracked:
+        report.log("found untracked file: '%s'" % (path))
+    report.log("check: %d missing images, %d untracked files" % (len(missing_images), len(untracked)))
+
+
+def toctree_parent(readme: Path, first_level_readmes: List[Path], index: Path) -> Path:
+    """
+    Find the readme whose toctree an untracked readme should be added to.
+
+    :param readme: Untracked first or second level readme.
+
+    :param first_level_readmes: Tracked first level readmes.
+
+    :param index: Project index (used if no first level readme is above `readme`).
+
+    :returns: The first level readme in the nearest parent directory of `readme`, or `index`.
+    """
+    parents: Dict[Path, Path] = {path.parent: path for path in first_level_readmes if path != readme}
+    # a first level readme is listed by the first level readme of a parent directory, not the one in its own directory
+    directories = readme.parents[1:] if readme.name == "01readme.rst" else readme.parents
+
+    for directory in directories:
+        if directory in parents:
+            return parents[directory]
+        if directory == index.parent:
+            break
+
+    return index
+
+
+def in_dirs(path: Path, directories: List[Path]) -> bool:
+    """
+    Return true if `path` is inside (or is) one of `directories`.
+
+    :param path: Path to check.
+
+    :param directories: Directories to check against.
+    """
+    return any(directory == path or directory in path.parents for directory in directories)
+
+
+def main(args) -> ExitCode:
+    """
+    Entry point for the pfiga-browser program.
+
+    Every index given on the command line or listed in a manifest is processed as a separate project. Projects run
+    concurrently on a thread pool and share one `RunContext`, so templates, caches, and worker pools are set up once per
+    invocation and CPU-heavy work of all projects is spread over the same process pool. Each project's report is printed
+    once it finishes (in the order the indexes were given), followed by a summary of the exit codes of all projects.
+
+    :param args: CLI arugments parsed by the argument parser.
+
+    :returns: The exit code of the first project that failed, or `ExitCode.NORMAL` if all succeeded.
+    """
+    indexes: List[Path] = [Path(index).absolute() for index in args.index]
+
+    for manifest in args.manifest:
+        try:
+            indexes.extend(read_manifest(Path(manifest).absolute()))
+        except FileNotFoundError:
+            print("Error processing manifest: File '%s' not found" % (manifest))
+            return ExitCode.FILENOTFOUND
+
+    # the same project listed twice would update its readmes twice
+    indexes = list(dict.fromkeys(indexes))
+
+    if not indexes:
+        print("Error: no index file given")
+        return ExitCode.FILENOTFOUND
+
+    cache_dir: Path = Path(args.cache_dir) if args.cache_dir else default_cache_dir()
+    context: RunContext = RunContext(cache_dir)
+    reports: List[ProjectReport] = []
+
+    # progress goes to stderr, so it does not mix with the reports
+    reporter: Optional[ProgressReporter] = ProgressReporter(
+        cache_dir, indexes, stream=sys.stderr) if args.progress else None
+
+    # projects inside zip and tar archives are read in place
+    filesystems: Dict[Path, FileSystem] = {}
+    for index in indexes:
+        try:
+            filesystems[index] = filesystem_for(index)
+        except (OSError, ValueError) as ex:
+            print("Error opening archive of '%s': %s" % (index, ex))
+            for fs in filesystems.values():
+                fs.close()
+            return ExitCode.FILENOTFOUND
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.jobs or len(indexes)) as executor:
+            for report in executor.map(lambda index: process_index(
+                    index, args, context, reporter.callback(index) if reporter is not None else None,
+                    fs=filesystems[index]), indexes):
+                print(report)
+                reports.append(report)
+    except KeyboardInterrupt:
+        # stop the other projects at their next readme or directory instead of waiting for them to finish
+        context.cancel.set()
+        raise
+    finally:
+        context.close()
+        for fs in filesystems.values():
+            fs.close()
+
+    if reporter is not None:
+        # only runs over whole projects give the totals the next run is estimated from; --changed-only, --since, and
+        # --time-budget runs only process part of a project
+        whole = not (args.changed_only or args.since or args.time_budget is not None)
+        reporter.finish([index for index, report in zip(indexes, reports) if whole and report.exit_code == ExitCode.NORMAL
+                         and not context.cancel.is_set() and not report.remaining])
+
+    if len(reports) > 1:
+        print("projects:")
+        for report in reports:
+            print("%s: %s" % (report.index, report.exit_code.name))
+        print()
+
+    # projects are only cancelled because of a problem found in another project (or an interrupt), so that problem comes first
+    for report in reports:
+        if report.exit_code not in (ExitCode.NORMAL, ExitCode.CANCELLED):
+            return report.exit_code
+    for report in reports:
+        if report.exit_code != ExitCode.NORMAL:
+            return report.exit_code
+
     return ExitCode.NORMAL
 
 
 def run() -> int:
-    # TODO document/add CLI arguments
-    # TODO move argument parser to its own file (arguments.py?)
-    argparser = ArgumentParser()
-    argparser.add_argument("index")
-    args = argparser.parse_args()
+    args = build_parser().parse_args()
 
     exit_code = main(args)
 
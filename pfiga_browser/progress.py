@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"""
+Live progress of long runs: directories walked (and how fast), readmes parsed, images verified, and files written.
+
+`process_index` reports every readme parsed ('readme'), image verified ('image'), directory scanned ('directory'), and
+readme written ('write') to its `progress` callback. `ProgressReporter` counts these events for all projects of a run and,
+at most every `interval` seconds, prints a status line to a stream (stderr for `--progress`) and/or passes a
+`ProgressStatus` to a callback. The estimated time left is based on the number of directories and readmes of the
+previous run of the same projects, which is stored in the cache directory.
+
+`ProgressStatus`: Counters, throughput, and estimated time left of a run.
+
+`ProgressReporter`: Collects progress events and reports them, rate limited.
+"""
+# python level imports
+import time
+import threading
+from typing import Callable, Dict, IO, Iterable, Optional
+from pathlib import Path
+# pfiga-browser level imports
+from pfiga_browser.cache import cache_lock, read_json, write_json
+
+# kinds of progress events counted; see `process_index`
+KINDS = ("directory", "readme", "image", "write")
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Format a duration as 'h:mm:ss' (or 'm:ss' below an hour).
+
+    :param seconds: Duration in seconds.
+
+    :returns: Formatted duration.
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "%d:%02d:%02d" % (hours, minutes, seconds)
+    return "%d:%02d" % (minutes, seconds)
+
+
+class ProgressStatus(object):
+    """
+    Counters, throughput, and estimated time left of a run at one point in time.
+
+    `counts`: Map of event kinds ('directory', 'readme', 'image', 'write') to the number of events so far.
+
+    `elapsed`: Seconds since the run started.
+
+    `eta`: Estimated seconds left, or None if unknown (no previous run, or more work than in the previous run).
+
+    `done`: Whether the run has finished.
+    """
+
+    counts: Dict[str, int]
+
+    elapsed: float
+
+    eta: Optional[float]
+
+    done: bool
+
+    def __init__(self, counts: Dict[str, int], elapsed: float, eta: Optional[float], done: bool = False):
+        """
+        Initialize with the counters and times.
+
+        :param counts: Number of events of each kind.
+
+        :param elapsed: Seconds since the run started.
+
+        :param eta: Estimated seconds left or None.
+
+        :param done: Optional. Whether the run has finished.
+        """
+        self.counts = counts
+        self.elapsed = elapsed
+        self.eta = eta
+        self.done = done
+
+    @property
+    def directories_per_second(self) -> float:
+        """Number of directories walked per second."""
+        return self.counts["directory"] / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        """Return the status as a single line."""
+        text = "%d directories (%.1f/s), %d readmes, %d images verified, %d files written, %s elapsed" % (
+            self.counts["directory"], self.directories_per_second, self.counts["readme"], self.counts["image"],
+            self.counts["write"], format_duration(self.elapsed))
+        if self.eta is not None and not self.done:
+            text += ", ETA %s" % (format_duration(self.eta))
+        return text
+
+
+class ProgressReporter(object):
+    """
+    Collects the progress events of all projects of a run and reports them at most every `interval` seconds.
+
+    Usage::
+
+        reporter = ProgressReporter(cache_dir, indexes, stream=sys.stderr)
+        report = process_index(index, args, context, reporter.callback(index))
+        reporter.finish([index] if report.exit_code == ExitCode.NORMAL else [])
+
+    `path`: JSON file holding the totals of the previous run of each project. None to not estimate the time left.
+
+    `stream`: Stream the status line is written to. None to not write it.
+
+    `on_status`: Called with a `ProgressStatus` whenever the status is reported. None if not needed.
+
+    `interval`: Minimum number of seconds between two reports.
+
+    `counts`: Map of index files to the number of events of each kind so far.
+
+    `previous`: Map of index files to the number of events of each kind of their previous run.
+    """
+
+    path: Optional[Path]
+
+    stream: Optional[IO[str]]
+
+    on_status: Optional[Callable[[ProgressStatus], None]]
+
+    interval: float
+
+    counts: Dict[Path, Dict[str, int]]
+
+    previous: Dict[str, Dict[str, int]]
+
+    def __init__(self, cache_dir: Optional[Path], indexes: Iterable[Path], stream: Optional[IO[str]] = None,
+                 on_status: Optional[Callable[[ProgressStatus], None]] = None, interval: float = 0.5):
+        """
+        Initialize the counters and load the totals of the previous run.
+
+        :param cache_dir: Directory the totals of previous runs are stored in. None to not estimate the time left.
+
+        :param indexes: Index files of the projects of the run.
+
+        :param stream: Optional. Stream to write the status line to (e.g. `sys.stderr`).
+
+        :param on_status: Optional. Callback that receives each status.
+
+        :param interval: Optional. Minimum number of seconds between two reports. Defaults to half a second.
+        """
+        self.path = cache_dir.joinpath("progress.json") if cache_dir is not None else None
+        self.stream = stream
+        self.on_status = on_status
+        self.interval = interval
+        self.counts = {index: dict.fromkeys(KINDS, 0) for index in indexes}
+        self.previous = {}
+        self._started = time.monotonic()
+        self._reported = 0.0
+        self._lock = threading.Lock()
+        # a status line on a terminal is redrawn in place; other streams get one line per report
+        self._redraw = stream is not None and stream.isatty()
+
+        if self.path is not None:
+            previous = read_json(self.path)
+            self.previous = previous if isinstance(previous, dict) else {}
+
+    def callback(self, index: Path) -> Callable[[str, Path], None]:
+        """
+        Return the progress callback for one project, to pass to `process_index`.
+
+        :param index: Index file of the project.
+
+        :returns: Callback taking the kind of event and the path it is about.
+        """
+        counts = self.counts.setdefault(index, dict.fromkeys(KINDS, 0))
+
+        def progress(kind: str, path: Path) -> None:
+            # increments of different projects' counters do not conflict; only reporting is serialized
+            counts[kind] = counts.get(kind, 0) + 1
+            if time.monotonic() - self._reported >= self.interval:
+                self.report()
+
+        return progress
+
+    def status(self, done: bool = False) -> ProgressStatus:
+        """
+        Return the current status of the run.
+
+        :param done: Optional. Whether the run has finished.
+
+        :returns: Counters, elapsed time, and estimated time left.
+        """
+        counts = dict.fromkeys(KINDS, 0)
+        for project in list(self.counts.values()):
+            for kind in KINDS:
+                counts[kind] += project.get(kind, 0)
+        elapsed = time.monotonic() - self._started
+
+        # directories and readmes take most of the time of a run; images and writes follow from them
+        eta: Optional[float] = None
+        previous = [self.previous.get(str(index)) for index in self.counts]
+        if previous and all(totals is not None for totals in previous):
+            expected = sum(totals.get("directory", 0) + totals.get("readme", 0) for totals in previous)
+            finished = counts["directory"] + counts["readme"]
+            if 0 < finished <= expected:
+                eta = (expected - finished) * elapsed / finished
+
+        return ProgressStatus(counts, elapsed, eta, done)
+
+    def report(self, done: bool = False) -> None:
+        """
+        Report the current status to the stream and the callback.
+
+        :param done: Optional. Whether the run has finished (the status line is then ended).
+        """
+        with self._lock:
+            self._reported = time.monotonic()
+            status = self.status(done)
+            if self.stream is not None:
+                if self._redraw:
+                    self.stream.write("\r\033[Kprogress: %s%s" % (status, "\n" if done else ""))
+                else:
+                    self.stream.write("progress: %s\n" % (status))
+                self.stream.flush()
+            if self.on_status is not None:
+                self.on_status(status)
+
+    def finish(self, completed: Iterable[Path]) -> None:
+        """
+        Report the final status and store the totals of the projects that were processed completely, for the estimate of the next run.
+
+        :param completed: Index files of the projects that were processed completely (totals of cancelled or failed projects, or of runs over part of a project, would skew the estimate).
+        """
+        self.report(done=True)
+
+        if self.path is None:
+            return
+
+        try:
+            # totals of projects other processes finished in the meantime are kept
+            with cache_lock(self.path):
+                previous = read_json(self.path)
+                totals = previous if isinstance(previous, dict) else {}
+                for index in completed:
+                    if index in self.counts:
+                        totals[str(index)] = self.counts[index]
+                write_json(self.path, totals)
+            self.previous = totals
+        except OSError:
+            # the totals only improve the estimate
+            pass
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""
+Recency-ordered, time-budgeted processing of a project (see `--time-budget`).
+
+New figures almost always land in recently modified directories, so a time-budgeted run processes the directories of a
+project newest first, in batches, and stops when the budget runs out; the directories it did not get to are left for the
+next full run. The directories of a project are taken from the snapshot written by its last full run, so ordering them
+takes one `stat` per directory; only directories modified since the snapshot are listed, to find directories created since.
+
+`TimeBudget`: Deadline of a run and the size of its next batch.
+
+`snapshot_path`: Path of the directory snapshot of a project.
+
+`load_snapshot`: Read the directories recorded by the last full run of a project.
+
+`save_snapshot`: Record the directories scanned by a full run of a project.
+
+`order_by_recency`: Order directories by modification time, newest first.
+"""
+# python level imports
+import time
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from pathlib import Path
+# pfiga-browser level imports
+from pfiga_browser.cache import cache_lock, index_digest, read_json, write_json
+from pfiga_browser.error import OperationCancelledError
+from pfiga_browser.filesystem import FileSystem
+
+# number of directories processed by the first batch of a time-budgeted run (always processed, however small the budget)
+FIRST_BATCH = 16
+
+
+class TimeBudget(object):
+    """
+    Deadline of a time-budgeted run and the size of its next batch.
+
+    Batches are sized from the time the previous batches took per directory, so a batch is only started if it is expected to
+    finish within the budget. The estimate includes the fixed cost of a batch (parsing the first level readmes), so it is on
+    the safe side for larger batches; batches grow at most twice as large as the previous one to limit the cost of a bad estimate.
+
+    `seconds`: Length of the budget.
+
+    `deadline`: Time (`time.monotonic`) the budget runs out.
+
+    `rate`: Seconds per directory measured so far, or None before the first batch.
+
+    `batch`: Size of the latest batch.
+    """
+
+    seconds: float
+
+    deadline: float
+
+    rate: Optional[float]
+
+    batch: int
+
+    def __init__(self, seconds: float, clock: Callable[[], float] = time.monotonic):
+        """
+        Start the budget.
+
+        :param seconds: Length of the budget.
+
+        :param clock: Optional. Monotonic clock. `time.monotonic` by default.
+        """
+        self.seconds = seconds
+        self.deadline = clock() + seconds
+        self.rate = None
+        self.batch = 0
+        self._clock = clock
+
+    def remaining(self) -> float:
+        """Return the seconds left (negative once the budget ran out)."""
+        return self.deadline - self._clock()
+
+    def next_batch(self, pending: int) -> int:
+        """
+        Return the number of directories to process next.
+
+        :param pending: Number of directories not processed yet.
+
+        :returns: Size of the next batch; 0 if not even one directory is expected to fit in the time left.
+        """
+        if self.rate is None:
+            size = FIRST_BATCH
+        else:
+            size = min(2 * self.batch, int(self.remaining() / self.rate)) if self.rate > 0 else 2 * self.batch
+        self.batch = max(0, min(size, pending))
+        return self.batch
+
+    def record(self, directories: int, seconds: float) -> None:
+        """
+        Record the time a batch took.
+
+        :param directories: Number of directories of the batch.
+
+        :param seconds: Time the batch took.
+        """
+        if directories:
+            self.rate = seconds / directories
+
+
+def snapshot_path(cache_dir: Path, index: Path) -> Path:
+    """
+    Return the path of the directory snapshot of a project.
+
+    :param cache_dir: Directory the caches are stored in.
+
+    :param index: Index file of the project.
+
+    :returns: Path to the snapshot (may not exist).
+    """
+    return cache_dir.joinpath("snapshots", "%s.json" % (index_digest(index)))
+
+
+def load_snapshot(path: Path, index: Path) -> Optional[Tuple[int, List[Path]]]:
+    """
+    Read the directories recorded by the last full run of a project.
+
+    :param path: Path to the snapshot.
+
+    :param index: Index file of the project.
+
+    :returns: Tuple of the time the run started (ns since the epoch) and the directories it scanned, or None if there is no (usable) snapshot.
+    """
+    snapshot: Any = read_json(path)
+    try:
+        if snapshot.get("index") == str(index) and isinstance(snapshot["started"], int):
+            return (snapshot["started"], [Path(directory) for directory in snapshot["directories"]])
+    except (AttributeError, KeyError, TypeError):
+        pass
+    return None
+
+
+def save_snapshot(path: Path, index: Path, started: int, directories: Iterable[Path]) -> None:
+    """
+    Record the directories scanned by a full run of a project. Errors are ignored; the snapshot only speeds up `--time-budget`.
+
+    If runs of the same project overlap, the snapshot of the run that started last is kept.
+
+    :param path: Path to the snapshot.
+
+    :param index: Index file of the project.
+
+    :param started: Time the run started (ns since the epoch); directories modified after it are listed again by the next time-budgeted run.
+
+    :param directories: Directories the run scanned.
+    """
+    try:
+        with cache_lock(path):
+            previous = load_snapshot(path, index)
+            if previous is None or previous[0] <= started:
+                write_json(path, {"index": str(index), "started": started,
+                                  "directories": [str(directory) for directory in directories]})
+    except OSError:
+        pass
+
+
+def order_by_recency(directories: Iterable[Path], since: int, fs: FileSystem,
+                     cancel: Optional[threading.Event] = None, excluded: Iterable[Path] = ()) -> List[Path]:
+    """
+    Order directories by modification time, newest first, adding the directories created below them since `since`.
+
+    A directory whose entries changed after `since` is listed, and subdirectories that are not in `directories` (created
+    since) are added and looked at the same way. Directories that no longer exist are dropped.
+
+    :param directories: Directories of the project, e.g. from the snapshot of its last full run.
+
+    :param since: Time (ns since the epoch) `directories` were recorded.
+
+    :param fs: File system the directories are on.
+
+    :param cancel: Optional. Event that stops ordering when set.
+
+    :param excluded: Optional. Directories that are left out, with everything below them (e.g. the thumbnail store).
+
+    :raises OperationCancelledError: if `cancel` is set.
+
+    :returns: Directories, newest first (ties in path order).
+    """
+    excluded = set(excluded)
+    pending: List[Path] = [directory for directory in directories
+                           if directory not in excluded and not excluded.intersection(directory.parents)]
+    known: Set[Path] = set(pending) | excluded
+    mtimes: Dict[Path, int] = {}
+
+    while pending:
+        if cancel is not None and cancel.is_set():
+            raise OperationCancelledError()
+        directory = pending.pop()
+        try:
+            mtime = fs.stat(directory).st_mtime_ns
+        except OSError:
+            continue
+        mtimes[directory] = mtime
+        if mtime > since:
+            try:
+                entries = fs.scandir(directory)
+            except OSError:
+                continue
+            for entry in entries:
+                path = directory.joinpath(entry.name)
+                if path not in known and entry.is_dir():
+                    known.add(path)
+                    pending.append(path)
+
+    return sorted(mtimes, key=lambda path: (-mtimes[path], path))
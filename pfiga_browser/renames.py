@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""
+Detection of renamed and moved images so their readme entries (and hand-written descriptions) can be carried over.
+
+A persistent index maps the path of every tracked image to the hash of its content. When a tracked image goes missing and an
+untracked image with the same content appears, the pair is a rename (or a move, if the directories differ). Only missing
+and untracked files are looked at, and hashes of unchanged files come from the stat cache.
+
+`ContentIndex`: Persistent map of tracked image paths to content hashes.
+
+`Rename`: A missing tracked image and the untracked image it was renamed to.
+
+`detect_renames`: Pair missing images with untracked images that have the same content.
+"""
+# python level imports
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from pathlib import Path
+# pfiga-browser level imports
+from pfiga_browser.cache import (CACHE_MAX_AGE_DAYS, CACHE_VERSION, StatCache, cache_day, cache_lock, content_hash,
+                                 read_json, write_json)
+from pfiga_browser.imageinfo import Image
+
+
+class ContentIndex(object):
+    """
+    Persistent map of tracked image paths to the SHA-256 hash of their content.
+
+    Images that were neither recorded nor looked up for `cache.CACHE_MAX_AGE_DAYS` (e.g. deleted images that were never
+    renamed, or images that are no longer tracked) are dropped when the index is saved. Saving merges the images this
+    process recorded, looked up, or forgot into the file, so images other processes saved in the meantime are kept.
+
+    `path`: Path to the JSON file the index is persisted to. None if the index only lives in memory.
+
+    `hashes`: Map of absolute image paths (as strings) to hex digests.
+
+    `seen`: Map of absolute image paths (as strings) to the day they were last recorded or looked up. See `cache.cache_day`.
+    """
+
+    path: Optional[Path]
+
+    hashes: Dict[str, str]
+
+    seen: Dict[str, int]
+
+    def __init__(self, path: Optional[Path] = None):
+        """
+        Initialize the index, loading existing entries from `path` if it exists.
+
+        :param path: Optional. JSON file to load from and save to.
+        """
+        self.path = path
+        self.hashes = {}
+        self.seen = {}
+        self._today = cache_day()
+        # images recorded or looked up, and images forgotten, since the index was loaded or saved
+        self._changed: Set[str] = set()
+        self._forgotten: Set[str] = set()
+
+        if path is not None:
+            self.hashes, self.seen = self._read(path)
+
+    @staticmethod
+    def _read(path: Path) -> Tuple[Dict[str, str], Dict[str, int]]:
+        """
+        Read the images saved to an index file.
+
+        :param path: Path to the index file.
+
+        :returns: Tuple of the hashes and the days the images were last used; empty if the file does not exist, is corrupt, or has another version.
+        """
+        index: Any = read_json(path)
+        try:
+            if index.get("version") == CACHE_VERSION:
+                return ({image: entry[0] for image, entry in index["hashes"].items()},
+                        {image: entry[1] for image, entry in index["hashes"].items()})
+        except (AttributeError, KeyError, IndexError, TypeError):
+            pass
+        return ({}, {})
+
+    def record(self, image: Path, digest: str) -> None:
+        """
+        Record the content hash of a tracked image.
+
+        :param image: Absolute path to the image.
+
+        :param digest: SHA-256 hex digest of the image.
+        """
+        self.hashes[str(image)] = digest
+        self.seen[str(image)] = self._today
+        self._changed.add(str(image))
+        self._forgotten.discard(str(image))
+
+    def lookup(self, image: Path) -> Optional[str]:
+        """
+        Return the last known content hash of an image.
+
+        :param image: Absolute path to the image.
+
+        :returns: Hex digest or None if the image was never recorded.
+        """
+        digest = self.hashes.get(str(image))
+        if digest is not None and self.seen.get(str(image)) != self._today:
+            self.seen[str(image)] = self._today
+            self._changed.add(str(image))
+        return digest
+
+    def forget(self, image: Path) -> None:
+        """
+        Remove an image from the index (e.g. after it has been renamed).
+
+        :param image: Absolute path to the image.
+        """
+        self.hashes.pop(str(image), None)
+        self.seen.pop(str(image), None)
+        self._changed.discard(str(image))
+        self._forgotten.add(str(image))
+
+    def save(self) -> None:
+        """
+        Merge the images recorded, looked up, or forgotten since the index was loaded into `path` (if any), dropping images
+        that were not used for `cache.CACHE_MAX_AGE_DAYS`. The index then also holds the images other processes saved.
+        """
+        if self.path is None:
+            return
+
+        with cache_lock(self.path):
+            hashes, seen = self._read(self.path)
+            for image in self._forgotten:
+                hashes.pop(image, None)
+                seen.pop(image, None)
+            for image in self._changed:
+                hashes[image] = self.hashes[image]
+                seen[image] = self.seen[image]
+
+            oldest = self._today - CACHE_MAX_AGE_DAYS
+            self.hashes = {image: digest for image, digest in hashes.items() if seen.get(image, self._today) >= oldest}
+            self.seen = {image: seen.get(image, self._today) for image in self.hashes}
+            write_json(self.path, {"version": CACHE_VERSION,
+                                   "hashes": {image: [digest, self.seen[image]] for image, digest in self.hashes.items()}})
+            self._changed = set()
+            self._forgotten = set()
+
+
+class Rename(object):
+    """
+    A tracked image that was renamed or moved.
+
+    `old`: Absolute path the image is tracked under (no longer exists).
+
+    `new`: Absolute path of the untracked image with the same content.
+
+    `image`: Image object parsed from the readme for `old` (holds the description to carry over).
+    """
+
+    old: Path
+
+    new: Path
+
+    image: Image
+
+    def __init__(self, old: Path, new: Path, image: Image):
+        """
+        Initialize with the old and new locations of the image.
+
+        :param old: Path the image is tracked under.
+
+        :param new: Path the image was renamed/moved to.
+
+        :param image: Image object parsed from the readme for `old`.
+        """
+        self.old = old
+        self.new = new
+        self.image = image
+
+    @property
+    def is_move(self) -> bool:
+        """True if the image was moved to a different directory."""
+        return self.old.parent != self.new.parent
+
+    def __str__(self) -> str:
+        """Return a human readable 'old -> new' string."""
+        return "%s -> %s" % (self.old, self.new)
+
+
+def detect_renames(missing: Dict[Path, Image], untracked: Iterable[Path], index: ContentIndex,
+                   cache: Optional[StatCache] = None) -> List[Rename]:
+    """
+    Pair missing tracked images with untracked images that have the same content.
+
+    When several missing images have the same content, an untracked image is paired with one from its own directory first.
+
+    :param missing: Map of absolute paths of missing tracked images to the Image objects parsed for them.
+
+    :param untracked: Absolute paths of untracked images.
+
+    :param index: Index of the content hashes of tracked images.
+
+    :param cache: Optional. Cache to look up and store content hashes in.
+
+    :returns: List of detected renames.
+    """
+    by_digest: Dict[str, List[Path]] = {}
+    for path in missing:
+        digest = index.lookup(path)
+        if digest is not None:
+            by_digest.setdefault(digest, []).append(path)
+
+    renames: List[Rename] = []
+
+    # nothing can have been renamed if no missing image has a known hash; don't hash untracked images in that case
+    if not by_digest:
+        return renames
+
+    for path in untracked:
+        candidates = by_digest.get(content_hash(path, cache))
+        if not candidates:
+            continue
+
+        same_directory = [old for old in candidates if old.parent == path.parent]
+        old = same_directory[0] if same_directory else candidates[0]
+        candidates.remove(old)
+        renames.append(Rename(old, path, missing[old]))
+
+    return renames
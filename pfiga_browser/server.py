@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+"""
+Query server that keeps the latest scan of one or more projects in memory and answers requests over a Unix domain socket.
+
+Started with `python -m pfiga_browser.server serve <index>...`. The protocol is one JSON object per line in each direction. A request
+holds a `command` and its arguments, a response holds `ok` and either `result` or `error`:
+
+    {"command": "images", "folder": "4gr/folder_figs"}
+    {"ok": true, "result": [{"name": "img01.png", ...}]}
+
+Commands:
+
+`status`: Served projects, when they were scanned, and whether files changed since then.
+
+`untracked`: Untracked readmes and images, and images missing on disk.
+
+`images`: Images described in the second level readme of `folder` (absolute or relative to the project).
+
+`search`: Images whose name or description contains `query` (case insensitive).
+
+`rescan`: Scan the project again, or only the directories below `subtree`.
+
+`apply`: Add untracked readmes and images to the readmes (like a normal run) and scan again.
+
+`shutdown`: Stop the server.
+
+Every command takes an optional `index` naming the project (the first served project by default).
+
+`ProjectState`: Latest scan of a project and a snapshot of the directory modification times it saw.
+
+`QueryServer`: Dispatches requests to the project states. Also used directly by the client when no server is running.
+
+`serve`: Run the server until it is shut down.
+
+`query`: Send a request to a running server.
+
+`serve_command`, `query_command`: Implementations of the `serve` and `query` commands.
+
+`run`: Entry point of `python -m pfiga_browser.server`.
+"""
+# python level imports
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import socketserver
+from typing import Any, Dict, List, Optional, Set
+from pathlib import Path
+from argparse import Namespace
+# pfiga-browser level imports
+from pfiga_browser.arguments import build_server_parser, default_options
+from pfiga_browser.cache import default_cache_dir
+from pfiga_browser.error import ExitCode
+from pfiga_browser.pfiga_browser import ProjectReport, RunContext, in_dirs, process_index
+
+
+def default_socket_path() -> Path:
+    """
+    Return the default path of the server socket: `$XDG_RUNTIME_DIR/pfiga_browser.sock`, or `server.sock` in the cache directory.
+
+    :returns: Path to the socket.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir).joinpath("pfiga_browser.sock")
+    return default_cache_dir().joinpath("server.sock")
+
+
+class ProjectState(object):
+    """
+    Latest scan of a project.
+
+    `index`: Index file of the project.
+
+    `report`: Report of the latest scan (holds the tracked readmes, images, and untracked files).
+
+    `snapshot`: Map of the directories of the project to their modification time (ns) when they were scanned.
+
+    `scanned`: Time of the latest scan (seconds since the epoch).
+    """
+
+    index: Path
+
+    report: ProjectReport
+
+    snapshot: Dict[Path, int]
+
+    scanned: float
+
+    def __init__(self, index: Path):
+        """
+        Initialize an empty state. See `rescan`.
+
+        :param index: Index file of the project.
+        """
+        self.index = index
+        self.report = ProjectReport(index)
+        self.snapshot = {}
+        self.scanned = 0.0
+
+    def rescan(self, context: RunContext, subtree: Optional[Path] = None) -> None:
+        """
+        Scan the project (read-only) and replace the state, or only the part of it below `subtree`.
+
+        :param context: Shared run state (caches).
+
+        :param subtree: Optional. Directory to scan again. The whole project is scanned by default.
+        """
+        args = default_options(check=True, all=True)
+        directories: Dict[Path, int] = {}
+
+        def progress(kind: str, path: Path) -> None:
+            if kind == "directory":
+                directories[path] = path.stat().st_mtime_ns
+
+        if subtree is None:
+            self.report = process_index(self.index, args, context, progress)
+            self.snapshot = directories
+        else:
+            scope: Set[Path] = {subtree}
+            for root, dirnames, _ in os.walk(subtree):
+                scope.update(Path(root).joinpath(name) for name in dirnames)
+            report = process_index(self.index, args, context, progress, scope)
+
+            # keep everything outside of the subtree from the previous scan
+            old = self.report
+            report.collections.update({path: collection for path, collection in old.collections.items()
+                                       if not in_dirs(path, [subtree])})
+            report.missing_images.update({path: image for path, image in old.missing_images.items()
+                                          if not in_dirs(path, [subtree])})
+            report.untracked.extend(path for path in old.untracked if not in_dirs(path, [subtree]))
+            self.report = report
+            self.snapshot = {path: mtime for path, mtime in self.snapshot.items() if not in_dirs(path, [subtree])}
+            self.snapshot.update(directories)
+
+        self.scanned = time.time()
+
+    def changed(self) -> List[Path]:
+        """
+        Return the directories that changed since the latest scan (one `stat` per directory, nothing is read).
+
+        :returns: List of directories whose modification time changed or that no longer exist.
+        """
+        changed: List[Path] = []
+        for path, mtime in self.snapshot.items():
+            try:
+                if path.stat().st_mtime_ns != mtime:
+                    changed.append(path)
+            except OSError:
+                changed.append(path)
+        return changed
+
+    def resolve(self, folder: str) -> Path:
+        """
+        Return the absolute path of a folder given relative to the project.
+
+        :param folder: Absolute path or path relative to the directory of the index.
+
+        :returns: Normalized absolute path.
+        """
+        return Path(os.path.normpath(self.index.parent.joinpath(folder)))
+
+
+class QueryServer(object):
+    """
+    Answers requests about the served projects. Requests are handled one at a time.
+
+    `context`: Run state shared by all projects (caches).
+
+    `projects`: Map of index paths to project states.
+    """
+
+    context: RunContext
+
+    projects: Dict[Path, ProjectState]
+
+    def __init__(self, indexes: List[Path], cache_dir: Optional[Path] = None):
+        """
+        Initialize and scan all projects.
+
+        :param indexes: Index files of the projects to serve.
+
+        :param cache_dir: Optional. Cache directory. See `cache.default_cache_dir`.
+        """
+        self.context = RunContext(cache_dir if cache_dir is not None else default_cache_dir())
+        self.projects = {}
+        self._lock = threading.Lock()
+
+        for index in indexes:
+            state = ProjectState(Path(os.path.normpath(index.absolute())))
+            state.rescan(self.context)
+            self.projects[state.index] = state
+
+    def project(self, request: Dict[str, Any]) -> ProjectState:
+        """
+        Return the project a request is about.
+
+        :param request: Decoded request.
+
+        :raises KeyError: if the request names a project that is not served.
+
+        :returns: Project state.
+        """
+        if "index" not in request:
+            return next(iter(self.projects.values()))
+        index = Path(os.path.normpath(Path(request["index"]).absolute()))
+        if index not in self.projects:
+            raise KeyError("not serving '%s'" % index)
+        return self.projects[index]
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Answer a request.
+
+        :param request: Decoded request.
+
+        :returns: Response (`ok` and `result`, or `ok` and `error`).
+        """
+        try:
+            with self._lock:
+                return {"ok": True, "result": self.dispatch(request)}
+        except (KeyError, ValueError, TypeError, OSError) as ex:
+            return {"ok": False, "error": "%s: %s" % (ex.__class__.__name__, ex)}
+
+    def dispatch(self, request: Dict[str, Any]) -> Any:
+        """
+        Run a command.
+
+        :param request: Decoded request.
+
+        :raises ValueError: if the command is unknown.
+
+        :returns: Result of the command (JSON serializable).
+        """
+        command = request.get("command")
+
+        if command == "status":
+            return [{
+                "index": str(state.index),
+                "scanned": state.scanned,
+                "exit_code": state.report.exit_code.name,
+                "changed": [str(path) for path in state.changed()]
+            } for state in self.projects.values()]
+
+        state = self.project(request)
+        report = state.report
+
+        if command == "untracked":
+            return {
+                "untracked": [str(path) for path in report.untracked],
+                "missing": [str(path) for path in report.missing_images]
+            }
+        if command == "images":
+            collection = report.collections.get(state.resolve(request["folder"]))
+            return collection.to_dict() if collection is not None else []
+        if command == "search":
+            query = str(request["query"]).lower()
+            return [dict(image.to_dict(), path=str(directory.joinpath(image.uri)))
+                    for directory, collection in sorted(report.collections.items())
+                    for image in collection.collection
+                    if query in image.name.lower() or query in image.description.lower()]
+        if command == "rescan":
+            subtree = state.resolve(request["subtree"]) if request.get("subtree") else None
+            self.context.start_batch()
+            state.rescan(self.context, subtree)
+            return {"untracked": len(state.report.untracked), "missing": len(state.report.missing_images)}
+        if command == "apply":
+            self.context.start_batch()
+            applied = process_index(state.index, default_options(), self.context)
+            state.rescan(self.context)
+            return {"exit_code": applied.exit_code.name, "untracked": len(state.report.untracked)}
+
+        raise ValueError("unknown command: '%s'" % command)
+
+    def close(self) -> None:
+        """Save the caches and shut down the worker pools."""
+        self.context.close()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Reads one JSON request per line from a connection and writes one JSON response per line."""
+
+    def handle(self) -> None:
+        """Answer requests until the client closes the connection."""
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("request must be an object")
+            except ValueError as ex:
+                response: Dict[str, Any] = {"ok": False, "error": "invalid request: %s" % ex}
+            else:
+                if request.get("command") == "shutdown":
+                    response = {"ok": True, "result": None}
+                    # shutdown() waits for serve_forever() to return, so it must not be called from the serving thread
+                    threading.Thread(target=self.server.shutdown).start()
+                else:
+                    response = self.server.query_server.handle(request)
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix domain socket server handling each connection in its own thread."""
+
+    daemon_threads = True
+
+    query_server: QueryServer
+
+
+def serve(indexes: List[Path], socket_path: Path, cache_dir: Optional[Path] = None) -> None:
+    """
+    Scan the projects and answer requests on `socket_path` until a `shutdown` request is received.
+
+    :param indexes: Index files of the projects to serve.
+
+    :param socket_path: Path of the Unix domain socket to listen on.
+
+    :param cache_dir: Optional. Cache directory.
+
+    :raises OSError: if another server is already listening on `socket_path`.
+    """
+    if socket_path.exists():
+        if query(socket_path, {"command": "status"}) is not None:
+            raise OSError("a server is already listening on '%s'" % socket_path)
+        # left behind by a server that did not shut down cleanly
+        socket_path.unlink()
+
+    query_server = QueryServer(indexes, cache_dir)
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        with _UnixServer(str(socket_path), _RequestHandler) as server:
+            server.query_server = query_server
+            os.chmod(socket_path, 0o600)
+            server.serve_forever()
+    finally:
+        socket_path.unlink(missing_ok=True)
+        query_server.close()
+
+
+def query(socket_path: Path, request: Dict[str, Any], timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """
+    Send a request to a running server.
+
+    :param socket_path: Path of the server's Unix domain socket.
+
+    :param request: Request to send.
+
+    :param timeout: Optional. Seconds to wait for the response. Waits indefinitely by default (rescans can take a while).
+
+    :returns: Decoded response, or None if no server is listening on `socket_path`.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(timeout)
+            connection.connect(str(socket_path))
+            connection.sendall(json.dumps(request).encode() + b"\n")
+            with connection.makefile("rb") as f_connection:
+                line = f_connection.readline()
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+
+    return json.loads(line) if line else None
+
+
+def serve_command(args: Namespace) -> ExitCode:
+    """
+    Run the `serve` command.
+
+    :param args: Arguments of the command, parsed by `arguments.build_server_parser`.
+
+    :returns: Exit code.
+    """
+    socket_path = Path(args.socket) if args.socket else default_socket_path()
+    indexes = [Path(index) for index in args.index]
+
+    missing = [index for index in indexes if not index.is_file()]
+    if missing:
+        print("Error processing index: File '%s' not found" % (missing[0]))
+        return ExitCode.FILENOTFOUND
+
+    try:
+        serve(indexes, socket_path, Path(args.cache_dir) if args.cache_dir else None)
+    except OSError as ex:
+        print("Error: %s" % ex)
+        return ExitCode.UNKOWN
+
+    return ExitCode.NORMAL
+
+
+def query_command(args: Namespace) -> ExitCode:
+    """
+    Run the `query` command. Uses the server if one is running and scans the project directly otherwise.
+
+    :param args: Arguments of the command, parsed by `arguments.build_server_parser`.
+
+    :returns: Exit code.
+    """
+    socket_path = Path(args.socket) if args.socket else default_socket_path()
+
+    request: Dict[str, Any] = {"command": args.command}
+    if args.index:
+        request["index"] = str(Path(args.index).absolute())
+    if args.argument is not None:
+        request[{"images": "folder", "search": "query", "rescan": "subtree"}.get(args.command, "argument")] = args.argument
+
+    response = query(socket_path, request)
+
+    if response is None:
+        if args.command == "shutdown":
+            print("Error: no server is listening on '%s'" % socket_path)
+            return ExitCode.UNKOWN
+        if not args.index or not Path(args.index).is_file():
+            print("Error: no server is running and no index file was given (--index)")
+            return ExitCode.FILENOTFOUND
+        query_server = QueryServer([Path(args.index)], Path(args.cache_dir) if args.cache_dir else None)
+        try:
+            response = query_server.handle(request)
+        finally:
+            query_server.close()
+
+    print(json.dumps(response.get("result") if response["ok"] else response, indent=1))
+
+    return ExitCode.NORMAL if response["ok"] else ExitCode.UNKOWN
+
+
+def run() -> int:
+    """
+    Entry point of `python -m pfiga_browser.server {serve,query}`.
+
+    :returns: Exit code of the command.
+    """
+    args = build_server_parser().parse_args()
+    command = serve_command if args.subcommand == "serve" else query_command
+    return command(args).value
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+"""
+Detection of near-duplicate images (e.g. re-exported or slightly edited screenshots) using perceptual hashes.
+
+Each PNG is reduced to a 64 bit difference hash (dHash) computed with NumPy from downscaled pixel data. Hashes are stored
+in the stat cache so unchanged images are only decoded once. Hashes are indexed in a BK-tree, which answers "all hashes
+within Hamming distance `d`" queries without comparing every pair of images.
+
+`difference_hash`: Compute the dHash of an array of pixels.
+
+`BKTree`: Metric tree for Hamming distance queries.
+
+`NearDuplicateReport`: Groups of images whose hashes are within a maximum distance of each other.
+
+`find_near_duplicates`: Build a `NearDuplicateReport` from a list of image paths.
+"""
+# python level imports
+from concurrent.futures import Executor
+from typing import Dict, Generic, Iterable, List, Optional, Tuple, TypeVar
+from pathlib import Path
+# numpy level imports
+import numpy as np
+# pfiga-browser level imports
+from pfiga_browser.workers import process_pool
+from pfiga_browser.cache import StatCache
+from pfiga_browser.thumbnail import UnsupportedImageError, area_resize, decode_png
+
+# ITU-R BT.601 luma weights
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+HASH_SIZE = 8
+
+DEFAULT_MAX_DISTANCE = 6
+
+T = TypeVar("T")
+
+
+def hamming_distance(first: int, second: int) -> int:
+    """
+    Return the number of bits that differ between two hashes.
+
+    :param first: First hash.
+
+    :param second: Second hash.
+
+    :returns: Hamming distance between the hashes.
+    """
+    return bin(first ^ second).count("1")
+
+
+def difference_hash(pixels: np.ndarray, size: int = HASH_SIZE) -> int:
+    """
+    Compute the difference hash (dHash) of an image.
+
+    The image is converted to grayscale and area-averaged down to (`size` + 1) x `size` pixels. Each bit of the hash records
+    whether a pixel's right neighbour is brighter than it, which is robust to scaling, re-compression, and small edits.
+
+    :param pixels: Array of shape (height, width, channels) of type uint8.
+
+    :param size: Optional. Number of rows/columns compared. The hash has `size` * `size` bits. Defaults to 8.
+
+    :returns: Hash as an integer.
+    """
+    channels = pixels.shape[2]
+    # ignore the alpha channel
+    if channels >= 3:
+        gray = pixels[..., :3].astype(np.float32) @ LUMA_WEIGHTS
+    else:
+        gray = pixels[..., 0].astype(np.float32)
+
+    small = area_resize(gray[..., np.newaxis], size + 1, size)[..., 0]
+    bits = (small[:, 1:] > small[:, :-1]).reshape(-1)
+
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hash_image(path: Path) -> Optional[int]:
+    """
+    Compute the difference hash of the PNG image at `path`. Run in worker processes by `find_near_duplicates`.
+
+    :param path: Path to the image.
+
+    :returns: Hash or None if the image could not be decoded.
+    """
+    try:
+        return difference_hash(decode_png(path.read_bytes()))
+    except UnsupportedImageError:
+        return None
+
+
+class BKTree(Generic[T]):
+    """
+    Burkhard-Keller tree of hashes under the Hamming distance.
+
+    Each node stores a hash and its children keyed by their distance to it. The triangle inequality lets a search for hashes within
+    distance `d` of a query skip every subtree whose key is not within `d` of the query's distance to the node.
+
+    `root`: Root node as a list of [hash, items with that hash, children]. None if the tree is empty.
+    """
+
+    root: Optional[list]
+
+    def __init__(self):
+        """Initialize an empty tree."""
+        self.root = None
+
+    def add(self, value: int, item: T) -> None:
+        """
+        Add an item with hash `value` to the tree.
+
+        :param value: Hash of the item.
+
+        :param item: Item to store (e.g. a path).
+        """
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, T]]:
+        """
+        Find all items with a hash within `max_distance` of `value`.
+
+        :param value: Hash to search for.
+
+        :param max_distance: Maximum Hamming distance (inclusive).
+
+        :returns: List of (distance, item) pairs.
+        """
+        results: List[Tuple[int, T]] = []
+        stack = [self.root] if self.root is not None else []
+
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, item) for item in node[1])
+            for key, child in node[2].items():
+                if distance - max_distance <= key <= distance + max_distance:
+                    stack.append(child)
+
+        return results
+
+
+class NearDuplicateReport(object):
+    """
+    Report of groups of images that look alike.
+
+    `groups`: Groups of image paths. Each image in a group is within `max_distance` of at least one other image in the group.
+
+    `max_distance`: Maximum Hamming distance between hashes that was considered similar.
+    """
+
+    groups: List[List[Path]]
+
+    max_distance: int
+
+    def __init__(self, groups: List[List[Path]], max_distance: int):
+        """
+        Initialize with the groups found.
+
+        :param groups: Groups of similar images.
+
+        :param max_distance: Maximum Hamming distance used to build the groups.
+        """
+        self.groups = sorted(sorted(group) for group in groups)
+        self.max_distance = max_distance
+
+    def __str__(self) -> str:
+        """Return a human readable report with one block per group."""
+        lines: List[str] = []
+        for group in self.groups:
+            lines.append("%d similar images:" % len(group))
+            lines.extend("\t%s" % path for path in group)
+        lines.append("%d groups of near-duplicate images (max distance %d)" % (len(self.groups), self.max_distance))
+        return "\n".join(lines)
+
+
+def image_hashes(paths: Iterable[Path], cache: Optional[StatCache] = None, workers: Optional[int] = None,
+                 executor: Optional[Executor] = None) -> Dict[Path, int]:
+    """
+    Compute the difference hash of every PNG image in `paths`.
+
+    Cached hashes are stored in the 'dhash' field of each file's record in `cache`; only images without one are decoded (on a process pool).
+
+    :param paths: Paths to images. Non-PNG images are skipped.
+
+    :param cache: Optional. Cache to look up and store hashes in.
+
+    :param workers: Optional. Number of worker processes. Defaults to one per CPU.
+
+    :param executor: Optional. Process pool to run on (e.g. one shared by several projects). A new pool is created by default.
+
+    :returns: Map of image paths to hashes. Images that could not be decoded are omitted.
+    """
+    hashes: Dict[Path, int] = {}
+    pending: List[Path] = []
+
+    for path in paths:
+        if path.suffix.lower() != ".png":
+            continue
+        record = cache.get(path) if cache is not None else None
+        if record is not None and "dhash" in record:
+            if record["dhash"] is not None:
+                hashes[path] = int(record["dhash"], 16)
+        else:
+            pending.append(path)
+
+    if pending:
+        pool = executor if executor is not None else process_pool(workers)
+        try:
+            for path, value in zip(pending, pool.map(hash_image, pending)):
+                if cache is not None:
+                    # images that cannot be decoded are remembered too, so they are not retried every run
+                    cache.update(path, {"dhash": "%016x" % value if value is not None else None})
+                if value is not None:
+                    hashes[path] = value
+        finally:
+            if executor is None:
+                pool.shutdown()
+
+    return hashes
+
+
+def find_near_duplicates(paths: Iterable[Path], cache: Optional[StatCache] = None, max_distance: int = DEFAULT_MAX_DISTANCE,
+                         workers: Optional[int] = None, executor: Optional[Executor] = None) -> NearDuplicateReport:
+    """
+    Find groups of PNG images that look alike.
+
+    :param paths: Paths to images (e.g. the result of `DirectoryWalker.find_all_images`).
+
+    :param cache: Optional. Cache to look up and store hashes in.
+
+    :param max_distance: Optional. Maximum Hamming distance between the 64 bit hashes of similar images. Defaults to 6.
+
+    :param workers: Optional. Number of worker processes used to hash images.
+
+    :param executor: Optional. Process pool to hash images on.
+
+    :returns: Report of all groups of similar images.
+    """
+    hashes = image_hashes(paths, cache, workers, executor)
+    tree: BKTree[Path] = BKTree()
+    for path, value in hashes.items():
+        tree.add(value, path)
+
+    # union-find over all pairs within `max_distance`
+    parents: Dict[Path, Path] = {path: path for path in hashes}
+
+    def find(path: Path) -> Path:
+        while parents[path] != path:
+            parents[path] = parents[parents[path]]
+            path = parents[path]
+        return path
+
+    for path, value in hashes.items():
+        for _, other in tree.search(value, max_distance):
+            parents[find(other)] = find(path)
+
+    groups: Dict[Path, List[Path]] = {}
+    for path in hashes:
+        groups.setdefault(find(path), []).append(path)
+
+    return NearDuplicateReport([group for group in groups.values() if len(group) > 1], max_distance)
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+"""
+Sphinx extension that tracks and updates pfiga readmes as part of a Sphinx build, instead of in a separate pfiga-browser run.
+
+Add `"pfiga_browser.sphinxext"` to `extensions` in the project's `conf.py`. Sphinx's own change detection decides which
+documents are read; the extension only looks at those:
+
+`builder-inited`: Sets up the template engine and image metadata cache shared by all hooks.
+
+`env-get-outdated`: Marks second level readmes whose directory changed (e.g. a new image was added) as outdated, since adding an image does not modify the readme itself.
+
+`source-read`: Appends untracked images to the source of second level readmes as they are read (`env.pfiga_pending`).
+
+`doctree-read`: Collects the images of each second level readme from the doctree Sphinx parsed (no second parse) into the build
+environment (`env.pfiga_images`) and warns about missing images.
+
+`env-updated`: Writes the images added while reading to the readmes on disk, and appends readmes that are not included in
+any toctree to the nearest first level readme (or the root document). Files are only written once all documents were read.
+
+Configuration values: `pfiga_first_level_name`, `pfiga_second_level_name`, `pfiga_image_exts`, `pfiga_update`, and `pfiga_cache_dir`.
+
+Note: `parsers.RstParser` registers a docutils-only `toctree` directive and must not be used inside a Sphinx build; nothing here
+uses it (`TemplateEngine.update_first_level_readme` and `update_index` find toctree entries without it).
+"""
+# python level imports
+import re
+import time
+from typing import Any, Dict, List, Optional, Set
+from pathlib import Path
+# docutils level imports
+from docutils import nodes
+# pfiga-browser level imports
+from pfiga_browser.cache import StatCache, default_cache_dir
+from pfiga_browser.imageinfo import Image, ImageCollection
+from pfiga_browser.locking import locked
+from pfiga_browser.metadata import MetadataReader, thumbnail_width
+from pfiga_browser.parsers import SecondLevelProcessor
+from pfiga_browser.template import TemplateEngine
+
+# reST lines that reference an image file: the image directive argument or a thumbnail's download link (or target)
+IMAGE_REFERENCE = re.compile(r"^\s*(?:\.\. image::\s*|:target:\s*|:download:`[^`<]*<)([^\s<>`]+)", re.MULTILINE)
+
+
+class PfigaState(object):
+    """
+    State shared by the extension's event handlers for the duration of a build.
+
+    `template_engine`: Template engine used to render new readme entries.
+
+    `metadata_reader`: Reader for image dimensions (thumbnail widths of new entries).
+    """
+
+    template_engine: TemplateEngine
+
+    metadata_reader: MetadataReader
+
+    def __init__(self, cache_dir: Path):
+        """
+        Initialize with the directory the image metadata cache is stored in.
+
+        :param cache_dir: Cache directory.
+        """
+        self.template_engine = TemplateEngine()
+        self.metadata_reader = MetadataReader(StatCache(cache_dir.joinpath("metadata.json")))
+
+
+def _basename(docname: str) -> str:
+    """Return the last component of a docname (docnames always use '/' as separator)."""
+    return docname.rsplit("/", 1)[-1]
+
+
+def _read_time(env: Any, docname: str) -> float:
+    """Return the time a document was last read in seconds (Sphinx stores microseconds since 7.3 and seconds before)."""
+    read_time = env.all_docs[docname]
+    return read_time / 1e6 if read_time > 1e11 else read_time
+
+
+def _mark_read(env: Any, docname: str) -> None:
+    """Record that a document was read now, in the unit Sphinx uses (see `_read_time`)."""
+    env.all_docs[docname] = time.time_ns() // 1000 if env.all_docs.get(docname, 0) > 1e11 else time.time()
+
+
+def builder_inited(app: Any) -> None:
+    """
+    Set up the state shared by the other event handlers.
+
+    :param app: Sphinx application.
+    """
+    cache_dir = Path(app.config.pfiga_cache_dir) if app.config.pfiga_cache_dir else default_cache_dir()
+    app.pfiga = PfigaState(cache_dir)
+
+    if not hasattr(app.env, "pfiga_images"):
+        app.env.pfiga_images = {}
+    if not hasattr(app.env, "pfiga_pending"):
+        app.env.pfiga_pending = {}
+
+
+def env_get_outdated(app: Any, env: Any, added: Set[str], changed: Set[str], removed: Set[str]) -> List[str]:
+    """
+    Return second level readmes that Sphinx considers up to date but whose directory changed since they were last read.
+
+    Adding, removing, or renaming an image changes the directory's mtime, not the readme's, so this costs one `stat` per readme.
+
+    :param app: Sphinx application.
+
+    :param env: Build environment.
+
+    :param added: Documents Sphinx will read because they are new.
+
+    :param changed: Documents Sphinx will read because they changed.
+
+    :param removed: Documents that were removed.
+
+    :returns: Additional docnames to read.
+    """
+    second_level = Path(app.config.pfiga_second_level_name).stem
+    outdated: List[str] = []
+
+    for docname in env.found_docs:
+        if _basename(docname) != second_level or docname in added or docname in changed or docname not in env.all_docs:
+            continue
+        directory = env.doc2path(docname).parent
+        if directory.stat().st_mtime > _read_time(env, docname):
+            outdated.append(docname)
+
+    return outdated
+
+
+def source_read(app: Any, docname: str, source: List[str]) -> None:
+    """
+    Append untracked images to a second level readme before Sphinx parses it.
+
+    Tracked images are found with a line-based scan of the source (not a reST parse). New entries are added to the text
+    Sphinx is about to parse and recorded in `env.pfiga_pending`; they are written to the file on disk by `env_updated`,
+    after the read phase, so the file does not change while Sphinx reads it.
+
+    :param app: Sphinx application.
+
+    :param docname: Document being read.
+
+    :param source: Single element list holding the document's source text (modified in place).
+    """
+    if not app.config.pfiga_update or _basename(docname) != Path(app.config.pfiga_second_level_name).stem:
+        return
+
+    path = Path(app.env.doc2path(docname))
+    tracked = set(IMAGE_REFERENCE.findall(source[0]))
+    untracked: List[Image] = []
+
+    for item in sorted(path.parent.iterdir()):
+        if item.is_file() and item.suffix in app.config.pfiga_image_exts and item.name not in tracked:
+            untracked.append(Image(uri=item.name, width=thumbnail_width(app.pfiga.metadata_reader.size(item))))
+
+    if untracked:
+        rendered_text = app.pfiga.template_engine.render_images(untracked)
+        source[0] += rendered_text
+        app.env.pfiga_pending[docname] = rendered_text
+
+
+def doctree_read(app: Any, doctree: nodes.document) -> None:
+    """
+    Collect the images of a second level readme from the doctree Sphinx parsed and warn about images missing on disk.
+
+    Connected with a priority below Sphinx's image collector so image URIs are still relative to the readme.
+
+    :param app: Sphinx application.
+
+    :param doctree: Doctree of the document that was read.
+    """
+    docname = app.env.docname
+    if _basename(docname) != Path(app.config.pfiga_second_level_name).stem:
+        return
+
+    collection = ImageCollection()
+    doctree.walk(SecondLevelProcessor(doctree, collection, {}))
+    app.env.pfiga_images[docname] = collection.to_dict()
+
+    directory = Path(app.env.doc2path(docname)).parent
+    for image in collection.collection:
+        if not directory.joinpath(image.uri).is_file():
+            _logger().warning("could not find image: '%s' on path: '%s'" % (image, directory), location=docname)
+
+
+def env_purge_doc(app: Any, env: Any, docname: str) -> None:
+    """
+    Forget the images of a document that is about to be re-read or was removed.
+
+    :param app: Sphinx application.
+
+    :param env: Build environment.
+
+    :param docname: Document being purged.
+    """
+    env.pfiga_images.pop(docname, None)
+    env.pfiga_pending.pop(docname, None)
+
+
+def env_merge_info(app: Any, env: Any, docnames: Set[str], other: Any) -> None:
+    """
+    Merge images collected by a parallel reader process into the main environment.
+
+    :param app: Sphinx application.
+
+    :param env: Main build environment.
+
+    :param docnames: Documents read by the other process.
+
+    :param other: Build environment of the other process.
+    """
+    for docname in docnames:
+        if docname in other.pfiga_images:
+            env.pfiga_images[docname] = other.pfiga_images[docname]
+        if docname in other.pfiga_pending:
+            env.pfiga_pending[docname] = other.pfiga_pending[docname]
+
+
+def env_updated(app: Any, env: Any) -> List[str]:
+    """
+    Write the images added to second level readmes while reading them, and add first and second level readmes that are not
+    included in any toctree to the toctree of their nearest first level readme.
+
+    The second level readmes are marked as read after the write, since Sphinx already parsed the text that was written.
+    Readmes directly below the root document's directory (or without a first level readme above them) are added to the
+    root document. Sphinx reads the updated toctrees on the next build. Readmes a toctree already lists are not added again.
+
+    :param app: Sphinx application.
+
+    :param env: Build environment (all documents have been read).
+
+    :returns: Empty list (no documents need to be re-written).
+    """
+    if not app.config.pfiga_update:
+        return []
+
+    for docname, rendered_text in sorted(env.pfiga_pending.items()):
+        path = Path(env.doc2path(docname))
+        with locked(path) as f_readme:
+            text = f_readme.read()
+            # the images may have been added to the file since it was read (e.g. by pfiga-browser)
+            if not set(IMAGE_REFERENCE.findall(rendered_text)) <= set(IMAGE_REFERENCE.findall(text)):
+                f_readme.write(rendered_text)
+        _mark_read(env, docname)
+    env.pfiga_pending = {}
+
+    first_level = Path(app.config.pfiga_first_level_name).stem
+    second_level = Path(app.config.pfiga_second_level_name).stem
+    root_doc = getattr(app.config, "root_doc", None) or app.config.master_doc
+
+    included: Set[str] = {child for children in env.toctree_includes.values() for child in children}
+    additions: Dict[str, List[Path]] = {}
+
+    for docname in sorted(env.found_docs):
+        if _basename(docname) not in (first_level, second_level) or docname in included or docname == root_doc:
+            continue
+        additions.setdefault(_toctree_parent(docname, env.found_docs, first_level, root_doc), []).append(
+            Path(env.doc2path(docname)))
+
+    for parent, paths in additions.items():
+        parent_path = Path(env.doc2path(parent))
+        if parent == root_doc:
+            app.pfiga.template_engine.update_index(paths, parent_path)
+        else:
+            app.pfiga.template_engine.update_first_level_readme(
+                [path.relative_to(parent_path.parent) for path in paths], parent_path)
+        _logger().info("pfiga: added %d untracked readme(s) to '%s'" % (len(paths), parent))
+
+    return []
+
+
+def _toctree_parent(docname: str, found_docs: Set[str], first_level: str, root_doc: str) -> str:
+    """
+    Find the document whose toctree should include `docname`: the nearest first level readme in a parent directory, or the root document.
+
+    :param docname: Untracked readme.
+
+    :param found_docs: All documents in the project.
+
+    :param first_level: Docname basename of first level readmes.
+
+    :param root_doc: Docname of the root document.
+
+    :returns: Docname of the parent document.
+    """
+    parts = docname.split("/")[:-1]
+    # a first level readme is included by the first level readme of a parent directory, not by itself
+    if _basename(docname) == first_level:
+        parts = parts[:-1]
+
+    while parts:
+        candidate = "/".join(parts + [first_level])
+        if candidate in found_docs:
+            return candidate
+        parts = parts[:-1]
+
+    return root_doc
+
+
+def build_finished(app: Any, exception: Optional[Exception]) -> None:
+    """
+    Persist the image metadata cache.
+
+    :param app: Sphinx application.
+
+    :param exception: Exception raised by the build, if any.
+    """
+    if hasattr(app, "pfiga"):
+        app.pfiga.metadata_reader.cache.save()
+
+
+def _logger() -> Any:
+    """Return the extension's Sphinx logger (imported lazily so the module can be imported without Sphinx)."""
+    from sphinx.util import logging
+
+    return logging.getLogger(__name__)
+
+
+def setup(app: Any) -> Dict[str, Any]:
+    """
+    Register the extension's configuration values and event handlers with Sphinx.
+
+    :param app: Sphinx application.
+
+    :returns: Extension metadata.
+    """
+    app.add_config_value("pfiga_first_level_name", "01readme.rst", "env")
+    app.add_config_value("pfiga_second_level_name", "02readme.rst", "env")
+    app.add_config_value("pfiga_image_exts", [".png", ".odg", ".svg"], "env")
+    app.add_config_value("pfiga_update", True, "env")
+    app.add_config_value("pfiga_cache_dir", "", "")
+
+    app.connect("builder-inited", builder_inited)
+    app.connect("env-get-outdated", env_get_outdated)
+    app.connect("source-read", source_read)
+    app.connect("doctree-read", doctree_read, priority=400)
+    app.connect("env-purge-doc", env_purge_doc)
+    app.connect("env-merge-info", env_merge_info)
+    app.connect("env-updated", env_updated)
+    app.connect("build-finished", build_finished)
+
+    return {
+        "version": "0.1.3",
+        "parallel_read_safe": True,
+        "parallel_write_safe": True
+    }
@@ -1,16 +1,31 @@
 #!/usr/bin/env python
-"""TODO Add file doc string."""
+"""
+Template engine for rendering and updating readmes.
+
+Readmes are updated while holding an exclusive lock on them (see `locking.py`), so several processes can update overlapping
+projects at the same time. Before writing, a readme is compared to the version the edit was planned against; if another
+process changed it in the meantime, it is parsed again and entries it already lists are not added a second time.
+
+Toctree entries are found with a line-based scan (see `listed_paths`), so readmes listing other readmes can also be updated
+from within a Sphinx build (see `sphinxext.py`) without a docutils parse.
+"""
 # python level imports
 import os
+import re
+import threading
+from contextlib import ExitStack, contextmanager
 from importlib import abc, resources
 import importlib.abc
-from typing import Union, List
+from typing import Callable, Iterator, Union, List, Optional, Tuple, Dict, Set, IO
 from pathlib import Path
 # jinja level imports
 import jinja2 as jinja
 # pfiga-browser level imports
 import pfiga_browser.templates
+from pfiga_browser.cache import file_stamp
 from pfiga_browser.imageinfo import Image, ImageCollection
+from pfiga_browser.locking import FileVersion, locked, text_digest
+from pfiga_browser.parsers import RstParser, SecondLevelProcessor
 
 
 class TemplateLoader(jinja.BaseLoader):
@@ -43,7 +58,7 @@ class TemplateLoader(jinja.BaseLoader):
         return (full_path.read_text(), str(full_path), lambda: mtime == os.path.getmtime(full_path))
 
 
-def add_indent(text: str, level: int = 1) -> str:
+def add_indent(text: str, level: int = 1, indent: str = "\t") -> str:
     """
     Add `level` levels of indent to `text`. `text` must be lines in a file separated by a carriage return.
 
@@ -51,28 +66,123 @@ def add_indent(text: str, level: int = 1) -> str:
 
     :param level: (optional) level of indent to add (number of levels, in other words; the number of tab characters to add to the lines). Defaults to 1.
 
+    :param indent: (optional) string making up one level of indent. Defaults to a tab character.
+
     :returns: `text` indented by `level` levels.
     """
     lines = text.split("\n")
     indented_text = ""
 
     for line in lines:
-        indented_text += ("\t" * level) + line.strip() + "\n"
+        indented_text += (indent * level) + line.strip() + "\n"
 
     return indented_text
 
 
+# start of a `toctree` directive
+TOCTREE_DIRECTIVE = re.compile(r"^\s*\.\. toctree::", re.MULTILINE)
+
+
+def toctree_indent(text: str) -> str:
+    """
+    Find the indent used for the content of the last `toctree` directive in `text`, so appended entries line up with existing ones.
+
+    Sphinx does not strip entries, so an entry indented differently than the rest of the directive (e.g. a tab among spaces) is read as a different path.
+
+    :param text: reST text.
+
+    :returns: Leading whitespace of the directive's first indented line, or three spaces if there is none.
+    """
+    lines = text.split("\n")
+    directives = [number for number, line in enumerate(lines) if line.strip().startswith(".. toctree::")]
+
+    if directives:
+        for line in lines[directives[-1] + 1:]:
+            if line.strip():
+                if line[0].isspace():
+                    return line[:len(line) - len(line.lstrip())]
+                break
+
+    return "   "
+
+
+def toctree_addition(text: str, entries: str) -> str:
+    """
+    Return the text to append to a readme to add toctree entries: the entries indented like those of its last `toctree`
+    directive, or a new `toctree` directive holding them if the readme has none (bare indented lines would be a block quote).
+
+    :param text: Current contents of the readme.
+
+    :param entries: Rendered entries (see the `index.rst` template).
+
+    :returns: Text to append.
+    """
+    if TOCTREE_DIRECTIVE.search(text):
+        return add_indent(entries, indent=toctree_indent(text))
+    separator = "" if not text or text.endswith("\n") else "\n"
+    return separator + "\n.. toctree::\n" + add_indent(entries, indent="   ")
+
+
 class TemplateEngine(object):
-    """Sets up the jinja2 template engine and environment and provides methods for rendering and updating readme files."""
+    """
+    Sets up the jinja2 template engine and environment and provides methods for rendering and updating readme files.
+
+    `versions`: Map of readmes to the version edits to them are planned against (see `expect`). Readmes without a known version are always re-parsed before they are updated.
+    """
 
     environment = None
 
+    versions: Dict[Path, FileVersion]
+
     def __init__(self):
         """Create a jinja2 environment for the package."""
         self.environment = jinja.Environment(
             loader=TemplateLoader(resources.files(pfiga_browser.templates)),
             autoescape=jinja.select_autoescape()
         )
+        self.versions = {}
+        self._observer = threading.local()
+
+    @contextmanager
+    def observe(self, callback: Optional[Callable[[str, Path], None]]) -> Iterator[None]:
+        """
+        Report the readmes written by the calling thread to `callback` until the block is left (for progress reporting).
+
+        The engine is shared by projects processed on different threads, so each thread has its own callback.
+
+        :param callback: Called with ('write', path) after a readme was written. None to not report writes.
+
+        :returns: Context manager.
+        """
+        previous = getattr(self._observer, "callback", None)
+        self._observer.callback = callback
+        try:
+            yield
+        finally:
+            self._observer.callback = previous
+
+    def expect(self, path: Path, version: FileVersion) -> None:
+        """
+        Record the version of a readme that edits to it are planned against (usually the version that was parsed).
+
+        :param path: Path to the readme.
+
+        :param version: Version of the readme.
+        """
+        self.versions[path] = version
+
+    def render_images(self, images: Union[List[Image], ImageCollection]) -> str:
+        """
+        Render image data in `images` as second level readme entries (see the `readme.rst` template).
+
+        :param images: Either a list of `Images` or single `ImageCollection`.
+
+        :returns: Rendered reST text.
+        """
+        image_template = self.environment.get_template("readme.rst")
+
+        return image_template.render(
+            images=images.collection if isinstance(images, ImageCollection) else images)
 
     def update_images(self, images: Union[List[Image], ImageCollection], outpath: Path) -> None:
         """
@@ -99,15 +209,18 @@ class TemplateEngine(object):
             raise FileNotFoundError(
                 "Could not find file to append to: '%s'" % outpath)
 
-        # render template and save text
-        image_template = self.environment.get_template("readme.rst")
-
-        rendered_text = image_template.render(
-            images=images.collection if isinstance(images, ImageCollection) else images)
+        with locked(outpath) as f_outpath:
+            text = f_outpath.read()
+            if not self.unchanged(outpath, f_outpath, text):
+                # changed by another process since it was parsed; only add images it does not list yet
+                listed = listed_images(outpath, text)
+                images = [image for image in (images.collection if isinstance(images, ImageCollection) else images)
+                          if image.uri not in listed]
+                if not images:
+                    return
 
-        # append rendered string to file
-        with outpath.open("a") as f_outpath:
-            f_outpath.write(rendered_text)
+            # render template and append rendered string to file
+            self.append(outpath, f_outpath, text, self.render_images(images))
 
     def update_first_level_readme(self, paths: List[Path], outpath: Path) -> None:
         """
@@ -125,11 +238,18 @@ class TemplateEngine(object):
 
         readme_template = self.environment.get_template("index.rst")
 
-        rendered_text = readme_template.render(
-            paths=[str(path) for path in paths])
+        with locked(outpath) as f_outpath:
+            text = f_outpath.read()
+            # readmes the file already lists (added by another process, or by an earlier Sphinx build) are not added again
+            listed = listed_paths(outpath, text)
+            paths = [path for path in paths if os.path.normpath(outpath.parent.joinpath(path)) not in listed]
+            if not paths:
+                return
 
-        with outpath.open("a") as f_outpath:
-            f_outpath.write(add_indent(rendered_text))
+            rendered_text = readme_template.render(
+                paths=[str(path) for path in paths])
+
+            self.append(outpath, f_outpath, text, toctree_addition(text, rendered_text))
 
     def update_index(self, paths: List[Path], outpath: Path) -> None:
         """
@@ -147,8 +267,290 @@ class TemplateEngine(object):
 
         index_template = self.environment.get_template("index.rst")
 
-        rendered_text = index_template.render(
-            paths=[str(path.relative_to(outpath.parent)) for path in paths])
+        with locked(outpath) as f_outfile:
+            text = f_outfile.read()
+            # readmes the file already lists (added by another process, or by an earlier Sphinx build) are not added again
+            listed = listed_paths(outpath, text)
+            paths = [path for path in paths if os.path.normpath(path) not in listed]
+            if not paths:
+                return
+
+            rendered_text = index_template.render(
+                paths=[str(path.relative_to(outpath.parent)) for path in paths])
+
+            self.append(outpath, f_outfile, text, toctree_addition(text, rendered_text))
+
+    def rename_image(self, old_uri: str, new_uri: str, outpath: Path) -> None:
+        """
+        Rename an image in an existing second level readme, keeping its description and options.
+
+        Rewrites the image name (bold text), the `image` directive, and the `:download:` link or `:target:` option (used for thumbnails) in place.
 
-        with outpath.open("a") as f_outfile:
-            f_outfile.write(add_indent(rendered_text))
+        :param old_uri: URI the image is currently listed under.
+
+        :param new_uri: URI to list the image under.
+
+        :param outpath: `Path` to the second level readme to update.
+
+        :raises: `FileNotFoundError` if `outpath` is not a file or does not exist.
+        """
+        if not outpath.exists() and not outpath.is_file():
+            raise FileNotFoundError(
+                "Could not find file to update: '%s'" % outpath)
+
+        # the rename is applied to the current contents, so it needs no re-planning
+        with locked(outpath) as f_outpath:
+            self.rewrite(outpath, f_outpath, rename_in_text(f_outpath.read(), old_uri, new_uri))
+
+    def move_image(self, old_uri: str, new_uri: str, oldpath: Path, outpath: Path) -> None:
+        """
+        Move an image entry from one second level readme to another, keeping its description and options.
+
+        The entry spans from the paragraph starting with the bold image name to the end of the image's `image` directive
+        (including anything in between, e.g. lists of suggested captions). It is removed from `oldpath`, renamed to
+        `new_uri`, and appended to `outpath`. A thumbnail shown instead of the image is linked relative to `outpath`.
+
+        :param old_uri: URI the image is currently listed under in `oldpath`.
+
+        :param new_uri: URI to list the image under in `outpath`.
+
+        :param oldpath: `Path` to the second level readme the image is currently listed in.
+
+        :param outpath: `Path` to the second level readme to move the image to.
+
+        :raises: `FileNotFoundError` if `oldpath` or `outpath` is not a file or does not exist.
+        """
+        for path in (oldpath, outpath):
+            if not path.exists() and not path.is_file():
+                raise FileNotFoundError(
+                    "Could not find file to update: '%s'" % path)
+
+        with ExitStack() as stack:
+            # both readmes are locked (in a fixed order, so two moves in opposite directions cannot deadlock)
+            files: Dict[Path, IO[str]] = {}
+            for path in sorted({oldpath, outpath}):
+                files[path] = stack.enter_context(locked(path))
+
+            # the entry is looked up in the current contents, so the move needs no re-planning
+            lines = files[oldpath].read().split("\n")
+            span = find_image_entry(lines, old_uri)
+            if span is None:
+                return
+
+            entry = rename_in_text("\n".join(lines[span[0]:span[1]]), old_uri, new_uri)
+            entry = rebase_in_text(entry, oldpath.parent, outpath.parent, new_uri)
+            self.rewrite(oldpath, files[oldpath], "\n".join(lines[:span[0]] + lines[span[1]:]))
+
+            files[outpath].seek(0)
+            self.append(outpath, files[outpath], files[outpath].read(), "\n" + entry + "\n")
+
+    def unchanged(self, path: Path, f_file: IO[str], text: str) -> bool:
+        """
+        Return true if a locked readme is still the version edits to it were planned against. See `expect`.
+
+        :param path: Path to the readme.
+
+        :param f_file: The locked readme.
+
+        :param text: Current contents of the readme.
+
+        :returns: True if the readme has a known version and did not change since.
+        """
+        version = self.versions.get(path)
+        return version is not None and version.matches(f_file, text)
+
+    def append(self, path: Path, f_file: IO[str], text: str, addition: str) -> None:
+        """
+        Append to a locked readme and record the new version, so later edits in this run are not re-planned.
+
+        :param path: Path to the readme.
+
+        :param f_file: The locked readme.
+
+        :param text: Current contents of the readme.
+
+        :param addition: Text to append.
+        """
+        f_file.seek(0, os.SEEK_END)
+        f_file.write(addition)
+        self.written(path, f_file, text + addition)
+
+    def rewrite(self, path: Path, f_file: IO[str], text: str) -> None:
+        """
+        Replace the contents of a locked readme and record the new version.
+
+        :param path: Path to the readme.
+
+        :param f_file: The locked readme.
+
+        :param text: New contents of the readme.
+        """
+        f_file.seek(0)
+        f_file.write(text)
+        f_file.truncate()
+        self.written(path, f_file, text)
+
+    def written(self, path: Path, f_file: IO[str], text: str) -> None:
+        """
+        Record the version of a readme that was just written.
+
+        :param path: Path to the readme.
+
+        :param f_file: The locked readme.
+
+        :param text: Contents of the readme.
+        """
+        f_file.flush()
+        self.versions[path] = FileVersion(file_stamp(path, os.fstat(f_file.fileno())), text_digest(text))
+
+        callback = getattr(self._observer, "callback", None)
+        if callback is not None:
+            callback("write", path)
+
+
+def listed_paths(path: Path, text: str) -> Set[str]:
+    """
+    Find the toctree entries of a readme with a line-based scan: the indented lines after a `toctree` directive that are not options.
+
+    :param path: Path to the readme.
+
+    :param text: Contents of the readme.
+
+    :returns: Set of normalized absolute paths listed in its toctree directives.
+    """
+    entries: Set[str] = set()
+    lines = text.split("\n")
+
+    for match in TOCTREE_DIRECTIVE.finditer(text):
+        for line in lines[text.count("\n", 0, match.start()) + 1:]:
+            if line.strip() and not line[0].isspace():
+                break
+            entry = line.strip()
+            if entry and not entry.startswith(":"):
+                entries.add(os.path.normpath(path.parent.joinpath(entry)))
+
+    return entries
+
+
+def listed_images(path: Path, text: str) -> Set[str]:
+    """
+    Parse the images described in a second level readme.
+
+    :param path: Path to the readme.
+
+    :param text: Contents of the readme.
+
+    :returns: Set of URIs of the images.
+    """
+    image_collection = ImageCollection()
+    parsed_rst = RstParser(path, text).parse()
+    parsed_rst.walk(SecondLevelProcessor(parsed_rst, image_collection, {}))
+    return {image.uri for image in image_collection.collection}
+
+
+def rename_in_text(text: str, old_uri: str, new_uri: str) -> str:
+    """
+    Replace an image URI in second level readme text: the image name (bold text), the `image` directive, and the `:download:` link or `:target:` option.
+
+    :param text: Readme text.
+
+    :param old_uri: URI to replace.
+
+    :param new_uri: URI to replace it with.
+
+    :returns: `text` with the image renamed.
+    """
+    old = re.escape(old_uri)
+    patterns = [
+        re.compile(r"^(\s*\*\*)%s(\*\*)" % old, re.MULTILINE),
+        re.compile(r"^(\s*\.\. image::\s*)%s(\s*)$" % old, re.MULTILINE),
+        re.compile(r"^(\s+:target:\s*)%s(\s*)$" % old, re.MULTILINE),
+        re.compile(r"^(\s*:download:`[^`<]*<)%s(>`\s*)$" % old, re.MULTILINE)
+    ]
+
+    for pattern in patterns:
+        text = pattern.sub(lambda match: match.group(1) + new_uri + match.group(2), text)
+
+    return text
+
+
+def rebase_in_text(text: str, olddir: Path, newdir: Path, uri: str) -> str:
+    """
+    Rewrite the relative `image` directive arguments in a second level readme entry moved from `olddir` to `newdir` (e.g. thumbnails).
+
+    :param text: Text of the entry.
+
+    :param olddir: Directory of the readme the entry was in.
+
+    :param newdir: Directory of the readme the entry is moved to.
+
+    :param uri: URI of the moved image itself, which is already relative to `newdir` (left as is).
+
+    :returns: `text` with the other relative image paths pointing at the same files from `newdir`.
+    """
+    directive = re.compile(r"^(\s*\.\. image::\s*)(\S+)(\s*)$", re.MULTILINE)
+
+    def rebase(match: "re.Match[str]") -> str:
+        path = match.group(2)
+        # absolute paths are relative to the Sphinx source directory and do not depend on the readme
+        if path == uri or path.startswith("/") or "://" in path:
+            return match.group(0)
+        return match.group(1) + Path(os.path.relpath(olddir.joinpath(path), newdir)).as_posix() + match.group(3)
+
+    return directive.sub(rebase, text)
+
+
+def find_image_entry(lines: List[str], uri: str) -> Optional[Tuple[int, int]]:
+    """
+    Find the lines of a second level readme that describe an image.
+
+    The entry starts at the paragraph starting with the bold image name (or the `image` directive if there is no description) and ends
+    after the directive's options (or the `:download:` link following them) and the following blank line. The image is either the
+    directive's argument or, for thumbnails, the file of the `:download:` link or of the `:target:` option.
+
+    :param lines: Lines of the readme.
+
+    :param uri: URI of the image.
+
+    :returns: (first line, line after the last line) of the entry or None if the image has no `image` directive.
+    """
+    description = re.compile(r"^\s*\*\*%s\*\*" % re.escape(uri))
+    directive = re.compile(r"^\s*\.\. image::\s*(\S+)\s*$")
+    target = re.compile(r"^\s+:target:\s*%s\s*$" % re.escape(uri))
+    link = re.compile(r"^\s*:download:`[^`<]*<%s>`\s*$" % re.escape(uri))
+
+    start: Optional[int] = None
+    end: Optional[int] = None
+
+    for number, line in enumerate(lines):
+        if start is None and description.match(line):
+            start = number
+
+        match = directive.match(line)
+        if match:
+            options_end = number + 1
+            while options_end < len(lines) and lines[options_end].strip() and lines[options_end][0].isspace():
+                options_end += 1
+            # a thumbnail's download link is the next paragraph
+            link_line = options_end
+            while link_line < len(lines) and not lines[link_line].strip():
+                link_line += 1
+            if link_line < len(lines) and link.match(lines[link_line]):
+                end = link_line + 1
+                if start is None:
+                    start = number
+                break
+            if match.group(1) == uri or any(target.match(option) for option in lines[number + 1:options_end]):
+                end = options_end
+                if start is None:
+                    start = number
+                break
+
+    if start is None or end is None:
+        return None
+
+    # include the blank line separating the entry from the next one
+    if end < len(lines) and not lines[end].strip():
+        end += 1
+
+    return (min(start, end), end)
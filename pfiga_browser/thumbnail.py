@@ -0,0 +1,430 @@
+#!/usr/bin/env python
+"""
+Thumbnail generation for images found in a project.
+
+PNG images are decoded with zlib, downscaled with NumPy (area averaging), and re-encoded as PNGs. Thumbnails are stored
+in a content-addressed directory (named by the SHA-256 of the original image) so an unchanged image is never processed twice,
+no matter where it is in the project or how often it is renamed or copied.
+
+`decode_png`: Decode PNG data into a NumPy array of pixels.
+
+`encode_png`: Encode a NumPy array of pixels as PNG data.
+
+`downscale`: Resize pixels to a given width using area averaging.
+
+`ThumbnailGenerator`: Generates thumbnails for a list of images on a process pool.
+"""
+# python level imports
+import os
+import zlib
+import struct
+from concurrent.futures import Executor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from pathlib import Path
+# numpy level imports
+import numpy as np
+# pfiga-browser level imports
+from pfiga_browser.workers import process_pool
+from pfiga_browser.cache import StatCache, content_hash
+from pfiga_browser.metadata import PNG_SIGNATURE
+
+# number of channels for each PNG color type
+PNG_CHANNELS: Dict[int, int] = {
+    0: 1,  # grayscale
+    2: 3,  # RGB
+    3: 1,  # palette index
+    4: 2,  # grayscale + alpha
+    6: 4   # RGBA
+}
+
+
+class UnsupportedImageError(Exception):
+    """Exception raised when an image cannot be decoded (invalid data or unsupported PNG features)."""
+
+    def __init__(self, *args: object):
+        """
+        Initialize the exception object. See `Exception` base class.
+
+        :param args: Arguments passed to the Exception super class to initialize with.
+        """
+        super(UnsupportedImageError, self).__init__(*args)
+
+
+def _unfilter_wavefront(data: np.ndarray, filters: np.ndarray, bpp: int) -> np.ndarray:
+    """
+    Reverse the filters of all rows of an image that uses the 'Average' or 'Paeth' filter.
+
+    A pixel of these rows depends on the unfiltered pixels to its left, above, and above left, so neither a row nor a column
+    can be unfiltered at once. All pixels on an anti-diagonal (same x + y) are independent of each other, though, so the
+    image is unfiltered in place one anti-diagonal at a time, vectorized over its pixels (width + height steps instead of one
+    step per byte).
+
+    :param data: Filtered rows, shape (height, stride).
+
+    :param filters: Filter type of each row.
+
+    :param bpp: Number of bytes per complete pixel.
+
+    :returns: Unfiltered rows, shape (height, stride).
+    """
+    height, stride = data.shape
+    width = -(-stride // bpp)
+    # a row and a column of zeros above and left of the image are the neighbours the filters use at the edges
+    pixels = np.zeros((height + 1, width + 1, bpp), dtype=np.uint8)
+    pixels[1:, 1:].reshape(height, width * bpp)[:, :stride] = data
+
+    # filter type of each row as 0/1 factors, so each row's predictor is picked without branching
+    kinds = filters.astype(np.int16)[:, None]
+    is_sub, is_up, is_average, is_paeth = [(kinds == kind).astype(np.int16) for kind in (1, 2, 3, 4)]
+
+    for diagonal in range(height + width - 1):
+        low, high = max(0, diagonal - width + 1), min(height, diagonal + 1)
+        y = np.arange(low + 1, high + 1)
+        x = diagonal + 2 - y
+        left = pixels[y, x - 1].astype(np.int16)
+        up = pixels[y - 1, x].astype(np.int16)
+        up_left = pixels[y - 1, x - 1].astype(np.int16)
+
+        # Paeth: the neighbour closest to left + up - up_left, preferring left, then up
+        distance_left = np.abs(up - up_left)
+        distance_up = np.abs(left - up_left)
+        distance_up_left = np.abs(left + up - 2 * up_left)
+        paeth = np.where((distance_left <= distance_up) & (distance_left <= distance_up_left), left,
+                         np.where(distance_up <= distance_up_left, up, up_left))
+
+        predictor = (left * is_sub[low:high] + up * is_up[low:high] + ((left + up) >> 1) * is_average[low:high] +
+                     paeth * is_paeth[low:high])
+        # uint8 arithmetic wraps around
+        pixels[y, x] += predictor.astype(np.uint8)
+
+    return pixels[1:, 1:].reshape(height, width * bpp)[:, :stride].copy()
+
+
+def _unfilter(raw: np.ndarray, height: int, stride: int, bpp: int) -> np.ndarray:
+    """
+    Reverse PNG scanline filtering.
+
+    'None' and 'Up' filters are vectorized over the whole row. 'Sub' is a running sum along each channel, which
+    is also vectorized. 'Average' and 'Paeth' depend on the previously decoded pixel, so images using them are
+    unfiltered by anti-diagonals instead (see `_unfilter_wavefront`).
+
+    :param raw: Decompressed IDAT data (one filter byte followed by `stride` bytes per row).
+
+    :param height: Number of rows.
+
+    :param stride: Number of bytes in a row (excluding the filter byte).
+
+    :param bpp: Number of bytes per complete pixel (at least 1).
+
+    :returns: 2D array of unfiltered bytes, shape (height, stride).
+    """
+    rows = raw.reshape(height, stride + 1)
+    filters = rows[:, 0]
+    data = rows[:, 1:].copy()
+
+    if np.any(filters > 4):
+        raise UnsupportedImageError("Invalid PNG filter type: %d" % filters[filters > 4][0])
+    if np.any(filters >= 3):
+        return _unfilter_wavefront(data, filters, bpp)
+
+    previous = np.zeros(stride, dtype=np.uint8)
+
+    for y in range(height):
+        line = data[y]
+        kind = filters[y]
+
+        if kind == 1:
+            # Sub: cumulative sum modulo 256 along each channel (uint8 arithmetic wraps around)
+            padded = np.zeros(-(-stride // bpp) * bpp, dtype=np.uint8)
+            padded[:stride] = line
+            line[:] = np.cumsum(padded.reshape(-1, bpp), axis=0, dtype=np.uint8).reshape(-1)[:stride]
+        elif kind == 2:
+            line += previous
+
+        previous = line
+
+    return data
+
+
+def decode_png(data: bytes) -> np.ndarray:
+    """
+    Decode PNG data into an array of 8-bit pixels.
+
+    Supports all color types and bit depths of non-interlaced images. Palette images are expanded to RGB, 16-bit samples are
+    reduced to 8 bits and sub-byte grayscale samples are scaled to the full 8-bit range.
+
+    :param data: Contents of a PNG file.
+
+    :returns: Array of shape (height, width, channels) of type uint8.
+
+    :raises: UnsupportedImageError if the data is not a valid PNG or uses an unsupported feature (interlacing).
+    """
+    if data[:8] != PNG_SIGNATURE:
+        raise UnsupportedImageError("Not a PNG file")
+
+    offset = 8
+    header: Optional[Tuple[int, ...]] = None
+    palette: Optional[np.ndarray] = None
+    idat: List[bytes] = []
+
+    # collect the chunks needed for decoding
+    while offset + 8 <= len(data):
+        length, kind = struct.unpack(">I4s", data[offset:offset + 8])
+        body = data[offset + 8:offset + 8 + length]
+        offset += length + 12
+
+        if kind == b"IHDR":
+            header = struct.unpack(">IIBBBBB", body)
+        elif kind == b"PLTE":
+            palette = np.frombuffer(body, dtype=np.uint8).reshape(-1, 3)
+        elif kind == b"IDAT":
+            idat.append(body)
+        elif kind == b"IEND":
+            break
+
+    if header is None or not idat:
+        raise UnsupportedImageError("PNG file is missing IHDR or IDAT chunks")
+
+    width, height, bit_depth, color_type, _, _, interlace = header
+    if interlace != 0:
+        raise UnsupportedImageError("Interlaced PNG images are not supported")
+    if color_type not in PNG_CHANNELS:
+        raise UnsupportedImageError("Invalid PNG color type: %d" % color_type)
+
+    channels = PNG_CHANNELS[color_type]
+    bits_per_pixel = channels * bit_depth
+    stride = (width * bits_per_pixel + 7) // 8
+
+    try:
+        raw = np.frombuffer(zlib.decompress(b"".join(idat)), dtype=np.uint8)
+    except zlib.error as ex:
+        raise UnsupportedImageError("Corrupt PNG data: %s" % ex)
+    if raw.size < height * (stride + 1):
+        raise UnsupportedImageError("Truncated PNG data")
+
+    rows = _unfilter(raw[:height * (stride + 1)], height, stride, max(1, bits_per_pixel // 8))
+
+    # convert samples to 8 bits
+    if bit_depth == 16:
+        pixels = rows.reshape(height, width, channels, 2)[..., 0]
+    elif bit_depth == 8:
+        pixels = rows.reshape(height, width, channels)
+    else:
+        samples = np.unpackbits(rows, axis=1).reshape(height, -1, bit_depth)
+        weights = (1 << np.arange(bit_depth - 1, -1, -1)).astype(np.uint8)
+        samples = (samples * weights).sum(axis=2, dtype=np.uint8)[:, :width]
+        if color_type == 0:
+            samples = samples * np.uint8(255 // ((1 << bit_depth) - 1))
+        pixels = samples.reshape(height, width, 1)
+
+    if color_type == 3:
+        if palette is None:
+            raise UnsupportedImageError("Palette PNG is missing a PLTE chunk")
+        pixels = palette[np.minimum(pixels[..., 0], len(palette) - 1)]
+
+    return np.ascontiguousarray(pixels)
+
+
+def encode_png(pixels: np.ndarray) -> bytes:
+    """
+    Encode an array of 8-bit pixels as PNG data.
+
+    :param pixels: Array of shape (height, width, channels) of type uint8 with 1 to 4 channels.
+
+    :returns: Contents of a PNG file.
+    """
+    height, width, channels = pixels.shape
+    color_type = {1: 0, 2: 4, 3: 2, 4: 6}[channels]
+
+    def chunk(kind: bytes, body: bytes) -> bytes:
+        return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body) & 0xFFFFFFFF)
+
+    # prefix each row with filter type 0 (None)
+    rows = np.zeros((height, width * channels + 1), dtype=np.uint8)
+    rows[:, 1:] = pixels.reshape(height, -1)
+
+    return PNG_SIGNATURE + \
+        chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)) + \
+        chunk(b"IDAT", zlib.compress(rows.tobytes(), 9)) + \
+        chunk(b"IEND", b"")
+
+
+def _area_weights(old_size: int, new_size: int) -> np.ndarray:
+    """
+    Create a matrix that resamples `old_size` samples to `new_size` samples by averaging over the area each new sample covers.
+
+    :param old_size: Number of input samples.
+
+    :param new_size: Number of output samples.
+
+    :returns: Array of shape (new_size, old_size) whose rows sum to 1.
+    """
+    edges = np.linspace(0, old_size, new_size + 1)
+    starts = np.arange(old_size)
+    # overlap of each output interval [edges[i], edges[i+1]) with each input pixel [x, x + 1)
+    overlap = np.clip(np.minimum(edges[1:, None], starts[None, :] + 1) -
+                      np.maximum(edges[:-1, None], starts[None, :]), 0, None)
+    return (overlap / overlap.sum(axis=1, keepdims=True)).astype(np.float32)
+
+
+def area_resize(pixels: np.ndarray, width: int, height: int) -> np.ndarray:
+    """
+    Resize `pixels` to exactly `width` x `height` using area averaging (each output pixel is the mean of the input area it covers).
+
+    :param pixels: Array of shape (height, width, channels).
+
+    :param width: Width of the result in pixels.
+
+    :param height: Height of the result in pixels.
+
+    :returns: Array of shape (`height`, `width`, channels) of type float32.
+    """
+    rows = _area_weights(pixels.shape[0], height)
+    columns = _area_weights(pixels.shape[1], width)
+
+    # (height, old height) x (old height, old width, channels) -> (height, old width, channels)
+    resized = np.tensordot(rows, pixels.astype(np.float32), axes=([1], [0]))
+    # (height, old width, channels) x (width, old width) -> (height, channels, width)
+    resized = np.tensordot(resized, columns, axes=([1], [1]))
+
+    return resized.transpose(0, 2, 1)
+
+
+def downscale(pixels: np.ndarray, width: int) -> np.ndarray:
+    """
+    Resize `pixels` to `width` (keeping the aspect ratio) using area averaging. Images narrower than `width` are returned unchanged.
+
+    :param pixels: Array of shape (height, width, channels) of type uint8.
+
+    :param width: Width of the result in pixels.
+
+    :returns: Array of shape (new height, `width`, channels) of type uint8.
+    """
+    old_height, old_width = pixels.shape[:2]
+    if old_width <= width:
+        return pixels
+
+    height = max(1, round(old_height * width / old_width))
+    resized = area_resize(pixels, width, height)
+
+    return np.clip(np.rint(resized), 0, 255).astype(np.uint8)
+
+
+def make_thumbnail(source: Path, target: Path, width: int) -> Optional[Path]:
+    """
+    Create a thumbnail of the PNG image at `source` and write it to `target`. Run in worker processes by `ThumbnailGenerator`.
+
+    :param source: Path to the original image.
+
+    :param target: Path to write the thumbnail to.
+
+    :param width: Width of the thumbnail in pixels.
+
+    :returns: `target` or None if the image could not be decoded.
+    """
+    try:
+        pixels = decode_png(source.read_bytes())
+    except UnsupportedImageError:
+        return None
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    # write to a temporary file first so a partially written thumbnail is never picked up from the cache
+    tmp_target = target.with_name(target.name + ".%d.tmp" % os.getpid())
+    tmp_target.write_bytes(encode_png(downscale(pixels, width)))
+    os.replace(tmp_target, target)
+
+    return target
+
+
+class ThumbnailGenerator(object):
+    """
+    Generates thumbnails for images into a content-addressed directory using a pool of worker processes.
+
+    Thumbnails are named `<sha256 of the original>-<width>.png`, so an image is only processed if a thumbnail for its exact
+    content does not exist yet.
+
+    `store`: Directory thumbnails are written to. Must be inside the documentation source tree for readmes to reference it.
+
+    `width`: Width of the thumbnails in pixels.
+
+    `workers`: Number of worker processes. None uses one per CPU.
+
+    `cache`: Cache for content hashes (see `content_hash`).
+    """
+
+    store: Path
+
+    width: int
+
+    workers: Optional[int]
+
+    cache: Optional[StatCache]
+
+    def __init__(self, store: Path, width: int = 300, workers: Optional[int] = None, cache: Optional[StatCache] = None):
+        """
+        Initialize with the thumbnail store location and settings.
+
+        :param store: Directory to write thumbnails to.
+
+        :param width: Optional. Width of the thumbnails in pixels. Defaults to 300.
+
+        :param workers: Optional. Number of worker processes. Defaults to one per CPU.
+
+        :param cache: Optional. Cache to store content hashes in.
+        """
+        self.store = store
+        self.width = width
+        self.workers = workers
+        self.cache = cache
+
+    def thumbnail_path(self, digest: str) -> Path:
+        """
+        Return the path of the thumbnail for an image with content hash `digest`.
+
+        :param digest: SHA-256 hex digest of the original image.
+
+        :returns: Path to the (possibly not yet existing) thumbnail.
+        """
+        return self.store.joinpath(digest[:2], "%s-%d.png" % (digest, self.width))
+
+    def generate(self, images: Iterable[Path], executor: Optional[Executor] = None) -> Dict[Path, Path]:
+        """
+        Create thumbnails for all PNG images in `images` that don't have one yet.
+
+        :param images: Paths to images (e.g. the result of `DirectoryWalker.find_all_images`). Non-PNG images are skipped.
+
+        :param executor: Optional. Process pool to run on (e.g. one shared by several projects). A new pool is created by default.
+
+        :returns: Map of each image path to its thumbnail path. Images that could not be decoded are omitted.
+        """
+        thumbnails: Dict[Path, Path] = {}
+        pending: Dict[Path, Path] = {}
+        pending_targets: Set[Path] = set()
+
+        for image in images:
+            if image.suffix.lower() != ".png":
+                continue
+            target = self.thumbnail_path(content_hash(image, self.cache))
+            if target.is_file():
+                thumbnails[image] = target
+            elif target in pending_targets:
+                # identical copies of an image share a single thumbnail
+                thumbnails[image] = target
+            else:
+                pending[image] = target
+                pending_targets.add(target)
+
+        if pending:
+            pool = executor if executor is not None else process_pool(self.workers)
+            try:
+                results = pool.map(make_thumbnail, pending.keys(), pending.values(),
+                                   [self.width] * len(pending))
+                for image, result in zip(pending.keys(), results):
+                    if result is not None:
+                        thumbnails[image] = result
+            finally:
+                if executor is None:
+                    pool.shutdown()
+
+        # drop copies whose shared thumbnail failed to decode
+        return {image: target for image, target in thumbnails.items() if target.is_file()}
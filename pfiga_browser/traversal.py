@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+"""
+Traversal of a project's toctrees to any depth.
+
+Starting at the project index, every readme listed in a `toctree` directive is parsed (once, even if it is listed in several
+toctrees) and the readmes it lists are added to a work queue. Each readme is parsed for both its toctree entries and its images,
+so no file is read twice. Optionally (`use_maxdepth`), the `:maxdepth:` option of a toctree limits how many levels below the readme holding it are followed.
+
+`ReadmeDocument`: A readme found by the traversal, with its toctree entries and images.
+
+`TocTreeWalker`: Breadth-first traversal of the toctrees of a project.
+"""
+# python level imports
+import os
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple
+from pathlib import Path
+# pfiga-browser level imports
+from pfiga_browser.cache import file_stamp
+from pfiga_browser.checkpoint import Journal
+from pfiga_browser.error import OperationCancelledError
+from pfiga_browser.filesystem import LOCAL, FileSystem
+from pfiga_browser.imageinfo import ImageCollection
+from pfiga_browser.locking import FileVersion, text_digest
+from pfiga_browser.parsers import ReadmeDocumentParser
+
+
+class ReadmeDocument(object):
+    """
+    A readme found by the toctree traversal.
+
+    `path`: Normalized absolute path to the readme.
+
+    `depth`: Number of toctrees between the index and the readme (0 for the index itself).
+
+    `parent`: Readme whose toctree the readme was first found in. None for the index.
+
+    `children`: Paths listed in the readme's toctree directives, in document order.
+
+    `maxdepths`: Map of each child to the `:maxdepth:` option of the toctree it is listed in.
+
+    `collection`: Images described in the readme.
+
+    `budget`: Number of levels below the readme that may still be followed. None if unlimited.
+
+    `version`: Version of the readme that was parsed (edits to the readme are planned against it, see `TemplateEngine.expect`).
+    """
+
+    path: Path
+
+    depth: int
+
+    parent: Optional[Path]
+
+    children: List[Path]
+
+    maxdepths: Dict[Path, Optional[int]]
+
+    collection: ImageCollection
+
+    budget: Optional[int]
+
+    version: FileVersion
+
+    def __init__(self, path: Path, depth: int, parent: Optional[Path], budget: Optional[int],
+                 journal: Optional[Journal] = None, fs: Optional[FileSystem] = None):
+        """
+        Parse the readme at `path`, or take the parse result from the journal if it is up to date.
+
+        :param path: Normalized absolute path to the readme.
+
+        :param depth: Depth of the readme.
+
+        :param parent: Readme the path was found in.
+
+        :param budget: Number of levels below the readme that may be followed.
+
+        :param journal: Optional. Checkpoint journal to look up and record the parse result in.
+
+        :param fs: Optional. File system to read the readme from. The local disk by default.
+
+        :raises FileNotFoundError: if the readme does not exist.
+        """
+        self.path = path
+        self.depth = depth
+        self.parent = parent
+        self.budget = budget
+
+        parsed = journal.readme(path) if journal is not None else None
+        if parsed is not None:
+            # recorded children are already normalized
+            self.children, self.maxdepths, self.collection, self.version = parsed
+            return
+
+        # stamped before reading, so a change made while the readme is parsed is noticed
+        fs = fs if fs is not None else LOCAL
+        stamp = file_stamp(path, fs.stat(path))
+        parser = ReadmeDocumentParser(path, fs)
+        children, maxdepths, self.collection = parser.parse()
+        self.version = FileVersion(stamp, text_digest(parser.content))
+        self.children = []
+        self.maxdepths = {}
+        for child in children:
+            normalized = normalize(child)
+            if normalized not in self.maxdepths:
+                self.children.append(normalized)
+                self.maxdepths[normalized] = maxdepths.get(child)
+
+        if journal is not None:
+            journal.record_readme(path, self.version, self.children, self.maxdepths, self.collection)
+
+
+class TocTreeWalker(object):
+    """
+    Breadth-first traversal of the toctrees of a project, starting at its index.
+
+    Readmes are parsed at most once and yielded by `walk` as soon as they are parsed, so callers can process them while the traversal continues.
+
+    `root`: Path to the project index.
+
+    `use_maxdepth`: Whether the `:maxdepth:` options of toctrees limit the traversal.
+
+    `documents`: Map of paths to all readmes parsed so far.
+
+    `missing`: List of (readme, path) pairs of toctree entries that do not exist.
+
+    `truncated`: Paths listed in a toctree that were not followed because of a depth limit.
+
+    `include`: Predicate deciding whether a listed readme is parsed. None to parse all of them.
+
+    `skipped`: Paths listed in a toctree that were not parsed because `include` rejected them.
+
+    `cancel`: Event that stops the traversal when set. None if the traversal cannot be cancelled.
+
+    `cycles`: List of (readme, path) pairs of toctree entries that lead back to a readme that (indirectly) lists `readme`.
+
+    `journal`: Checkpoint journal readmes are looked up in and recorded to. None to always parse them.
+
+    `fs`: File system the readmes are read from.
+    """
+
+    root: Path
+
+    use_maxdepth: bool
+
+    documents: Dict[Path, ReadmeDocument]
+
+    missing: List[Tuple[Path, Path]]
+
+    truncated: Set[Path]
+
+    include: Optional[Callable[[Path], bool]]
+
+    skipped: Set[Path]
+
+    cancel: Optional[threading.Event]
+
+    cycles: List[Tuple[Path, Path]]
+
+    journal: Optional[Journal]
+
+    fs: FileSystem
+
+    def __init__(self, root: Path, use_maxdepth: bool = False, include: Optional[Callable[[Path], bool]] = None,
+                 cancel: Optional[threading.Event] = None, journal: Optional[Journal] = None, fs: Optional[FileSystem] = None):
+        """
+        Initialize with the project index.
+
+        :param root: Path to the project index.
+
+        :param use_maxdepth: Optional. Whether toctree `:maxdepth:` options limit the traversal. False by default (`:maxdepth:` only limits the depth of Sphinx's rendered table of contents).
+
+        :param include: Optional. Predicate deciding whether a listed readme is parsed (e.g. only readmes in changed directories). Rejected readmes are neither parsed nor followed.
+
+        :param cancel: Optional. Event that stops the traversal when set (checked before each readme is parsed).
+
+        :param journal: Optional. Checkpoint journal to record parse results in and, when resuming, take them from.
+
+        :param fs: Optional. File system to read the readmes from. The local disk by default.
+        """
+        self.root = normalize(root)
+        self.use_maxdepth = use_maxdepth
+        self.documents = {}
+        self.missing = []
+        self.truncated = set()
+        self.include = include
+        self.skipped = set()
+        self.cancel = cancel
+        self.cycles = []
+        self.journal = journal
+        self.fs = fs if fs is not None else LOCAL
+
+    def walk(self) -> Iterator[ReadmeDocument]:
+        """
+        Traverse the toctrees and yield each readme as soon as it is parsed.
+
+        A readme that is reached again along a route with a larger depth budget is not parsed again, but its children are followed further.
+
+        :raises FileNotFoundError: if the index does not exist.
+
+        :raises OperationCancelledError: if `cancel` is set during the traversal.
+
+        :returns: Iterator over the readmes in breadth-first order (the index first).
+        """
+        # the index must exist; missing readmes further down are collected in `missing`
+        document = ReadmeDocument(self.root, 0, None, None, self.journal, self.fs)
+        self.documents[self.root] = document
+        yield document
+
+        queue: Deque[ReadmeDocument] = deque([document])
+
+        while queue:
+            document = queue.popleft()
+            for child in document.children:
+                budget = self.child_budget(document, child)
+                if budget is not None and budget < 0:
+                    if child not in self.documents:
+                        self.truncated.add(child)
+                    continue
+
+                known = self.documents.get(child)
+                if known is None and self.include is not None and not self.include(child):
+                    self.skipped.add(child)
+                    continue
+                if known is None:
+                    if self.cancel is not None and self.cancel.is_set():
+                        raise OperationCancelledError()
+                    try:
+                        known = ReadmeDocument(child, document.depth + 1, document.path, budget, self.journal, self.fs)
+                    except FileNotFoundError:
+                        self.missing.append((document.path, child))
+                        continue
+                    self.documents[child] = known
+                    self.truncated.discard(child)
+                    queue.append(known)
+                    yield known
+                elif exceeds(budget, known.budget):
+                    # reached along a route that allows following more levels; expand it again without parsing
+                    known.budget = budget
+                    queue.append(known)
+
+        self.cycles = self.find_cycles()
+
+    def child_budget(self, document: ReadmeDocument, child: Path) -> Optional[int]:
+        """
+        Return the number of levels that may be followed below `child` when it is reached from `document`.
+
+        :param document: Readme listing `child`.
+
+        :param child: Path listed in the readme's toctree.
+
+        :returns: Budget of the child (negative if it must not be followed at all), or None if unlimited.
+        """
+        budget = document.budget - 1 if document.budget is not None else None
+        maxdepth = document.maxdepths.get(child)
+
+        # like Sphinx, a non-positive maxdepth means unlimited
+        if self.use_maxdepth and maxdepth is not None and maxdepth > 0:
+            budget = maxdepth - 1 if budget is None else min(budget, maxdepth - 1)
+
+        return budget
+
+    def find_cycles(self) -> List[Tuple[Path, Path]]:
+        """
+        Find toctree entries that lead back to a readme on the route to them (including readmes that list themselves).
+
+        Uses an iterative depth-first search over the parsed readmes, so deeply nested projects cannot exhaust the stack.
+
+        :returns: List of (readme, path) pairs of entries that close a cycle.
+        """
+        cycles: List[Tuple[Path, Path]] = []
+        # 1: on the current route, 2: finished
+        state: Dict[Path, int] = {}
+
+        for start in self.documents:
+            if start in state:
+                continue
+            state[start] = 1
+            stack: List[Tuple[Path, Iterator[Path]]] = [(start, iter(self.documents[start].children))]
+            while stack:
+                path, children = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    state[path] = 2
+                    stack.pop()
+                elif child not in self.documents:
+                    continue
+                elif state.get(child) == 1:
+                    cycles.append((path, child))
+                elif child not in state:
+                    state[child] = 1
+                    stack.append((child, iter(self.documents[child].children)))
+
+        return cycles
+
+
+def normalize(path: Path) -> Path:
+    """
+    Return the absolute path with '.' and '..' components removed, so the same file listed in different ways is parsed once.
+
+    Symbolic links are not resolved, so paths stay comparable to the paths found by `DirectoryWalker`.
+
+    :param path: Path to normalize.
+
+    :returns: Normalized absolute path.
+    """
+    return Path(os.path.normpath(path.absolute()))
+
+
+def exceeds(budget: Optional[int], other: Optional[int]) -> bool:
+    """
+    Return true if `budget` allows following more levels than `other` (None is unlimited).
+
+    :param budget: Depth budget.
+
+    :param other: Depth budget to compare to.
+
+    :returns: True if `budget` is larger.
+    """
+    if other is None:
+        return False
+    return budget is None or budget > other
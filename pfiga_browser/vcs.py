@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Helpers for scoping a run to the files that changed in a git repository.
+
+Only the local `git` executable is used (no git library is required). Paths are returned as absolute paths so they can be
+compared to the paths found by the parsers and the directory walker.
+
+`GitError`: Raised when `git` is not installed or a git command fails.
+
+`git_root`: Find the root of the git repository a path is in.
+
+`changed_paths`: List files that changed since a revision, including uncommitted and untracked files.
+"""
+# python level imports
+import subprocess
+from typing import List, Optional, Set
+from pathlib import Path
+
+
+class GitError(Exception):
+    """Exception object that is raised when `git` is not available or a git command fails."""
+
+    def __init__(self, *args: object):
+        """
+        Initialize with `args`. See `Exception` base class.
+
+        :param args: Arguments to pass to the super class
+        """
+        super(GitError, self).__init__(*args)
+
+
+def git(directory: Path, *args: str) -> str:
+    """
+    Run a git command in `directory` and return its output.
+
+    :param directory: Directory to run git in.
+
+    :param args: Arguments to pass to git.
+
+    :raises GitError: if git is not installed or exits with a non-zero status.
+
+    :returns: Standard output of the command.
+    """
+    try:
+        result = subprocess.run(["git", "-C", str(directory)] + list(args),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    except OSError as ex:
+        raise GitError("could not run git: %s" % ex)
+
+    if result.returncode != 0:
+        raise GitError("'git %s' failed: %s" % (" ".join(args), result.stderr.strip()))
+
+    return result.stdout
+
+
+def git_root(path: Path) -> Optional[Path]:
+    """
+    Find the root of the git repository `path` is in.
+
+    :param path: A file or directory.
+
+    :returns: Absolute path to the top level directory of the repository, or None if `path` is not inside one (or git is not installed).
+    """
+    directory = path if path.is_dir() else path.parent
+    try:
+        return Path(git(directory, "rev-parse", "--show-toplevel").strip())
+    except GitError:
+        return None
+
+
+def changed_paths(directory: Path, since: Optional[str] = None) -> Set[Path]:
+    """
+    List files below `directory` that changed since `since`, plus all uncommitted and untracked (not ignored) files.
+
+    Uses `git diff --name-only` for changes since the revision, `git status --porcelain` for staged, unstaged, and deleted
+    files (both names of renamed files are included), and `git ls-files --others` for untracked files.
+
+    :param directory: Directory inside a git repository. Only changes below it are listed.
+
+    :param since: Optional. Revision (commit, branch, tag, ...) to compare the working tree to. Only uncommitted changes are listed by default.
+
+    :raises GitError: if `directory` is not inside a git repository or a git command fails (e.g. `since` is not a valid revision).
+
+    :returns: Set of absolute paths to changed files. Deleted files are included.
+    """
+    root = git_root(directory)
+    if root is None:
+        raise GitError("'%s' is not inside a git repository" % directory)
+
+    pathspec = ["--", str(directory.absolute())]
+    names: List[str] = []
+
+    if since is not None:
+        names.extend(git(root, "diff", "--name-only", "-z", since, *pathspec).split("\0"))
+
+    # entries are 'XY path'; renames and copies are followed by an extra entry holding the old path
+    status = git(root, "status", "--porcelain", "-z", "--untracked-files=no", *pathspec).split("\0")
+    entries = iter(status)
+    for entry in entries:
+        if len(entry) < 4:
+            continue
+        names.append(entry[3:])
+        if entry[0] in "RC":
+            names.append(next(entries, ""))
+
+    names.extend(git(root, "ls-files", "--others", "--exclude-standard", "-z", *pathspec).split("\0"))
+
+    return {root.joinpath(name) for name in names if name}
+
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+"""
+Process pools for CPU-bound work (thumbnails, perceptual hashes).
+
+Pools are started with the "forkserver" start method (or "spawn" where it is not available) rather than "fork": the
+processes that create them run worker threads (projects are processed concurrently, `asyncscan` and the query server scan
+in threads), and forking a multithreaded process can leave locks held by other threads locked forever in the child.
+
+`process_pool`: Create a process pool.
+"""
+# python level imports
+import multiprocessing
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+
+
+def process_pool(workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """
+    Create a process pool that does not fork the calling process.
+
+    :param workers: Optional. Number of worker processes. None to use the executor's default.
+
+    :returns: Process pool; the caller shuts it down.
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
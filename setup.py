@@ -11,12 +11,20 @@ setup(
     package_data={
         "pfiga_browser.templates": [
             "index.rst",
-            "readme.rst"
+            "readme.rst",
+            "gallery_page.html",
+            "gallery_index.html",
+            "gallery.css"
         ]
     },
     install_requires=[
         "docutils",
         "jinja2",
         "setuptools"
-    ]
+    ],
+    extras_require={
+        "thumbnails": [
+            "numpy"
+        ]
+    }
 )
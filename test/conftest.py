@@ -0,0 +1,55 @@
+"""Fixtures shared by the tests: small pfiga projects written to a temporary directory."""
+# python level imports
+from typing import Callable, Dict, Optional
+from pathlib import Path
+# pytest level imports
+import pytest
+# pfiga-browser level imports
+from pfiga_browser.arguments import default_options
+from pfiga_browser.pfiga_browser import ProjectReport, RunContext, process_index
+
+# a project with first level readme 4gr listing two image directories at different depths
+PROJECT: Dict[str, str] = {
+    "index.rst": ".. toctree::\n   :maxdepth: 2\n\n   4gr/01readme.rst\n",
+    "4gr/01readme.rst": "4gr\n###\n\n.. toctree::\n\n   folder_figs/02readme.rst\n   more_figs/deeper/02readme.rst\n",
+    "4gr/folder_figs/02readme.rst": "folder_figs\n###########\n\n",
+    "4gr/more_figs/deeper/02readme.rst": "deeper\n######\n\n",
+}
+
+
+@pytest.fixture
+def make_project() -> Callable[[Path], Path]:
+    """Return a function that writes `PROJECT` below a directory and returns the path of its index."""
+    def make(root: Path) -> Path:
+        for name, text in PROJECT.items():
+            root.joinpath(name).parent.mkdir(parents=True, exist_ok=True)
+            root.joinpath(name).write_text(text)
+        return root.joinpath("index.rst")
+
+    return make
+
+
+@pytest.fixture
+def png() -> Callable[[int, int, int], bytes]:
+    """Return a function that encodes a PNG of the given size filled with one gray level (requires numpy)."""
+    np = pytest.importorskip("numpy")
+    from pfiga_browser.thumbnail import encode_png
+
+    def encode(width: int, height: int, level: int = 128) -> bytes:
+        return encode_png(np.full((height, width, 3), level, dtype=np.uint8))
+
+    return encode
+
+
+@pytest.fixture
+def context(tmp_path: Path):
+    """Yield a `RunContext` with its caches in the temporary directory; closed after the test."""
+    run_context = RunContext(tmp_path.joinpath("cache"))
+    yield run_context
+    run_context.close()
+
+
+def run(index: Path, context: RunContext, **options) -> ProjectReport:
+    """Process a project with the command line defaults and `options`, as a new batch of `context`."""
+    context.start_batch()
+    return process_index(index, default_options(**options), context)
@@ -0,0 +1,69 @@
+"""Tests for the asyncio scanning API (`pfiga_browser.asyncscan.scan_async`)."""
+# python level imports
+import asyncio
+from typing import List
+# pytest level imports
+import pytest
+# pfiga-browser level imports
+from pfiga_browser import asyncscan
+from pfiga_browser.asyncscan import ScanEvent, scan_async
+from pfiga_browser.error import ExitCode
+
+
+async def collect(*args, **options) -> List[ScanEvent]:
+    """Return all events of a scan."""
+    return [event async for event in scan_async(*args, **options)]
+
+
+def test_projects_one_at_a_time(tmp_path, make_project):
+    indexes = [make_project(tmp_path.joinpath(name)) for name in ("a", "b")]
+    indexes[1].parent.joinpath("4gr", "folder_figs", "new.svg").write_text("<svg/>")
+
+    events = asyncio.run(collect(indexes, concurrency=1, check=True, all=True, cache_dir=str(tmp_path.joinpath("cache"))))
+
+    done = [event for event in events if event.kind == "done"]
+    assert {event.index: event.report.exit_code for event in done} == {indexes[0]: ExitCode.NORMAL,
+                                                                       indexes[1]: ExitCode.UNTRACKED}
+    # with one project at a time, the events of a project do not interleave with the other project's
+    owners = [event.index for event in events]
+    assert owners == sorted(owners, key=lambda index: owners.index(index))
+    assert sum(event.kind == "readme" for event in events) == 8
+
+
+def test_missing_index(tmp_path):
+    missing = tmp_path.joinpath("index.rst")
+
+    events = asyncio.run(collect(missing, cache_dir=str(tmp_path.joinpath("cache"))))
+
+    assert [(event.kind, event.index, event.report.exit_code) for event in events] == [
+        ("done", missing, ExitCode.FILENOTFOUND)]
+
+
+def test_failed_project_is_done_and_raised(tmp_path, make_project, monkeypatch):
+    indexes = [make_project(tmp_path.joinpath(name)) for name in ("a", "b")]
+
+    def process_index(index, *args, **kwargs):
+        if index == indexes[1]:
+            raise RuntimeError("broken project")
+        return original(index, *args, **kwargs)
+
+    original = asyncscan.process_index
+    monkeypatch.setattr(asyncscan, "process_index", process_index)
+    events: List[ScanEvent] = []
+
+    async def scan() -> None:
+        async for event in scan_async(indexes, check=True, cache_dir=str(tmp_path.joinpath("cache"))):
+            events.append(event)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(scan())
+
+    # the project that failed still has its 'done' event, and the other project is processed completely
+    done = {event.index: event for event in events if event.kind == "done"}
+    assert done[indexes[0]].report.exit_code == ExitCode.NORMAL
+    assert isinstance(done[indexes[1]].error, RuntimeError) and done[indexes[1]].report is None
+
+
+def test_unknown_option(tmp_path):
+    with pytest.raises(TypeError):
+        asyncio.run(collect(tmp_path.joinpath("index.rst"), no_such_option=True))
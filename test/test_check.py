@@ -0,0 +1,78 @@
+"""Tests for `--check` runs of one and several projects (`pfiga_browser.main`)."""
+# python level imports
+from pathlib import Path
+# pfiga-browser level imports
+from pfiga_browser.arguments import build_parser
+from pfiga_browser.error import ExitCode
+from pfiga_browser.pfiga_browser import main
+# test level imports
+from conftest import run
+
+
+def summary(output: str) -> dict:
+    """Return the per-project exit codes printed at the end of a run of several projects."""
+    lines = output.split("projects:\n", 1)[1].strip().split("\n")
+    return {Path(line.rsplit(": ", 1)[0]).parent.name: line.rsplit(": ", 1)[1] for line in lines}
+
+
+def test_check_does_not_modify(tmp_path, make_project, context):
+    index = make_project(tmp_path.joinpath("a"))
+    readme = index.parent.joinpath("4gr", "folder_figs", "02readme.rst")
+    readme.parent.joinpath("new.svg").write_text("<svg/>")
+    text = readme.read_text()
+
+    report = run(index, context, check=True)
+
+    assert report.exit_code == ExitCode.UNTRACKED
+    assert readme.read_text() == text
+
+
+def test_cancelled_project_is_not_reported_as_passing(tmp_path, make_project, capsys):
+    failing = make_project(tmp_path.joinpath("a"))
+    failing.parent.joinpath("4gr", "folder_figs", "new.svg").write_text("<svg/>")
+    unchecked = make_project(tmp_path.joinpath("b"))
+
+    exit_code = main(build_parser().parse_args(
+        ["--check", "--jobs", "1", "--cache-dir", str(tmp_path.joinpath("cache")), str(failing), str(unchecked)]))
+
+    assert exit_code == ExitCode.UNTRACKED
+    assert summary(capsys.readouterr().out) == {"a": "UNTRACKED", "b": "CANCELLED"}
+
+
+def test_first_failure_wins_over_cancelled_projects(tmp_path, make_project, capsys):
+    # the cancelled project is listed first; the exit code is still the one of the project that failed
+    unchecked = make_project(tmp_path.joinpath("a"))
+    failing = make_project(tmp_path.joinpath("b"))
+    failing.parent.joinpath("4gr", "folder_figs", "02readme.rst").write_text(
+        "folder_figs\n###########\n\n**gone.png**. Missing.\n\n.. image:: gone.png\n   :width: 300\n")
+
+    exit_code = main(build_parser().parse_args(
+        ["--check", "--jobs", "1", "--cache-dir", str(tmp_path.joinpath("cache")), str(failing), str(unchecked)]))
+
+    assert exit_code == ExitCode.MISSING
+    assert summary(capsys.readouterr().out) == {"a": "CANCELLED", "b": "MISSING"}
+
+
+def test_check_all_checks_every_project(tmp_path, make_project, capsys):
+    first = make_project(tmp_path.joinpath("a"))
+    second = make_project(tmp_path.joinpath("b"))
+    for index in (first, second):
+        index.parent.joinpath("4gr", "folder_figs", "new.svg").write_text("<svg/>")
+    clean = make_project(tmp_path.joinpath("c"))
+
+    exit_code = main(build_parser().parse_args(
+        ["--check", "--all", "--jobs", "1", "--cache-dir", str(tmp_path.joinpath("cache")),
+         str(first), str(second), str(clean)]))
+
+    assert exit_code == ExitCode.UNTRACKED
+    assert summary(capsys.readouterr().out) == {"a": "UNTRACKED", "b": "UNTRACKED", "c": "NORMAL"}
+
+
+def test_context_is_reusable_after_a_cancelled_batch(tmp_path, make_project, context):
+    failing = make_project(tmp_path.joinpath("a"))
+    failing.parent.joinpath("4gr", "folder_figs", "new.svg").write_text("<svg/>")
+    clean = make_project(tmp_path.joinpath("b"))
+
+    assert run(failing, context, check=True).exit_code == ExitCode.UNTRACKED
+    assert context.cancel.is_set()
+    assert run(clean, context, check=True).exit_code == ExitCode.NORMAL
@@ -0,0 +1,63 @@
+"""Tests for the checkpoint journal of resumable runs (`pfiga_browser.checkpoint.Journal`)."""
+# pfiga-browser level imports
+from pfiga_browser.checkpoint import Journal, journal_path
+from pfiga_browser.error import ExitCode
+from pfiga_browser.imageinfo import Image, ImageCollection
+from pfiga_browser.locking import file_version
+# test level imports
+from conftest import run
+
+
+def record(tmp_path, index):
+    """Write a journal with one readme and one directory record, as an interrupted run would leave it."""
+    readme = tmp_path.joinpath("02readme.rst")
+    readme.write_text("figs\n####\n")
+    collection = ImageCollection()
+    collection.add(Image("img.png", description="A figure.", width=300))
+    journal = Journal(tmp_path.joinpath("journal"), index)
+    journal.record_readme(readme, file_version(readme), [tmp_path.joinpath("child.rst")], {}, collection)
+    journal.record_directory(tmp_path, ["sub"], ["02readme.rst", "img.png"])
+    journal.close()
+    return readme
+
+
+def test_resume(tmp_path):
+    index = tmp_path.joinpath("index.rst")
+    readme = record(tmp_path, index)
+
+    journal = Journal(tmp_path.joinpath("journal"), index, resume=True)
+    children, maxdepths, collection, _ = journal.readme(readme)
+    assert children == [tmp_path.joinpath("child.rst")]
+    assert [(image.uri, image.description, image.width) for image in collection.collection] == [("img.png", "A figure.", 300)]
+    assert journal.directory(tmp_path) == (["sub"], ["02readme.rst", "img.png"])
+    # each directory is only taken from the journal once
+    assert journal.directory(tmp_path) is None
+    assert journal.reused == 2
+    journal.close(complete=True)
+    assert not tmp_path.joinpath("journal").exists()
+
+
+def test_changed_and_foreign_records_are_ignored(tmp_path):
+    index = tmp_path.joinpath("index.rst")
+    readme = record(tmp_path, index)
+    readme.write_text("figs\n####\n\nchanged\n")
+    # a record cut short by a crash
+    with tmp_path.joinpath("journal").open("a") as f_journal:
+        f_journal.write('["d","%s' % tmp_path)
+
+    journal = Journal(tmp_path.joinpath("journal"), index, resume=True)
+    assert journal.readme(readme) is None
+    assert journal.directory(tmp_path) == (["sub"], ["02readme.rst", "img.png"])
+    journal.close()
+
+    other = Journal(tmp_path.joinpath("journal"), tmp_path.joinpath("other.rst"), resume=True)
+    assert other.directory(tmp_path) is None
+    other.close()
+
+
+def test_complete_run_removes_journal(tmp_path, make_project, context):
+    index = make_project(tmp_path.joinpath("docs"))
+
+    assert run(index, context).exit_code == ExitCode.NORMAL
+
+    assert not journal_path(context.cache_dir, index).exists()
@@ -0,0 +1,26 @@
+"""Tests for the report of byte-identical images (`pfiga_browser.duplicates`)."""
+# pfiga-browser level imports
+from pfiga_browser.cache import StatCache
+from pfiga_browser.duplicates import find_duplicates
+
+
+def test_find_duplicates(tmp_path):
+    files = {"a.png": b"x" * 100, "b.png": b"x" * 100, "c.png": b"y" * 100, "d.png": b"z" * 10, "e.png": b"z" * 10,
+             "f.png": b"z" * 10, "g.png": b"unique"}
+    for name, data in files.items():
+        tmp_path.joinpath(name).write_bytes(data)
+    cache = StatCache()
+
+    report = find_duplicates(sorted(tmp_path.iterdir()), cache=cache, workers=2)
+
+    # same size but different content (c.png) is not a duplicate; the set wasting most bytes comes first
+    assert [[path.name for path in dup.paths] for dup in report.sets] == [["a.png", "b.png"], ["d.png", "e.png", "f.png"]]
+    assert report.wasted_bytes == 100 + 2 * 10
+    # files of a unique size are never hashed
+    assert str(tmp_path.joinpath("g.png")) not in cache.entries
+    assert "sha256" in cache.entries[str(tmp_path.joinpath("c.png"))]
+
+
+def test_no_duplicates(tmp_path):
+    tmp_path.joinpath("a.png").write_bytes(b"a")
+    assert find_duplicates([tmp_path.joinpath("a.png")]).sets == []
@@ -0,0 +1,29 @@
+"""Tests for the external sort and merge join of `--low-memory` runs (`pfiga_browser.extsort`)."""
+# python level imports
+import os
+import random
+# pfiga-browser level imports
+from pfiga_browser.extsort import ExternalSorter, anti_join
+
+
+def test_sort_spills_runs(tmp_path):
+    generator = random.Random(1)
+    records = [("/p/%04d" % generator.randrange(500), generator.randrange(10)) for _ in range(100)]
+
+    with ExternalSorter(run_size=7, directory=str(tmp_path)) as sorter:
+        for record in records:
+            sorter.add(record)
+        assert len(sorter.runs) == 14
+        assert list(sorter.sorted()) == sorted(records)
+        runs = sorter.runs
+    # the runs are deleted
+    assert not any(os.path.exists(run) for run in runs)
+
+
+def test_anti_join():
+    left = [("a", 1), ("b", 2), ("b", 3), ("d", 4), ("f", 5)]
+    right = [("b",), ("c",), ("c",), ("f",), ("g",)]
+
+    assert list(anti_join(iter(left), iter(right), key=lambda record: record[0])) == [("a", 1), ("d", 4)]
+    assert list(anti_join(iter(left), iter([]), key=lambda record: record[0])) == left
+    assert list(anti_join(iter([]), iter(right), key=lambda record: record[0])) == []
@@ -0,0 +1,103 @@
+"""Tests for reading projects from zip and tar archives (`pfiga_browser.filesystem.ArchiveFileSystem`)."""
+# python level imports
+import io
+import tarfile
+import zipfile
+from typing import Dict
+from pathlib import Path
+# pytest level imports
+import pytest
+# pfiga-browser level imports
+from pfiga_browser.arguments import default_options
+from pfiga_browser.error import ExitCode
+from pfiga_browser.filesystem import ArchiveFileSystem, member_key
+from pfiga_browser.pfiga_browser import RunContext, process_index
+
+
+def drawing() -> bytes:
+    """Return the bytes of a minimal .odg drawing (a zip archive)."""
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as f_drawing:
+        f_drawing.writestr("mimetype", "application/vnd.oasis.opendocument.graphics")
+    return data.getvalue()
+
+
+# a small project; the drawing is the last member, so an uncompressed tar ends with a zip central directory
+PROJECT: Dict[str, bytes] = {
+    "docs/index.rst": b".. toctree::\n\n   1pj/01readme.rst\n",
+    "docs/1pj/01readme.rst": b"1pj\n###\n\n.. toctree::\n\n   proj1/02readme.rst\n",
+    "docs/1pj/proj1/02readme.rst": b"proj1\n#####\n\n**img.png**. A figure.\n\n.. image:: img.png\n   :width: 300\n\n"
+                                   b"**figure.odg**. A drawing.\n\n.. image:: figure.odg\n   :width: 300\n",
+    "docs/1pj/proj1/img.png": b"",
+    "docs/1pj/proj1/figure.odg": drawing(),
+}
+
+
+def write_zip(path: Path, prefix: str, files: Dict[str, bytes]) -> None:
+    """Write `files` to a zip archive, prefixing each member name with `prefix`."""
+    with zipfile.ZipFile(path, "w") as f_archive:
+        for name, data in files.items():
+            f_archive.writestr(prefix + name, data)
+
+
+def write_tar(path: Path, prefix: str, files: Dict[str, bytes]) -> None:
+    """Write `files` to an (uncompressed, or by suffix compressed) tar archive, prefixing each member name with `prefix`."""
+    with tarfile.open(path, "w:gz" if path.name.endswith(".tar.gz") else "w") as f_archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(prefix + name)
+            info.size = len(data)
+            f_archive.addfile(info, io.BytesIO(data))
+
+
+ARCHIVES = [("project.zip", write_zip), ("project.tar", write_tar), ("project.tar.gz", write_tar)]
+
+
+@pytest.mark.parametrize("prefix", ["", "./"])
+@pytest.mark.parametrize("name, write", ARCHIVES)
+def test_archive_tree(tmp_path, name, write, prefix):
+    archive = tmp_path.joinpath(name)
+    write(archive, prefix, PROJECT)
+
+    fs = ArchiveFileSystem(archive)
+    try:
+        assert sorted(entry.name for entry in fs.scandir(archive.joinpath("docs", "1pj", "proj1"))) == [
+            "02readme.rst", "figure.odg", "img.png"]
+        assert fs.is_dir(archive.joinpath("docs", "1pj"))
+        with fs.open(archive.joinpath("docs", "index.rst")) as f_index:
+            assert f_index.read() == PROJECT["docs/index.rst"]
+    finally:
+        fs.close()
+
+
+@pytest.mark.parametrize("prefix", ["", "./"])
+@pytest.mark.parametrize("name, write", ARCHIVES)
+def test_check_archive(tmp_path, name, write, prefix):
+    tracked = tmp_path.joinpath("tracked", name)
+    tracked.parent.mkdir()
+    write(tracked, prefix, PROJECT)
+    untracked = tmp_path.joinpath("untracked", name)
+    untracked.parent.mkdir()
+    write(untracked, prefix, dict(PROJECT, **{"docs/1pj/proj1/new.png": b""}))
+
+    context = RunContext(tmp_path.joinpath("cache"))
+    try:
+        for archive, exit_code in ((tracked, ExitCode.NORMAL), (untracked, ExitCode.UNTRACKED)):
+            fs = ArchiveFileSystem(archive)
+            try:
+                context.start_batch()
+                report = process_index(archive.joinpath("docs", "index.rst"), default_options(), context, fs=fs)
+            finally:
+                fs.close()
+            assert report.exit_code == exit_code, str(report)
+    finally:
+        context.close()
+
+
+def test_member_key():
+    assert member_key("docs/index.rst") == "docs/index.rst"
+    assert member_key("./docs/index.rst") == "docs/index.rst"
+    assert member_key("/docs//1pj/./01readme.rst") == "docs/1pj/01readme.rst"
+    assert member_key("docs/") == "docs"
+    assert member_key("./") == ""
+    assert member_key("../index.rst") is None
+    assert member_key("docs/../../index.rst") is None
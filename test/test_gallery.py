@@ -0,0 +1,95 @@
+"""Tests for the static HTML gallery (`pfiga_browser.gallery.GalleryBuilder`), alone and shared by several projects."""
+# python level imports
+import json
+from pathlib import Path
+# pfiga-browser level imports
+from pfiga_browser.arguments import build_parser
+from pfiga_browser.cache import index_digest
+from pfiga_browser.error import ExitCode
+from pfiga_browser.gallery import MANIFEST_NAME, GalleryBuilder
+from pfiga_browser.pfiga_browser import main
+# test level imports
+from conftest import run
+
+
+def manifest(gallery: Path) -> dict:
+    """Return the manifest of a gallery."""
+    return json.loads(gallery.joinpath(MANIFEST_NAME).read_text())
+
+
+def test_page_paths(tmp_path, make_project, context):
+    index = make_project(tmp_path.joinpath("docs"))
+    figs = index.parent.joinpath("4gr", "folder_figs")
+    figs.joinpath("img.svg").write_text("<svg/>")
+    gallery = tmp_path.joinpath("gallery")
+
+    assert run(index, context, gallery=str(gallery)).exit_code == ExitCode.NORMAL
+
+    project = index_digest(index)
+    assert sorted(manifest(gallery)) == ["%s/4gr/folder_figs/index.html" % project,
+                                         "%s/4gr/more_figs/deeper/index.html" % project]
+    page = gallery.joinpath(project, "4gr", "folder_figs", "index.html").read_text()
+    # links are relative to the page: up to the gallery for the style sheet, and to the image in the project
+    assert 'href="../../../gallery.css"' in page
+    assert 'src="%s"' % Path("..", "..", "..", "..", "docs", "4gr", "folder_figs", "img.svg").as_posix() in page
+    assert json.loads(gallery.joinpath("search.json").read_text())[0]["href"] == (
+        "%s/4gr/folder_figs/index.html#img.svg" % project)
+
+
+def test_projects_share_a_gallery(tmp_path, make_project, capsys):
+    indexes = [make_project(tmp_path.joinpath(name)) for name in ("a", "b")]
+    for index in indexes:
+        index.parent.joinpath("4gr", "folder_figs", "img.svg").write_text("<svg/>")
+    gallery = tmp_path.joinpath("gallery")
+    args = ["--gallery", str(gallery), "--cache-dir", str(tmp_path.joinpath("cache"))] + [str(index) for index in indexes]
+
+    assert main(build_parser().parse_args(args)) == ExitCode.NORMAL
+
+    # the projects have the same layout; each has its own two pages
+    pages = manifest(gallery)
+    assert len(pages) == 4
+    assert {entry["root"] for entry in pages.values()} == {str(index.parent) for index in indexes}
+    for page in pages:
+        assert gallery.joinpath(page).is_file()
+    text = gallery.joinpath("index.html").read_text()
+    assert all(page in text for page in pages)
+
+    # nothing changed: nothing is written
+    capsys.readouterr()
+    stamps = {path: path.stat().st_mtime_ns for path in gallery.rglob("*") if path.is_file()}
+    assert main(build_parser().parse_args(args)) == ExitCode.NORMAL
+    assert "gallery: 0 files written" in capsys.readouterr().out
+    assert {path: path.stat().st_mtime_ns for path in gallery.rglob("*") if path.is_file()} == stamps
+
+
+def test_build_only_prunes_own_pages(tmp_path, make_project, context):
+    first = make_project(tmp_path.joinpath("a"))
+    second = make_project(tmp_path.joinpath("b"))
+    gallery = tmp_path.joinpath("gallery")
+    for index in (first, second):
+        assert run(index, context, gallery=str(gallery)).exit_code == ExitCode.NORMAL
+
+    # the deeper readme is no longer part of the second project
+    builder = GalleryBuilder(gallery, second.parent, project=index_digest(second))
+    builder.build([second.parent.joinpath("4gr", "folder_figs", "02readme.rst")])
+
+    pages = manifest(gallery)
+    assert sorted(pages) == sorted(["%s/4gr/folder_figs/index.html" % index_digest(first),
+                                    "%s/4gr/more_figs/deeper/index.html" % index_digest(first),
+                                    "%s/4gr/folder_figs/index.html" % index_digest(second)])
+    assert not gallery.joinpath(index_digest(second), "4gr", "more_figs", "deeper", "index.html").exists()
+    assert gallery.joinpath(index_digest(first), "4gr", "more_figs", "deeper", "index.html").is_file()
+
+
+def test_stale_builder_keeps_pages_of_other_projects(tmp_path, make_project):
+    # two builders load the manifest before either writes it (e.g. projects processed concurrently)
+    first = make_project(tmp_path.joinpath("a"))
+    second = make_project(tmp_path.joinpath("b"))
+    gallery = tmp_path.joinpath("gallery")
+    builders = [GalleryBuilder(gallery, index.parent, project=index_digest(index)) for index in (first, second)]
+
+    for builder, index in zip(builders, (first, second)):
+        builder.build([index.parent.joinpath("4gr", "folder_figs", "02readme.rst")])
+
+    assert sorted(manifest(gallery)) == sorted("%s/4gr/folder_figs/index.html" % index_digest(index)
+                                               for index in (first, second))
@@ -0,0 +1,77 @@
+"""Tests for cache merges, readme locks, and optimistic write checks of concurrent runs (`pfiga_browser.locking`)."""
+# python level imports
+import os
+import threading
+# pfiga-browser level imports
+from pfiga_browser.cache import StatCache
+from pfiga_browser.locking import file_version, locked
+from pfiga_browser.renames import ContentIndex
+
+
+def test_stat_caches_merge(tmp_path):
+    path = tmp_path.joinpath("cache.json")
+    images = [tmp_path.joinpath(name) for name in ("a.png", "b.png")]
+    for image in images:
+        image.write_bytes(b"png")
+    # both caches are loaded before either is saved (two runs at the same time)
+    caches = [StatCache(path), StatCache(path)]
+
+    for cache, image in zip(caches, images):
+        cache.update(image, {"sha256": image.name})
+        cache.save()
+
+    assert sorted(StatCache(path).entries) == sorted(str(image) for image in images)
+
+
+def test_content_indexes_merge(tmp_path):
+    path = tmp_path.joinpath("tracked.json")
+    first = ContentIndex(path)
+    first.record(tmp_path.joinpath("old.png"), "0" * 64)
+    first.save()
+    indexes = [ContentIndex(path), ContentIndex(path)]
+
+    indexes[0].record(tmp_path.joinpath("new.png"), "1" * 64)
+    indexes[1].forget(tmp_path.joinpath("old.png"))
+    for index in indexes:
+        index.save()
+
+    assert ContentIndex(path).hashes == {str(tmp_path.joinpath("new.png")): "1" * 64}
+
+
+def test_locked_serializes_updates(tmp_path):
+    counter = tmp_path.joinpath("counter")
+    counter.write_text("0")
+
+    def increment() -> None:
+        for _ in range(50):
+            with locked(counter) as f_counter:
+                value = int(f_counter.read())
+                f_counter.seek(0)
+                f_counter.truncate()
+                f_counter.write(str(value + 1))
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.read_text() == "200"
+
+
+def test_file_version(tmp_path):
+    readme = tmp_path.joinpath("02readme.rst")
+    readme.write_text("figs\n####\n")
+    version = file_version(readme, readme.read_text())
+
+    stamp_only = file_version(readme)
+
+    # only touched: the contents are unchanged, which only the digest can tell
+    os.utime(readme, ns=(1, 1))
+    with locked(readme) as f_readme:
+        assert version.matches(f_readme)
+        assert not stamp_only.matches(f_readme)
+
+    readme.write_text("figs\n####\n\nchanged\n")
+    with locked(readme) as f_readme:
+        assert not version.matches(f_readme)
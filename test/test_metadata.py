@@ -0,0 +1,69 @@
+"""Tests for reading image dimensions from file headers (`pfiga_browser.metadata`)."""
+# python level imports
+import io
+import struct
+import zipfile
+# pytest level imports
+import pytest
+# pfiga-browser level imports
+from pfiga_browser.metadata import (PNG_SIGNATURE, parse_svg_length, read_image_size, read_jpeg_size, read_odg_size,
+                                    read_png_size, read_svg_size, thumbnail_width)
+
+
+def test_png():
+    header = PNG_SIGNATURE + struct.pack(">I", 13) + b"IHDR" + struct.pack(">II", 640, 480) + b"\x08\x02\0\0\0"
+    assert read_png_size(io.BytesIO(header)) == (640, 480)
+    assert read_png_size(io.BytesIO(b"GIF89a" + header)) is None
+
+
+def test_jpeg():
+    # SOI, an APP0 segment to skip, then a baseline start of frame (height before width)
+    data = b"\xff\xd8" + b"\xff\xe0" + struct.pack(">H", 6) + b"JFIF" + \
+        b"\xff\xc0" + struct.pack(">HBHHB", 11, 8, 200, 320, 3) + b"\0" * 3
+    assert read_jpeg_size(io.BytesIO(data)) == (320, 200)
+    assert read_jpeg_size(io.BytesIO(b"\xff\xd8\xff\xd9")) is None
+
+
+@pytest.mark.parametrize("attributes, size", [
+    ('width="300" height="150"', (300, 150)),
+    ('width="1in" height="72pt"', (96, 96)),
+    ('viewBox="0 0 400 200"', (400, 200)),
+    ('width="100" viewBox="0,0,400,200"', (100, 50)),
+    ('width="50%" height="50%"', None),
+])
+def test_svg(attributes, size):
+    svg = '<?xml version="1.0"?><svg xmlns="http://www.w3.org/2000/svg" %s><rect/></svg>' % attributes
+    assert read_svg_size(io.BytesIO(svg.encode())) == size
+
+
+def test_parse_svg_length():
+    assert parse_svg_length("25.4mm") == pytest.approx(96)
+    assert parse_svg_length("1e2") == 100
+    assert parse_svg_length("3em") is None
+    assert parse_svg_length(None) is None
+
+
+def test_odg():
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as f_drawing:
+        f_drawing.writestr("styles.xml", '<office:document-styles '
+                           'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+                           'xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0" '
+                           'xmlns:fo="urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0">'
+                           '<style:page-layout-properties fo:page-width="2.54cm" fo:page-height="1in"/>'
+                           '</office:document-styles>')
+    assert read_odg_size(io.BytesIO(data.getvalue())) == (96, 96)
+    assert read_odg_size(io.BytesIO(b"not a zip")) is None
+
+
+def test_read_image_size(tmp_path):
+    tmp_path.joinpath("img.SVG").write_text('<svg width="640" height="10"/>')
+    tmp_path.joinpath("img.gif").write_bytes(b"GIF89a")
+    assert read_image_size(tmp_path.joinpath("img.SVG")) == (640, 10)
+    assert read_image_size(tmp_path.joinpath("img.gif")) is None
+
+
+def test_thumbnail_width():
+    assert thumbnail_width((640, 480)) == 300
+    assert thumbnail_width((120, 80)) == 120
+    assert thumbnail_width(None) == 300
@@ -0,0 +1,35 @@
+"""Tests for the progress totals stored for the estimate of the next run (`pfiga_browser.progress.ProgressReporter`)."""
+# python level imports
+import json
+# pytest level imports
+import pytest
+# pfiga-browser level imports
+from pfiga_browser.arguments import build_parser
+from pfiga_browser.error import ExitCode
+from pfiga_browser.pfiga_browser import main
+
+
+def test_whole_run_records_totals(tmp_path, make_project):
+    index = make_project(tmp_path.joinpath("docs"))
+    cache = tmp_path.joinpath("cache")
+
+    assert main(build_parser().parse_args(["--progress", "--cache-dir", str(cache), str(index)])) == ExitCode.NORMAL
+
+    totals = json.loads(cache.joinpath("progress.json").read_text())
+    assert list(totals) == [str(index)]
+    assert totals[str(index)]["readme"] == 4
+
+
+@pytest.mark.parametrize("options", [["--changed-only"], ["--time-budget", "60"]])
+def test_partial_run_keeps_totals(tmp_path, make_project, options):
+    index = make_project(tmp_path.joinpath("docs"))
+    cache = tmp_path.joinpath("cache")
+    # totals of an earlier whole run (larger than what a partial run counts)
+    totals = json.dumps({str(index): {"readme": 40, "directory": 50, "image": 0, "write": 0}})
+    cache.mkdir()
+    cache.joinpath("progress.json").write_text(totals)
+
+    assert main(build_parser().parse_args(["--progress", "--cache-dir", str(cache)] + options + [str(index)])) == (
+        ExitCode.NORMAL)
+
+    assert json.loads(cache.joinpath("progress.json").read_text()) == json.loads(totals)
@@ -0,0 +1,72 @@
+"""Tests for recency-ordered, time-budgeted runs (`pfiga_browser.recency`)."""
+# python level imports
+import os
+import json
+# pytest level imports
+import pytest
+# pfiga-browser level imports
+from pfiga_browser.filesystem import LOCAL
+from pfiga_browser.recency import FIRST_BATCH, TimeBudget, load_snapshot, order_by_recency, save_snapshot
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = tmp_path.joinpath("snapshot.json")
+    index = tmp_path.joinpath("index.rst")
+    save_snapshot(path, index, 20, [tmp_path.joinpath("a")])
+
+    assert load_snapshot(path, index) == (20, [tmp_path.joinpath("a")])
+    assert load_snapshot(path, tmp_path.joinpath("other.rst")) is None
+
+    # the snapshot of the run that started last is kept
+    save_snapshot(path, index, 10, [tmp_path.joinpath("b")])
+    assert load_snapshot(path, index) == (20, [tmp_path.joinpath("a")])
+
+
+@pytest.mark.parametrize("snapshot", [
+    [], "text", {}, {"index": "INDEX"}, {"index": "INDEX", "started": 1}, {"index": "INDEX", "directories": []},
+    {"index": "INDEX", "started": "1", "directories": []}, {"index": "INDEX", "started": 1, "directories": 1},
+    {"index": "INDEX", "started": 1, "directories": [1]}])
+def test_unusable_snapshot(tmp_path, snapshot):
+    path = tmp_path.joinpath("snapshot.json")
+    index = tmp_path.joinpath("index.rst")
+    path.write_text(json.dumps(snapshot).replace("INDEX", str(index)))
+
+    assert load_snapshot(path, index) is None
+    # a new snapshot replaces it
+    save_snapshot(path, index, 1, [])
+    assert load_snapshot(path, index) == (1, [])
+
+
+def test_time_budget():
+    now = [0.0]
+    budget = TimeBudget(10, clock=lambda: now[0])
+
+    assert budget.next_batch(100) == FIRST_BATCH
+    now[0] = 2.0
+    budget.record(FIRST_BATCH, 2.0)
+    # at most twice the previous batch
+    assert budget.next_batch(100) == 2 * FIRST_BATCH
+    now[0] = 9.0
+    budget.record(2 * FIRST_BATCH, 7.0)
+    # about 0.22 seconds per directory: 4 fit in the second left, none in the last 0.1 seconds
+    assert budget.next_batch(100) == 4
+    now[0] = 9.9
+    assert budget.next_batch(100) == 0
+    assert budget.remaining() == pytest.approx(0.1)
+
+
+def test_order_by_recency(tmp_path):
+    old, new, excluded = (tmp_path.joinpath(name) for name in ("old", "new", "excluded"))
+    for directory in (old, new, excluded):
+        directory.mkdir()
+    os.utime(old, ns=(10, 10))
+    os.utime(excluded, ns=(30, 30))
+    added = new.joinpath("added")
+    added.mkdir()
+    os.utime(added, ns=(40, 40))
+    os.utime(new, ns=(20, 20))
+
+    ordered = order_by_recency([old, new, excluded, tmp_path.joinpath("gone")], 15, LOCAL, excluded=[excluded])
+
+    # the directory created below a changed directory is added; removed and excluded directories are left out
+    assert ordered == [added, new, old]
@@ -0,0 +1,76 @@
+"""Tests for carrying readme entries over when images are renamed or moved (`renames.py`, `TemplateEngine.move_image`)."""
+# python level imports
+import re
+from pathlib import Path
+# pfiga-browser level imports
+from pfiga_browser.error import ExitCode
+from pfiga_browser.template import TemplateEngine, rebase_in_text
+# test level imports
+from conftest import run
+
+IMAGE_DIRECTIVE = re.compile(r"^\.\. image:: (\S+)$", re.MULTILINE)
+
+
+def describe(readme: Path, old: str, new: str) -> None:
+    """Replace the placeholder description of an image entry, so tests can tell the entry was carried over."""
+    readme.write_text(readme.read_text().replace("**%s**. Add description here." % old, "**%s**. %s" % (old, new)))
+
+
+def test_rename_in_place(tmp_path, make_project, png, context):
+    index = make_project(tmp_path.joinpath("docs"))
+    figs = index.parent.joinpath("4gr", "folder_figs")
+    figs.joinpath("plot.png").write_bytes(png(40, 20))
+    assert run(index, context).exit_code == ExitCode.NORMAL
+    describe(figs.joinpath("02readme.rst"), "plot.png", "A hand-written description.")
+
+    figs.joinpath("plot.png").rename(figs.joinpath("renamed.png"))
+    assert run(index, context).exit_code == ExitCode.NORMAL
+
+    text = figs.joinpath("02readme.rst").read_text()
+    assert "**renamed.png**. A hand-written description." in text
+    assert IMAGE_DIRECTIVE.findall(text) == ["renamed.png"]
+
+
+def test_move_across_depths_rebases_thumbnail(tmp_path, make_project, png, context):
+    index = make_project(tmp_path.joinpath("docs"))
+    figs = index.parent.joinpath("4gr", "folder_figs")
+    deeper = index.parent.joinpath("4gr", "more_figs", "deeper")
+    figs.joinpath("plot.png").write_bytes(png(600, 200))
+    assert run(index, context, thumbnails=True).exit_code == ExitCode.NORMAL
+    describe(figs.joinpath("02readme.rst"), "plot.png", "A hand-written description.")
+    thumbnail = IMAGE_DIRECTIVE.findall(figs.joinpath("02readme.rst").read_text())[0]
+    assert thumbnail.startswith("../../_thumbnails/")
+
+    figs.joinpath("plot.png").rename(deeper.joinpath("plot.png"))
+    assert run(index, context, thumbnails=True).exit_code == ExitCode.NORMAL
+
+    assert "plot.png" not in figs.joinpath("02readme.rst").read_text()
+    text = deeper.joinpath("02readme.rst").read_text()
+    assert "**plot.png**. A hand-written description." in text
+    assert ":download:`Full size image <plot.png>`" in text
+    assert IMAGE_DIRECTIVE.findall(text) == ["../" + thumbnail]
+    assert deeper.joinpath(IMAGE_DIRECTIVE.findall(text)[0]).is_file()
+
+
+def test_move_image_to_shallower_readme(tmp_path):
+    old = tmp_path.joinpath("a", "b", "c", "02readme.rst")
+    new = tmp_path.joinpath("a", "02readme.rst")
+    for path in (old, new):
+        path.parent.mkdir(parents=True, exist_ok=True)
+    old.write_text("c\n#\n\n**img.png**. Text.\n\n.. image:: ../../../_thumbnails/ab/abc-300.png\n   :width: 300\n\n"
+                   ":download:`Full size image <img.png>`\n\n**other.png**. Other.\n\n.. image:: other.png\n   :width: 300\n")
+    new.write_text("a\n#\n\n")
+
+    TemplateEngine().move_image("img.png", "img.png", old, new)
+
+    assert "img.png" not in old.read_text()
+    assert "**other.png**. Other." in old.read_text()
+    text = new.read_text()
+    assert IMAGE_DIRECTIVE.findall(text) == ["../_thumbnails/ab/abc-300.png"]
+    assert ":download:`Full size image <img.png>`" in text
+
+
+def test_rebase_in_text_keeps_image_and_absolute_paths():
+    text = ".. image:: img.png\n\n.. image:: /_static/logo.png\n\n.. image:: ../thumbs/img.png\n"
+    rebased = rebase_in_text(text, Path("/p/a"), Path("/p/a/b"), "img.png")
+    assert IMAGE_DIRECTIVE.findall(rebased) == ["img.png", "/_static/logo.png", "../../thumbs/img.png"]
@@ -0,0 +1,68 @@
+"""Tests for the query server (`pfiga_browser.server`), in process and over its Unix domain socket."""
+# python level imports
+import time
+import threading
+# pytest level imports
+import pytest
+# pfiga-browser level imports
+from pfiga_browser.server import QueryServer, query, serve
+
+
+@pytest.fixture
+def project(tmp_path, make_project):
+    """Return the index of a project with one tracked and one untracked image."""
+    index = make_project(tmp_path.joinpath("docs"))
+    figs = index.parent.joinpath("4gr", "folder_figs")
+    figs.joinpath("02readme.rst").write_text(
+        "folder_figs\n###########\n\n**plot.svg**. A line plot.\n\n.. image:: plot.svg\n   :width: 300\n")
+    figs.joinpath("plot.svg").write_text("<svg/>")
+    figs.joinpath("new.svg").write_text("<svg/>")
+    return index
+
+
+def test_queries(tmp_path, project):
+    server = QueryServer([project], tmp_path.joinpath("cache"))
+    try:
+        figs = project.parent.joinpath("4gr", "folder_figs")
+        assert server.handle({"command": "untracked"})["result"] == {"untracked": [str(figs.joinpath("new.svg"))],
+                                                                      "missing": []}
+        images = server.handle({"command": "images", "folder": "4gr/folder_figs"})["result"]
+        assert [image["name"] for image in images] == ["plot.svg"]
+        found = server.handle({"command": "search", "query": "LINE"})["result"]
+        assert [image["path"] for image in found] == [str(figs.joinpath("plot.svg"))]
+        assert not server.handle({"command": "status"})["result"][0]["changed"]
+
+        # the readme is not touched until the untracked image is applied
+        assert "new.svg" not in figs.joinpath("02readme.rst").read_text()
+        assert server.handle({"command": "apply"})["result"]["untracked"] == 0
+        assert "new.svg" in figs.joinpath("02readme.rst").read_text()
+
+        assert server.handle({"command": "rescan", "subtree": "4gr"})["ok"]
+        assert server.handle({"command": "untracked"})["result"]["untracked"] == []
+
+        assert server.handle({"command": "unknown"}) == {"ok": False, "error": "ValueError: unknown command: 'unknown'"}
+        assert not server.handle({"command": "images", "index": str(tmp_path.joinpath("other.rst")), "folder": "."})["ok"]
+    finally:
+        server.close()
+
+
+def test_socket(tmp_path, project):
+    socket_path = tmp_path.joinpath("s.sock")
+    thread = threading.Thread(target=serve, args=([project], socket_path, tmp_path.joinpath("cache")))
+    thread.start()
+    try:
+        response = None
+        for _ in range(200):
+            response = query(socket_path, {"command": "status"}, timeout=10)
+            if response is not None:
+                break
+            time.sleep(0.05)
+        assert response["ok"] and response["result"][0]["index"] == str(project)
+        assert query(socket_path, {"command": "untracked"}, timeout=10)["result"]["untracked"]
+    finally:
+        query(socket_path, {"command": "shutdown"}, timeout=10)
+        thread.join(10)
+
+    assert not thread.is_alive()
+    assert not socket_path.exists()
+    assert query(socket_path, {"command": "status"}) is None
@@ -0,0 +1,54 @@
+"""Tests for near-duplicate detection (`pfiga_browser.similarity`)."""
+# python level imports
+import random
+from concurrent.futures import ThreadPoolExecutor
+# pytest level imports
+import pytest
+
+np = pytest.importorskip("numpy")
+
+# pfiga-browser level imports
+from pfiga_browser.similarity import BKTree, difference_hash, find_near_duplicates, hamming_distance  # noqa: E402
+from pfiga_browser.thumbnail import encode_png  # noqa: E402
+
+
+def test_bk_tree_matches_brute_force():
+    generator = random.Random(3)
+    values = [generator.getrandbits(16) for _ in range(300)]
+    # values listed twice are stored in one node
+    values += values[:20]
+    tree: BKTree[int] = BKTree()
+    for item, value in enumerate(values):
+        tree.add(value, item)
+
+    for query in [generator.getrandbits(16) for _ in range(30)] + values[:5]:
+        for max_distance in (0, 2, 5):
+            expected = sorted((hamming_distance(query, value), item) for item, value in enumerate(values)
+                              if hamming_distance(query, value) <= max_distance)
+            assert sorted(tree.search(query, max_distance)) == expected
+
+
+def test_empty_tree():
+    assert BKTree().search(0, 64) == []
+
+
+def test_difference_hash():
+    gradient = np.tile(np.arange(0, 250, 25, dtype=np.uint8)[None, :, None], (10, 1, 3))
+    # brightness increases to the right: every pixel is darker than its right neighbour
+    assert difference_hash(gradient) == (1 << 64) - 1
+    assert difference_hash(gradient[:, ::-1]) == 0
+    assert difference_hash(np.clip(gradient.astype(int) + 3, 0, 255).astype(np.uint8)) == (1 << 64) - 1
+
+
+def test_find_near_duplicates(tmp_path, png):
+    pixels = np.random.default_rng(0).integers(0, 256, (32, 40, 3), dtype=np.uint8)
+    tmp_path.joinpath("a.png").write_bytes(encode_png(pixels))
+    # slightly brighter copy: same hash
+    tmp_path.joinpath("b.png").write_bytes(encode_png(np.clip(pixels.astype(int) + 2, 0, 255).astype(np.uint8)))
+    tmp_path.joinpath("c.png").write_bytes(encode_png(pixels[:, ::-1].copy()))
+    tmp_path.joinpath("flat.png").write_bytes(png(40, 32))
+
+    with ThreadPoolExecutor(2) as executor:
+        report = find_near_duplicates(sorted(tmp_path.glob("*.png")), executor=executor)
+
+    assert report.groups == [[tmp_path.joinpath("a.png"), tmp_path.joinpath("b.png")]]
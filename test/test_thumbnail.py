@@ -0,0 +1,88 @@
+"""Tests for PNG decoding and downscaling (`pfiga_browser.thumbnail`)."""
+# python level imports
+import zlib
+import struct
+from typing import List
+# pytest level imports
+import pytest
+
+np = pytest.importorskip("numpy")
+
+# pfiga-browser level imports
+from pfiga_browser.metadata import PNG_SIGNATURE  # noqa: E402
+from pfiga_browser.thumbnail import UnsupportedImageError, decode_png, downscale, encode_png  # noqa: E402
+
+
+def paeth(left: int, above: int, upper_left: int) -> int:
+    """Return the Paeth predictor of a byte (PNG specification, 9.4)."""
+    estimate = left + above - upper_left
+    distances = [abs(estimate - left), abs(estimate - above), abs(estimate - upper_left)]
+    return [left, above, upper_left][distances.index(min(distances))]
+
+
+def filter_rows(rows: np.ndarray, filters: List[int], bpp: int) -> bytes:
+    """Filter the rows of an image with the given filter type per row, byte by byte as described by the PNG specification."""
+    data = bytearray()
+    previous = [0] * rows.shape[1]
+    for row, kind in zip(rows.tolist(), filters):
+        data.append(kind)
+        for x, value in enumerate(row):
+            left = row[x - bpp] if x >= bpp else 0
+            upper_left = previous[x - bpp] if x >= bpp else 0
+            predictor = [0, left, previous[x], (left + previous[x]) // 2, paeth(left, previous[x], upper_left)][kind]
+            data.append((value - predictor) % 256)
+        previous = row
+    return bytes(data)
+
+
+def png(rows: np.ndarray, filters: List[int], width: int, bit_depth: int, color_type: int, bpp: int) -> bytes:
+    """Return a PNG of the given (already packed) rows, filtered with `filters`."""
+    def chunk(kind: bytes, body: bytes) -> bytes:
+        return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body) & 0xFFFFFFFF)
+
+    return PNG_SIGNATURE + chunk(b"IHDR", struct.pack(">IIBBBBB", width, rows.shape[0], bit_depth, color_type, 0, 0, 0)) + \
+        chunk(b"IDAT", zlib.compress(filter_rows(rows, filters, bpp))) + chunk(b"IEND", b"")
+
+
+@pytest.mark.parametrize("filters", [[0] * 6, [1] * 6, [2] * 6, [3] * 6, [4] * 6, [0, 1, 2, 3, 4, 1], [4, 2, 0, 1, 3, 3]])
+@pytest.mark.parametrize("channels", [1, 2, 3, 4])
+def test_unfilter(filters, channels):
+    pixels = np.random.default_rng(len(filters) * channels + sum(filters)).integers(0, 256, (6, 7, channels), dtype=np.uint8)
+    color_type = {1: 0, 2: 4, 3: 2, 4: 6}[channels]
+
+    decoded = decode_png(png(pixels.reshape(6, -1), filters, 7, 8, color_type, channels))
+
+    assert np.array_equal(decoded, pixels)
+
+
+def test_sixteen_bit_and_sub_byte_samples():
+    pixels = np.random.default_rng(1).integers(0, 256, (5, 3, 3), dtype=np.uint8)
+    wide = np.stack([pixels, np.full_like(pixels, 7)], axis=-1).reshape(5, -1)
+    assert np.array_equal(decode_png(png(wide, [4, 3, 1, 2, 0], 3, 16, 2, 6)), pixels)
+
+    # 2-bit grayscale, 5 pixels per row (2 bytes): samples are scaled to the 8-bit range
+    samples = np.array([[0, 1, 2, 3, 1], [3, 3, 0, 0, 2]], dtype=np.uint8)
+    packed = np.packbits(np.unpackbits(samples[..., None], axis=2)[..., 6:].reshape(2, -1), axis=1)
+    assert np.array_equal(decode_png(png(packed, [3, 4], 5, 2, 0, 1))[..., 0], samples * 85)
+
+
+def test_invalid_png():
+    with pytest.raises(UnsupportedImageError):
+        decode_png(b"GIF89a")
+    data = bytearray(png(np.zeros((2, 3), dtype=np.uint8), [0, 0], 3, 8, 0, 1))
+    # the filter byte of the first row is the first byte of the (stored) IDAT data
+    data = data.replace(zlib.compress(b"\0\0\0\0\0\0\0\0"), zlib.compress(b"\5\0\0\0\0\0\0\0"))
+    with pytest.raises(UnsupportedImageError):
+        decode_png(bytes(data))
+
+
+def test_encode_round_trip_and_downscale():
+    pixels = np.zeros((4, 8, 3), dtype=np.uint8)
+    pixels[:, ::2] = 200
+    assert np.array_equal(decode_png(encode_png(pixels)), pixels)
+
+    # area averaging: every pair of columns becomes one pixel of their mean
+    small = downscale(pixels, 4)
+    assert small.shape == (2, 4, 3)
+    assert np.all(small == 100)
+    assert downscale(pixels, 16) is pixels
@@ -0,0 +1,42 @@
+"""Tests for the toctree traversal (`pfiga_browser.traversal.TocTreeWalker`)."""
+# python level imports
+from pathlib import Path
+# pfiga-browser level imports
+from pfiga_browser.traversal import TocTreeWalker
+
+
+def test_walk_is_breadth_first(tmp_path, make_project):
+    index = make_project(tmp_path.joinpath("docs"))
+
+    walker = TocTreeWalker(index)
+    paths = [document.path.relative_to(index.parent).as_posix() for document in walker.walk()]
+
+    assert paths == ["index.rst", "4gr/01readme.rst", "4gr/folder_figs/02readme.rst", "4gr/more_figs/deeper/02readme.rst"]
+    assert [document.depth for document in walker.documents.values()] == [0, 1, 2, 2]
+    assert not walker.missing and not walker.truncated and not walker.cycles
+
+
+def test_use_maxdepth_truncates(tmp_path, make_project):
+    index = make_project(tmp_path.joinpath("docs"))
+    index.write_text(index.read_text().replace(":maxdepth: 2", ":maxdepth: 1"))
+
+    unlimited = TocTreeWalker(index)
+    list(unlimited.walk())
+    limited = TocTreeWalker(index, use_maxdepth=True)
+    list(limited.walk())
+
+    assert len(unlimited.documents) == 4
+    assert [path.name for path in limited.documents] == ["index.rst", "01readme.rst"]
+    assert {path.parent.name for path in limited.truncated} == {"folder_figs", "deeper"}
+
+
+def test_missing_and_cycles(tmp_path, make_project):
+    index = make_project(tmp_path.joinpath("docs"))
+    readme = index.parent.joinpath("4gr", "01readme.rst")
+    readme.write_text(readme.read_text() + "   gone/02readme.rst\n   ../index.rst\n")
+
+    walker = TocTreeWalker(index)
+    list(walker.walk())
+
+    assert walker.missing == [(readme, readme.parent.joinpath("gone", "02readme.rst"))]
+    assert walker.cycles == [(readme, Path(index))]